@@ -0,0 +1,113 @@
+import subprocess
+
+
+def ffmpeg_remux(h264_path, mp4_path, framerate):
+    """
+    Packages a raw H.264 stream as an MP4 with ffmpeg, without re-encoding.
+
+    Args:
+        h264_path: Path of the H.264 elementary stream.
+        mp4_path: Path of the MP4 to write.
+        framerate: Frame rate the stream was recorded at.
+    """
+    subprocess.run(
+        [
+            "ffmpeg",
+            "-loglevel",
+            "warning",
+            "-y",
+            "-framerate",
+            "%.3f" % framerate,
+            "-i",
+            h264_path,
+            "-c",
+            "copy",
+            mp4_path,
+        ],
+        check=True,
+    )
+
+
+class CameraBackend:
+    """
+    Bundles the camera class and the encoder/output classes of one camera backend.
+    CameraCoreModel and the utilities only ever reach the camera stack through
+    one of these, so the real Picamera2 stack can be swapped for the simulated one.
+    """
+
+    def __init__(
+        self,
+        name,
+        camera_class,
+        h264_encoder,
+        jpeg_encoder,
+        file_output,
+        ffmpeg_output,
+        mapped_array,
+        remux,
+    ):
+        self.name = name
+        self.camera_class = camera_class  # Picamera2-compatible camera class.
+        self.h264_encoder = h264_encoder  # H264Encoder-compatible class.
+        self.jpeg_encoder = jpeg_encoder  # JpegEncoder-compatible class.
+        self.file_output = file_output  # FileOutput-compatible class.
+        self.ffmpeg_output = ffmpeg_output  # FfmpegOutput-compatible class.
+        self.mapped_array = mapped_array  # MappedArray-compatible class.
+        self.remux = remux  # Function packaging an H.264 file as an MP4.
+
+    def global_camera_info(self):
+        """Returns the list of attached cameras as reported by the camera class."""
+        return self.camera_class.global_camera_info()
+
+
+BACKEND_NAMES = ["picamera2", "simulated"]
+
+
+def load_backend(name="picamera2"):
+    """
+    Imports and returns the camera backend with the given name.
+    Imports are done here rather than at module level so that the simulated
+    backend can run on machines without libcamera/Picamera2 installed.
+
+    Args:
+        name: One of BACKEND_NAMES.
+    Returns:
+        CameraBackend instance.
+    """
+    if name == "picamera2":
+        from picamera2 import MappedArray, Picamera2
+        from picamera2.encoders import H264Encoder, JpegEncoder
+        from picamera2.outputs import FileOutput, FfmpegOutput
+
+        return CameraBackend(
+            name,
+            Picamera2,
+            H264Encoder,
+            JpegEncoder,
+            FileOutput,
+            FfmpegOutput,
+            MappedArray,
+            ffmpeg_remux,
+        )
+    elif name == "simulated":
+        from core.simulated import (
+            SimulatedPicamera2,
+            SimulatedH264Encoder,
+            SimulatedJpegEncoder,
+            SimulatedFileOutput,
+            SimulatedFfmpegOutput,
+            SimulatedMappedArray,
+            simulated_remux,
+        )
+
+        return CameraBackend(
+            name,
+            SimulatedPicamera2,
+            SimulatedH264Encoder,
+            SimulatedJpegEncoder,
+            SimulatedFileOutput,
+            SimulatedFfmpegOutput,
+            SimulatedMappedArray,
+            simulated_remux,
+        )
+    raise ValueError("Unknown camera backend: " + str(name))
@@ -0,0 +1,92 @@
+import os
+
+# Files each camera needs its own copy of when several run at once.
+CAMERA_FILES = [
+    "control_file",
+    "status_file",
+    "motion_pipe",
+    "preview_path",
+    "log_file",
+    "motion_logfile",
+    "remux_queue",
+    "media_index",
+    "stats_file",
+]
+
+# Output paths whose files go in a folder of their own for each camera.
+CAMERA_DIRS = ["image_output_path", "lapse_output_path", "video_output_path"]
+
+
+def camera_file(path, num):
+    """Returns path with the camera number added before its extension."""
+    base, ext = os.path.splitext(path)
+    return base + "_cam" + str(num) + ext
+
+
+def camera_paths(config, num):
+    """
+    Works out the files and folders camera 'num' uses when several cameras
+    run at once, so they don't share any: '/tmp/FIFO' becomes
+    '/tmp/FIFO_cam1', and media is saved to a 'cam1' folder inside each media
+    folder. A preview stream or metrics server on a port is moved up by the
+    camera number.
+    Each camera gets a status socket, whether or not one is configured.
+
+    Args:
+        config: Config read from the config files.
+        num: Number of the camera.
+
+    Returns:
+        Dict of the config settings to change for the camera.
+    """
+    paths = {}
+    for key in CAMERA_FILES:
+        if config.get(key):
+            paths[key] = camera_file(config[key], num)
+    for key in CAMERA_DIRS:
+        folder, name = os.path.split(config[key])
+        paths[key] = os.path.join(folder, "cam" + str(num), name)
+    paths["media_path"] = os.path.join(config["media_path"], "cam" + str(num))
+    # Every camera has a status socket, so its status can be followed.
+    status_socket = config.get("status_socket")
+    if not status_socket:
+        status_socket = os.path.splitext(config["status_file"])[0] + ".sock"
+    paths["status_socket"] = camera_file(status_socket, num)
+    for key in ["preview_stream", "metrics_socket"]:
+        address = config.get(key)
+        if not address:
+            continue
+        host, _, port = str(address).rpartition(":")
+        if port.isdigit():
+            port = str(int(port) + num)
+            paths[key] = host + ":" + port if host else port
+        else:
+            paths[key] = camera_file(address, num)
+    return paths
+
+
+def select_cameras(setting, all_cameras):
+    """
+    Picks the cameras to run from the 'cameras' setting.
+
+    Args:
+        setting: 'all', camera numbers separated by commas, or None for the
+                 first camera only.
+        all_cameras: Attached cameras, as from global_camera_info().
+
+    Returns:
+        List of the numbers of the cameras to run.
+    """
+    attached = [camera["Num"] for camera in all_cameras]
+    if not setting:
+        return attached[:1]
+    if setting == "all":
+        return attached
+    selected = []
+    for num in setting.split(","):
+        num = num.strip()
+        if num.isdigit() and (int(num) in attached):
+            selected.append(int(num))
+        else:
+            print("Camera not attached, skipping: " + num)
+    return selected
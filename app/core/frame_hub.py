@@ -0,0 +1,238 @@
+import threading
+from collections import deque
+
+
+class SharedFrame:
+    """
+    A captured request shared between several consumers. Each holder owns one
+    reference and calls release() when done with it; the request itself is
+    handed back to the camera when the last reference is released.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self._refs = 1  # The hub's own reference, dropped once it has fanned out.
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Takes an extra reference to the frame and returns it."""
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        """Drops a reference, releasing the request once nobody holds it."""
+        with self._lock:
+            self._refs -= 1
+            done = self._refs == 0
+        if done:
+            self.request.release()
+
+
+class FrameSubscription:
+    """
+    One consumer's view of the frames captured by a FrameHub.
+    With the 'latest' policy only the newest frame is kept and any frame the
+    consumer has not picked up yet is dropped. With the 'queue' policy up to
+    'maxlen' frames are kept and the oldest is dropped when full. Either way the
+    hub never waits for a slow consumer.
+    """
+
+    LATEST = "latest"
+    QUEUE = "queue"
+
+    def __init__(self, name, policy=LATEST, maxlen=4):
+        if policy not in [self.LATEST, self.QUEUE]:
+            raise ValueError("Unknown frame drop policy: " + str(policy))
+        self.name = name
+        self.policy = policy
+        self.maxlen = 1 if policy == self.LATEST else maxlen
+        self.delivered = 0  # Frames handed to the consumer.
+        self.dropped = 0  # Frames discarded before the consumer got to them.
+        self.closed = False
+        self._frames = deque()
+        self._cond = threading.Condition()
+
+    def push(self, frame):
+        """Called by the hub to offer a new frame to this consumer."""
+        with self._cond:
+            if self.closed:
+                return
+            while len(self._frames) >= self.maxlen:
+                self._frames.popleft().release()
+                self.dropped += 1
+            self._frames.append(frame.acquire())
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """
+        Waits for the next frame for this consumer. The caller must release()
+        the returned frame when done with it.
+
+        Returns:
+            SharedFrame, or None on timeout or once the subscription is closed.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._frames or self.closed, timeout)
+            if not self._frames:
+                return None
+            self.delivered += 1
+            return self._frames.popleft()
+
+    def clear(self):
+        """Releases any frames still waiting to be picked up."""
+        with self._cond:
+            while self._frames:
+                self._frames.popleft().release()
+                self.dropped += 1
+
+    def close(self):
+        """Stops receiving frames and releases any still waiting to be picked up."""
+        with self._cond:
+            self.closed = True
+            while self._frames:
+                self._frames.popleft().release()
+            self._cond.notify_all()
+
+
+class FrameHub:
+    """
+    Captures each camera request once, from its own thread, and fans it out to
+    every subscribed consumer (preview, motion detection, stills, ...) so they
+    all share one frame instead of each doing their own capture round-trip.
+    Nothing is captured while there are no subscribers. If capturing fails,
+    the hub stops and closes every subscription, so consumers find out
+    straight away instead of waiting on frames that will never come.
+    """
+
+    def __init__(self, capture, on_error=None, on_first_frame=None):
+        """
+        Args:
+            capture: Function returning the next completed request, e.g.
+                     CameraCoreModel.capture_request.
+            on_error: Function called with the exception if capturing fails.
+            on_first_frame: Function called with no arguments once the first
+                            frame after each start() is captured.
+        """
+        self.capture = capture
+        self.on_error = on_error
+        self.on_first_frame = on_first_frame
+        self.running = False
+        self.captured = 0  # Number of requests captured since creation.
+        self.error = None  # Why capturing last failed, until the hub is restarted.
+        self._subscriptions = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def subscribe(self, name, policy=FrameSubscription.LATEST, maxlen=4):
+        """Registers a consumer and returns its FrameSubscription."""
+        subscription = FrameSubscription(name, policy, maxlen)
+        with self._cond:
+            if self.error is None:
+                self._subscriptions.append(subscription)
+                self._cond.notify_all()
+                return subscription
+        subscription.close()  # Nothing will be captured until a restart.
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Removes a consumer, releasing any frames it had not picked up."""
+        with self._cond:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        subscription.close()
+
+    def next_frame(self, timeout=None):
+        """
+        Returns the next frame captured, for one-off consumers such as stills.
+        The caller must release() the returned frame.
+        """
+        subscription = self.subscribe("oneshot")
+        frame = subscription.get(timeout)
+        self.unsubscribe(subscription)
+        return frame
+
+    def stats(self):
+        """Returns per-consumer delivery and drop counts."""
+        with self._cond:
+            subscriptions = list(self._subscriptions)
+        consumers = {}
+        for subscription in subscriptions:
+            consumers[subscription.name] = {
+                "policy": subscription.policy,
+                "delivered": subscription.delivered,
+                "dropped": subscription.dropped,
+            }
+        return {"captured": self.captured, "consumers": consumers}
+
+    def start(self):
+        """Starts the capture thread. The camera must already be started."""
+        with self._cond:
+            if self.running:
+                return
+            self.running = True
+            self.error = None
+        self._thread = threading.Thread(target=self._capture_loop)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the capture thread, waiting for any capture in progress to finish.
+        Must be called while the camera is still started.
+        """
+        with self._cond:
+            if not self.running:
+                return
+            self.running = False
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def release_pending(self):
+        """
+        Releases every frame not yet picked up by its consumer, so the camera
+        gets its buffers back while the hub is stopped.
+        """
+        with self._cond:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.clear()
+
+    def _capture_loop(self):
+        first = True
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscriptions or not self.running)
+                if not self.running:
+                    break
+            try:
+                request = self.capture()
+            except Exception as e:
+                self._fail(e)
+                return
+            self.captured += 1
+            if first:
+                first = False
+                if self.on_first_frame:
+                    self.on_first_frame()
+            frame = SharedFrame(request)
+            with self._cond:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                subscription.push(frame)
+            frame.release()  # Drop the hub's reference.
+        with self._cond:
+            self.running = False
+
+    def _fail(self, error):
+        """Stops the hub after a failed capture, closing every subscription."""
+        print("ERROR: Frame capture failed. " + str(error))
+        with self._cond:
+            self.running = False
+            self.error = error
+            subscriptions = list(self._subscriptions)
+            self._subscriptions.clear()
+        for subscription in subscriptions:
+            subscription.close()
+        if self.on_error:
+            self.on_error(error)
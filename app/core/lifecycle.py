@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import deque
+
+
+class CameraLifecycle:
+    """
+    State machine for the camera pipeline. 'ru 0' puts it in standby instead
+    of tearing it down: the camera stays configured with its buffers
+    allocated (and, in warm standby, keeps streaming), and the preview and
+    motion threads wait on the lifecycle instead of exiting. 'ru 1' then only
+    has to start frames flowing again.
+
+    Halt and resume latencies are kept for the last few transitions. Resume
+    latency runs from the resume until the first frame is captured after it.
+    """
+
+    STOPPED = "stopped"  # Not started yet, e.g. without autostart.
+    RUNNING = "running"
+    STANDBY = "standby"  # Halted with 'ru 0', ready to resume.
+    CLOSED = "closed"  # Shutting down, threads waiting on it exit.
+
+    TRANSITIONS = {
+        STOPPED: [RUNNING, STANDBY, CLOSED],
+        RUNNING: [STANDBY, CLOSED],
+        STANDBY: [RUNNING, CLOSED],
+        CLOSED: [],
+    }
+
+    HISTORY = 32  # Latencies kept of each kind.
+
+    def __init__(self):
+        self.state = self.STOPPED
+        self.halt_times = deque(maxlen=self.HISTORY)  # Seconds per halt.
+        self.resume_times = deque(maxlen=self.HISTORY)  # Seconds per resume.
+        self._resume_from = None  # When the resume waiting for a frame began.
+        self._cond = threading.Condition()
+
+    @property
+    def running(self):
+        return self.state == self.RUNNING
+
+    def transition(self, state):
+        """
+        Moves to a new state, waking any thread waiting on the lifecycle.
+        Moving to the current state does nothing.
+
+        Raises:
+            ValueError: If the lifecycle can't move to state from its current one.
+        """
+        with self._cond:
+            if state == self.state:
+                return
+            if state not in self.TRANSITIONS[self.state]:
+                raise ValueError(
+                    "Can't go from camera state " + self.state + " to " + state
+                )
+            if state == self.RUNNING:
+                self._resume_from = time.monotonic()
+            self.state = state
+            self._cond.notify_all()
+
+    def wait_until_running(self, timeout=None):
+        """
+        Waits while the camera is stopped or in standby.
+
+        Returns:
+            Whether the camera is running, False on timeout or once closed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.state in [self.RUNNING, self.CLOSED], timeout
+            )
+            return self.state == self.RUNNING
+
+    def record_halt(self, seconds):
+        self.halt_times.append(seconds)
+
+    def first_frame(self):
+        """
+        Called as each frame hub start captures its first frame.
+
+        Returns:
+            Seconds since the camera was set running, or None if it was
+            already measured.
+        """
+        with self._cond:
+            if self._resume_from is None:
+                return None
+            latency = time.monotonic() - self._resume_from
+            self._resume_from = None
+        self.resume_times.append(latency)
+        return latency
+
+    @staticmethod
+    def _summary(times):
+        times = list(times)
+        if not times:
+            return {"count": 0, "last_ms": None, "mean_ms": None, "max_ms": None}
+        return {
+            "count": len(times),
+            "last_ms": times[-1] * 1000,
+            "mean_ms": sum(times) / len(times) * 1000,
+            "max_ms": max(times) * 1000,
+        }
+
+    def stats(self):
+        """Returns the state and the recent halt and resume latencies."""
+        return {
+            "state": self.state,
+            "halt": self._summary(self.halt_times),
+            "resume": self._summary(self.resume_times),
+        }
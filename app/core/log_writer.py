@@ -0,0 +1,138 @@
+import fcntl
+import os
+import threading
+from collections import deque
+from datetime import datetime
+
+
+def timestamped(message):
+    """Returns a log line for message, with the time in {} as RaspiMJPEG writes it."""
+    return "{" + datetime.now().strftime("%Y/%m/%d %H:%M:%S") + "} " + message + "\n"
+
+
+class LogWriter:
+    """
+    Writes log messages from a background thread, so threads logging never
+    wait on the disk. Messages are timestamped when they are logged and put on
+    a deque, which appends and pops safely across threads without a lock;
+    everything waiting is then written in one go per file.
+
+    A file given a line limit (RaspiMJPEG's log_size) is cut back to its
+    newest half of that many lines whenever it grows past it. The log file is
+    shared with RPi Cam Web Interface's scheduler, so the lines are counted
+    from the file itself when it is first written and each time it is cut.
+    """
+
+    def __init__(self):
+        self.written = 0  # Lines written.
+        self.trims = 0  # Times a file was cut back to its line limit.
+        self._messages = deque()  # (path, line, line limit) waiting to be written.
+        self._wake = threading.Event()
+        self._lines = {}  # Lines in each file written, as far as is known.
+        self._stopping = False
+        self._thread = None
+        self._lock = threading.Lock()  # Only taken to start or stop the thread.
+
+    def log(self, path, message, max_lines=0):
+        """
+        Queues a message to be written to the file at path.
+
+        Args:
+            path: Path of the log file.
+            message: Message, without its timestamp or newline.
+            max_lines: Most lines to keep in the file, 0 for no limit.
+        """
+        self._messages.append((path, timestamped(message), max_lines))
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stopping = False
+                    self._thread = threading.Thread(target=self._work, daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def _work(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            batches = {}  # Lines and line limit for each file, in order.
+            while self._messages:
+                path, line, max_lines = self._messages.popleft()
+                batch = batches.setdefault(path, [[], max_lines])
+                batch[0].append(line)
+                batch[1] = max_lines
+            for path, (lines, max_lines) in batches.items():
+                self._write(path, lines, max_lines)
+            if self._stopping and not self._messages:
+                break
+
+    def _write(self, path, lines, max_lines):
+        try:
+            if max_lines and (path not in self._lines):
+                self._lines[path] = self._count_lines(path)
+            with open(path, "a") as log_file:
+                log_file.writelines(lines)
+            self.written += len(lines)
+            if max_lines:
+                self._lines[path] += len(lines)
+                if self._lines[path] > max_lines:
+                    self._trim(path, max_lines // 2)
+        except OSError as e:
+            print("ERROR: Failed to write to log " + path + ": " + str(e))
+
+    @staticmethod
+    def _count_lines(path):
+        if not os.path.exists(path):
+            return 0
+        with open(path, "rb") as log_file:
+            return sum(1 for _ in log_file)
+
+    def _trim(self, path, keep):
+        """
+        Cuts a file back to its newest 'keep' lines in place, under flock().
+        The file isn't replaced, as the scheduler may hold it open to append
+        to. Lines appended while it is cut are carried over, so only a write
+        landing between the last read and the truncate could be lost, and
+        none from writers that flock() the file.
+        """
+        with open(path, "r+b") as log_file:
+            fcntl.flock(log_file, fcntl.LOCK_EX)
+            try:
+                lines = log_file.readlines()
+                end = log_file.tell()
+                kept = b"".join(lines[-keep:] if keep else [])
+                log_file.seek(0)
+                log_file.write(kept)
+                size = len(kept)
+                while True:
+                    log_file.seek(end)
+                    appended = log_file.read()
+                    if not appended:
+                        break
+                    end += len(appended)
+                    log_file.seek(size)
+                    log_file.write(appended)
+                    size += len(appended)
+                    kept += appended
+                log_file.truncate(size)
+            finally:
+                fcntl.flock(log_file, fcntl.LOCK_UN)
+        self._lines[path] = kept.count(b"\n")
+        self.trims += 1
+
+    def stats(self):
+        """Returns the number of lines waiting and written, and files cut back."""
+        return {
+            "depth": len(self._messages),
+            "written": self.written,
+            "trims": self.trims,
+        }
+
+    def stop(self):
+        """Writes everything still queued, then stops the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopping = True
+        if thread is not None:
+            self._wake.set()
+            thread.join()
@@ -0,0 +1,205 @@
+import json
+import os
+import threading
+
+
+class MediaIndex:
+    """
+    Index of the media files that have thumbnails, kept in a file of JSON
+    lines so the next image and video indexes don't need a scan of every file
+    on each start. Entries are appended as thumbnails are made, and a
+    checkpoint with the next indexes and the media folders' modification
+    times is appended when the program stops. On start, only the end of the
+    file is read for that checkpoint. If it is missing (the program didn't
+    stop cleanly) or the folders have changed since (files were added or
+    deleted while it wasn't running), the index is rebuilt from one scan of
+    the folders.
+
+    Entries are only read in when the index is first queried, so other
+    components can look up counts, sizes and the newest and oldest file of
+    each type without rescanning.
+    """
+
+    TAIL_BYTES = 4096  # Read from the end of the file for the last checkpoint.
+
+    def __init__(self, path, dirs):
+        """
+        Args:
+            path: Path of the index file.
+            dirs: Folders holding the media files and their thumbnails.
+        """
+        self.path = path
+        self.dirs = sorted(set(dirs))
+        self.rebuilt = False  # Whether the index had to be rebuilt on load.
+        self._entries = None  # Media path -> entry, once read in.
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns:
+            (next image index, next video index), from the last checkpoint,
+            or from rebuilding the index if it is stale.
+        """
+        checkpoint = self._last_checkpoint()
+        if checkpoint and (checkpoint["dirs"] == self._dir_times()):
+            return tuple(checkpoint["next"])
+        return self.rebuild()
+
+    def _dir_times(self):
+        return dict((d, os.stat(d).st_mtime_ns) for d in self.dirs if os.path.isdir(d))
+
+    def _last_checkpoint(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, "rb") as index_file:
+            index_file.seek(0, os.SEEK_END)
+            index_file.seek(max(index_file.tell() - self.TAIL_BYTES, 0))
+            lines = index_file.read().splitlines()
+        if not lines:
+            return None
+        try:
+            last = json.loads(lines[-1])
+        except ValueError:
+            return None  # Cut short by a crash.
+        return last if "checkpoint" in last else None
+
+    def rebuild(self):
+        """
+        Rebuilds the index from the thumbnails in the media folders.
+        RaspiMJPEG finds the file counts this way too, by not actually looking
+        at the files themselves, but instead their thumbnails and extracting
+        the type/count from their filenames, taking the highest number of each.
+
+        Returns:
+            (next image index, next video index), one greater than the last
+            existing counts. Images and timelapse sequences share a count.
+        """
+        entries = {}
+        for d in self.dirs:
+            if not os.path.isdir(d):
+                continue
+            with os.scandir(d) as files:
+                names = dict((f.name, f) for f in files)
+            for name in names:
+                # If the extensionless filename ends with '.th', it is a thumbnail.
+                file_without_ext = os.path.splitext(name)[0]
+                if not file_without_ext.endswith(".th"):
+                    continue
+                # Attempt to strip the type+count portion off.
+                without_th = os.path.splitext(file_without_ext)[0]
+                media_name, typecount = os.path.splitext(without_th)
+                filetype = typecount[1:2]
+                filecount = typecount[2:]
+                # Skip any invalid files.
+                if (filetype not in ["i", "t", "v"]) or (not filecount.isdigit()):
+                    continue
+                size, mtime = 0, names[name].stat().st_mtime
+                if media_name in names:
+                    stat = names[media_name].stat()
+                    size, mtime = stat.st_size, stat.st_mtime
+                media_path = os.path.join(d, media_name)
+                entries[media_path] = self._entry(
+                    filetype, int(filecount), media_path, size, mtime
+                )
+        with self._lock:
+            self._entries = entries
+            part_path = self.path + ".part"
+            with open(part_path, "w") as index_file:
+                for entry in entries.values():
+                    index_file.write(json.dumps(entry) + "\n")
+            os.replace(part_path, self.path)
+        self.rebuilt = True
+        counts = self.summary()
+        image_count = max(counts["i"]["last_count"], counts["t"]["last_count"])
+        return image_count + 1, counts["v"]["last_count"] + 1
+
+    @staticmethod
+    def _entry(filetype, count, media_path, size, mtime):
+        return {
+            "type": filetype,
+            "count": count,
+            "path": media_path,
+            "size": size,
+            "time": mtime,
+        }
+
+    def _append(self, record):
+        """Appends a record to the file, and to the entries if read in. Call with the lock held."""
+        with open(self.path, "a") as index_file:
+            index_file.write(json.dumps(record) + "\n")
+        if (self._entries is not None) and ("checkpoint" not in record):
+            if "type" in record:
+                self._entries[record["path"]] = record
+            elif record["path"] in self._entries:
+                self._entries[record["path"]]["size"] = record["size"]
+
+    def add(self, filetype, count, media_path):
+        """Indexes a media file as its thumbnail is made."""
+        size, mtime = 0, None
+        if os.path.exists(media_path):
+            stat = os.stat(media_path)
+            size, mtime = stat.st_size, stat.st_mtime
+        with self._lock:
+            self._append(self._entry(filetype, count, media_path, size, mtime))
+
+    def update_size(self, media_path):
+        """Records the size of an indexed file once it is finished, e.g. made into an MP4."""
+        if os.path.exists(media_path):
+            with self._lock:
+                self._append({"path": media_path, "size": os.path.getsize(media_path)})
+
+    def close(self, next_image, next_video):
+        """Appends the checkpoint read by the next load()."""
+        with self._lock:
+            self._append(
+                {
+                    "checkpoint": True,
+                    "next": [next_image, next_video],
+                    "dirs": self._dir_times(),
+                }
+            )
+
+    def _read_entries(self):
+        """Reads in every entry from the file. Call with the lock held."""
+        entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as index_file:
+                for line in index_file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # Cut short by a crash.
+                    if "type" in record:
+                        entries[record["path"]] = record
+                    elif ("size" in record) and (record["path"] in entries):
+                        entries[record["path"]]["size"] = record["size"]
+        return entries
+
+    def entries(self, filetype=None):
+        """Returns the entries of the given type ('i', 't' or 'v'), or of every type."""
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._read_entries()
+            return [
+                dict(entry)
+                for entry in self._entries.values()
+                if filetype in [None, entry["type"]]
+            ]
+
+    def summary(self):
+        """
+        Returns:
+            For each type, the number of files, their total size in bytes,
+            the highest count and the newest and oldest file by count.
+        """
+        summary = {}
+        for filetype in ["i", "t", "v"]:
+            entries = sorted(self.entries(filetype), key=lambda e: e["count"])
+            summary[filetype] = {
+                "files": len(entries),
+                "bytes": sum(entry["size"] for entry in entries),
+                "last_count": entries[-1]["count"] if entries else 0,
+                "newest": entries[-1]["path"] if entries else None,
+                "oldest": entries[0]["path"] if entries else None,
+            }
+        return summary
@@ -0,0 +1,371 @@
+import bisect
+import functools
+import http.server
+import json
+import os
+import re
+import socketserver
+import threading
+import time
+
+from core.preview_stream import parse_stream_address
+
+# Upper bounds of the buckets times are counted in, in seconds.
+TIME_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# Upper bounds of the buckets queue depths are counted in.
+DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+
+class Histogram:
+    """
+    Counts values into fixed buckets, as a Prometheus histogram, along with
+    their sum, the largest and the last. Recording a value is a bisect and a
+    few additions, so it can be done for every frame.
+    """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # The last is for anything larger.
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.last = value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q):
+        """
+        Returns an upper bound on the q-th quantile: the upper bound of the
+        bucket it falls in, or the largest value if that is smaller.
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self, scale=1.0, unit=""):
+        """
+        Returns the count, and the mean, quantiles, largest and last value
+        multiplied by scale, named with unit as a suffix.
+        """
+        with self._lock:
+            summary = {"count": self.count}
+            if self.count:
+                summary["mean" + unit] = scale * self.sum / self.count
+                summary["p50" + unit] = scale * self.quantile(0.5)
+                summary["p99" + unit] = scale * self.quantile(0.99)
+                summary["max" + unit] = scale * self.max
+                summary["last" + unit] = scale * self.last
+            return summary
+
+
+class Timer:
+    """Context manager adding the time spent inside it to a histogram."""
+
+    __slots__ = ["histogram", "start"]
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start)
+
+
+class Metrics:
+    """
+    Collects the camera's performance counters: histograms of how long each
+    stage of the pipeline takes, timed with timer() or @timed, and the
+    stats() of the workers and queues, added with add_source() and read
+    only when a snapshot is taken.
+    """
+
+    def __init__(self):
+        self.timings = {}  # Name -> Histogram of seconds.
+        self.depths = {}  # Name -> Histogram of queue depths.
+        self.sources = {}  # Name -> function returning a stats dict, or None.
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _histogram(self, histograms, name, buckets):
+        histogram = histograms.get(name)
+        if histogram is None:
+            with self._lock:
+                histogram = histograms.setdefault(name, Histogram(buckets))
+        return histogram
+
+    def timer(self, name):
+        """Returns a context manager timing the code inside it as stage 'name'."""
+        return Timer(self._histogram(self.timings, name, TIME_BUCKETS))
+
+    def observe(self, name, seconds):
+        """Records a time for stage 'name' measured by the caller."""
+        self._histogram(self.timings, name, TIME_BUCKETS).observe(seconds)
+
+    def observe_depth(self, name, depth):
+        """Records the depth of queue 'name'."""
+        self._histogram(self.depths, name, DEPTH_BUCKETS).observe(depth)
+
+    def add_source(self, name, stats):
+        """Adds a function whose stats dict (or None) is included in snapshots."""
+        self.sources[name] = stats
+
+    def snapshot(self):
+        """
+        Returns every counter as a dict: times in milliseconds under
+        'timings', queue depths under 'depths', and each source's stats.
+        """
+        snapshot = {
+            "uptime": time.monotonic() - self.started,
+            "timings": dict(
+                (name, histogram.summary(1000, "_ms"))
+                for name, histogram in sorted(self.timings.items())
+            ),
+            "depths": dict(
+                (name, histogram.summary())
+                for name, histogram in sorted(self.depths.items())
+            ),
+        }
+        for name, stats in sorted(self.sources.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                print("ERROR: Failed to read " + name + " stats. " + str(e))
+                continue
+            if values is not None:
+                snapshot[name] = values
+        return snapshot
+
+    def prometheus(self):
+        """Returns every counter in the Prometheus text format."""
+        lines = []
+        for name, histogram in sorted(self.timings.items()):
+            lines += histogram_lines("raspycam_" + name + "_seconds", histogram)
+        for name, histogram in sorted(self.depths.items()):
+            lines += histogram_lines("raspycam_" + name + "_depth", histogram)
+        snapshot = self.snapshot()
+        lines.append("# TYPE raspycam_uptime_seconds gauge")
+        lines.append("raspycam_uptime_seconds %g" % snapshot["uptime"])
+        for name in sorted(self.sources):
+            if name in snapshot:
+                lines += gauge_lines("raspycam_" + name, snapshot[name])
+        return "\n".join(lines) + "\n"
+
+
+def histogram_lines(name, histogram):
+    """Returns the Prometheus text lines for a histogram."""
+    with histogram._lock:
+        counts = list(histogram.counts)
+        total, count = histogram.sum, histogram.count
+    lines = ["# TYPE " + name + " histogram"]
+    cumulative = 0
+    for bound, bucket in zip(histogram.buckets, counts):
+        cumulative += bucket
+        lines.append('%s_bucket{le="%g"} %d' % (name, bound, cumulative))
+    lines.append('%s_bucket{le="+Inf"} %d' % (name, count))
+    lines.append("%s_sum %g" % (name, total))
+    lines.append("%s_count %d" % (name, count))
+    return lines
+
+
+def gauge_lines(name, value):
+    """
+    Returns the Prometheus text lines for a stats value, with nested dicts
+    flattened into the name. Strings (such as the lifecycle state) become
+    a gauge of 1 labelled with the string.
+    """
+    name = re.sub(r"[^a-zA-Z0-9_]", "_", name)
+    if isinstance(value, dict):
+        lines = []
+        for key, item in value.items():
+            lines += gauge_lines(name + "_" + str(key), item)
+        return lines
+    if isinstance(value, bool):
+        value = int(value)
+    if isinstance(value, (int, float)):
+        return ["# TYPE " + name + " gauge", "%s %g" % (name, value)]
+    if isinstance(value, str):
+        label = value.replace("\\", "\\\\").replace('"', '\\"')
+        return ["# TYPE " + name + " gauge", '%s{value="%s"} 1' % (name, label)]
+    return []
+
+
+def timed(name):
+    """
+    Decorator timing each call of a function whose first argument is the
+    CameraCoreModel, as stage 'name' of cam.metrics.
+    """
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(cam, *args, **kwargs):
+            start = time.monotonic()
+            try:
+                return function(cam, *args, **kwargs)
+            finally:
+                cam.metrics.observe(name, time.monotonic() - start)
+
+        return wrapper
+
+    return decorate
+
+
+class StatsWriter:
+    """
+    Rewrites the stats file with a JSON snapshot of the camera's metrics
+    every stats_interval seconds, in one go so it is never read half
+    written, until stopped.
+    """
+
+    def __init__(self, cam):
+        self.cam = cam
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._work)
+
+    def start(self):
+        self._thread.start()
+
+    def write(self):
+        """Writes the stats file straight away."""
+        path = self.cam.config["stats_file"]
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            part_path = path + ".part"
+            with open(part_path, "w") as stats_file:
+                json.dump(self.cam.metrics.snapshot(), stats_file, indent=1)
+            os.replace(part_path, path)
+        except OSError as e:
+            print("ERROR: Failed to write stats file " + path + ": " + str(e))
+
+    def _work(self):
+        while not self._stopping.wait(self.cam.config["stats_interval"]):
+            self.write()
+
+    def stop(self):
+        """Stops the thread, writing the stats one last time."""
+        self._stopping.set()
+        self._thread.join()
+        self.write()
+
+
+def start_stats_writer(cam):
+    """
+    Starts rewriting the stats file, if one is set in the config.
+
+    Returns:
+        The StatsWriter, or None if no stats file is configured.
+    """
+    if not cam.config["stats_file"]:
+        return None
+    writer = StatsWriter(cam)
+    writer.start()
+    return writer
+
+
+def stop_stats_writer(writer):
+    if writer is not None:
+        writer.stop()
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /metrics in the Prometheus text format and /stats.json as the
+    stats file's JSON, both from the server's Metrics.
+    """
+
+    def do_GET(self):
+        metrics = self.server.metrics
+        path = self.path.split("?")[0]
+        if path in ["/", "/metrics"]:
+            body = metrics.prometheus().encode()
+            content_type = "text/plain; version=0.0.4"
+        elif path == "/stats.json":
+            body = json.dumps(metrics.snapshot()).encode()
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line for every scrape.
+
+
+class TCPMetricsServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixMetricsServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def start_metrics_server(cam):
+    """
+    Starts serving cam.metrics on the address in the metrics_socket setting
+    (parsed as preview_stream), in its own thread.
+
+    Returns:
+        The server, or None if metrics are not configured or could not start.
+    """
+    if not cam.config["metrics_socket"]:
+        return None
+    try:
+        address = parse_stream_address(cam.config["metrics_socket"])
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)  # Left over from a previous run.
+            server = UnixMetricsServer(address, MetricsHandler)
+        else:
+            server = TCPMetricsServer(address, MetricsHandler)
+    except (OSError, ValueError) as e:
+        print("ERROR: Could not start metrics server. " + str(e))
+        cam.print_to_logfile("Metrics server failed to start")
+        return None
+    server.metrics = cam.metrics
+    threading.Thread(target=server.serve_forever).start()
+    print("Serving metrics on " + str(cam.config["metrics_socket"]))
+    return server
+
+
+def stop_metrics_server(server):
+    """Shuts the metrics server down."""
+    if server is None:
+        return
+    server.shutdown()
+    server.server_close()
+    if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
@@ -1,9 +1,16 @@
-from picamera2 import Picamera2
-from picamera2.encoders import H264Encoder, JpegEncoder
-from picamera2.outputs import FileOutput
 from datetime import datetime
+from core.backend import load_backend
+from core.camera_paths import camera_paths
+from core.frame_hub import FrameHub
+from core.lifecycle import CameraLifecycle
+from core.log_writer import LogWriter
+from core.media_index import MediaIndex
+from core.metrics import Metrics, timed
+from core.preview_stream import PreviewStream
+from core.status import StatusPublisher
+from core.thumbnails import ThumbnailWriter
+import queue
 import threading
-import shutil
 import os
 
 
@@ -15,9 +22,9 @@ class CameraCoreModel:
 
     MAX_COMMAND_LEN = 256  # Maximum length of commands received from pipe
     FIFO_MAX = 10  # Maximum number of commands that can be queued at once
-    VALID_COMMANDS = ["ca", "im", "md", "mx", "ru"]
+    VALID_COMMANDS = ["ca", "im", "md", "mx", "ru", "tl", "tv"]
 
-    # ['tl','px','bo','tv','vi','an','as','at','ac',
+    # ['px','bo','vi','an','as','at','ac',
     #             'ab','sh','co','br','sa','is','vs','rl','ec','em','wb',
     #             'ag','mm','ie','ce','ro','fl','ri','ss','qu','pv','bi','ru',
     #             'md','sc','rs','bu','mn','mt','mi','ms','mb','me','mc','mx',
@@ -25,21 +32,37 @@ class CameraCoreModel:
 
     process_running = False
     fifo_fd = None  # File descriptor for the FIFO pipe
-    fifo_interval = 1.00  # Time interval for checking the FIFO pipe for new commands
-    command_queue = []  # Queue of commands to be executed
-    cmd_queue_lock = threading.Lock()  # Lock for synchronising access to command_queue
-
-    def __init__(self, camera_index, config_path):
-        """Initialises the camera and loads the configuration."""
-        self.picam2 = Picamera2(camera_index)
-        self.config = {
+    fifo_partial = b""  # Unterminated command left over from the last FIFO read
+    fifo_keepalive_fd = None  # Write end of the FIFO held open so reads never hit EOF
+    wake_fds = None  # (read, write) pipe used to wake the command intake thread
+    # Polling interval from the config file. Command intake is event-driven now,
+    # so this is only kept for compatibility with existing config files.
+    fifo_interval = 1.00
+    command_queue = queue.Queue()  # Thread-safe queue of command batches to execute
+
+    @staticmethod
+    def default_config():
+        """Returns the config used for anything not set in the config files."""
+        return {
             "preview_size": (512, 288),
             "preview_path": "/tmp/preview/cam_preview.jpg",
+            "preview_source": "main",  # 'main' to downscale the main stream in software, 'lores' to have the ISP produce the preview size.
+            "preview_fps": 15.0,  # Maximum previews per second, 0 for no limit.
+            "preview_idle_fps": 1.0,  # Previews per second while nobody is reading the preview.
+            "preview_idle_timeout": 10.0,  # Seconds without reads before dropping to preview_idle_fps, 0 to never. Reads are seen from the preview file's access time, so not on noatime mounts, where the rate is never dropped.
+            "preview_skip_threshold": 1.0,  # Lores MSE below which a frame is skipped as unchanged, 0 to never skip.
+            "preview_file": True,  # Whether to write previews to preview_path, as RPi Cam Web Interface reads them.
+            "preview_stream": None,  # Port, host:port or Unix socket path to stream previews on as MJPEG, None for no stream.
             "image_output_path": "/tmp/media/im_%i_%Y%M%D_%h%m%s.jpg",
             "lapse_output_path": "/tmp/media/tl_%i_%t_%Y%M%D_%h%m%s.jpg",
             "video_output_path": "/tmp/media/vi_%v_%Y%M%D_%h%m%s.mp4",
             "media_path": "/tmp/media",
+            "media_index": None,  # File indexing the media, to find the next file indexes without a scan. Defaults to .media_index in the video folder.
             "status_file": "/tmp/status_cam.txt",
+            "status_socket": None,  # Unix socket path to send each status change to clients on as it happens, None for no socket.
+            "stats_file": None,  # File rewritten with the performance counters as JSON every stats_interval seconds, None for no file.
+            "stats_interval": 10.0,  # Seconds between rewrites of the stats file.
+            "metrics_socket": None,  # Port, host:port or Unix socket path to serve the performance counters on for Prometheus, None for no server.
             "control_file": "/tmp/FIFO",
             "motion_pipe": "/tmp/motionFIFO",
             "video_width": 1920,
@@ -50,14 +73,56 @@ class CameraCoreModel:
             "motion_initframes": 0,  # How many frames to delay before starting any actual motion detection
             "motion_startframes": 3,  # How many frames of motion needed before flagging as motion detected
             "motion_stopframes": 50,  # How many frames w/o motion needed before unflagging for detected motion
+            "motion_decimation": 1,  # Only score every n-th lores pixel in each direction for motion.
+            "motion_detector": "mse",  # Motion detector to use, 'mse' (frame-to-frame) or 'background' (running average).
+            "motion_noise_floor": 6,  # Pixel differences ignored by the 'background' detector as sensor noise.
+            "motion_background_rate": 0.05,  # How quickly the 'background' detector's background follows the scene.
+            "motion_block_size": 0,  # If set, compare the threshold with the worst block of this many pixels square, not the whole frame.
+            "motion_process": False,  # Whether to score motion in a separate process, fed frames through shared memory.
+            "cameras": None,  # Cameras to run, by number ('0,1') or 'all', each in its own process with its own files. None for the first camera only.
             "autostart": True,  # Whether to start the Picamera2 instance when program launches, without waiting for 'ru'.
+            "standby": "warm",  # 'warm' to keep the camera streaming while halted with 'ru 0' so 'ru 1' resumes within a frame or two, 'cold' to stop it.
             "motion_detection": False,  # Whether to auto-start Motion Detection when program launches, no effect unless autostart is true.
             "user_config": "/tmp/uconfig",  # User configuration file used by RPi Cam Web Interface to overwrite defaults.
             "log_file": "/tmp/scheduleLog.txt",  # Filepath to record "print_to_log()" messages.
             "log_size": 5000,  # Set to 0 to not write to log file.
             "motion_logfile": "/tmp/motionLog.txt",  # Log file recording motion events during Monitor mode.
+            "still_workers": 2,  # Number of stills converted and saved in parallel in the background.
+            "still_queue_size": 4,  # Most stills waiting to be saved before new ones are dropped.
+            "raw_develop_threads": 0,  # Threads developing the tiles of a raw still, 0 for one per CPU.
+            "raw_tile_rows": 128,  # Rows of the raw frame developed per tile.
+            "burst_buffers": 4,  # Raw frame buffers set aside for bursts ('im <count>'), each the size of a raw frame.
+            "video_remux": False,  # Whether to record the H.264 stream to file and make MP4s in the background, instead of through ffmpeg while recording.
+            "remux_workers": 1,  # Number of recordings made into MP4s in parallel.
+            "remux_queue": "/tmp/remux_queue.txt",  # Lists the recordings waiting to be made into MP4s, to carry on after a restart.
+            "video_split": 0,  # Seconds after which a recording carries on in a new file, 0 to not split.
+            "video_split_mb": 0,  # MB after which a recording carries on in a new file, 0 to not split.
+            "motion_pre_seconds": 0.0,  # Seconds of video from before motion is detected to add to the start of recordings made while motion detection is on, 0 for none.
+            "motion_pre_max_mb": 32.0,  # Most memory in MB the video kept from before motion may use.
+            "timelapse_interval": 3.0,  # Seconds between timelapse frames. RaspiMJPEG's tl_interval, in tenths of a second.
         }
 
+    @classmethod
+    def load_config(cls, config_path):
+        """Returns the config a camera would use, read without opening the camera."""
+        model = cls.__new__(cls)
+        model.config = cls.default_config()
+        model.read_config_file(config_path)
+        return model.config
+
+    def __init__(self, camera_index, config_path, backend=None, separate_files=False):
+        """
+        Initialises the camera and loads the configuration.
+        Uses the Picamera2 backend unless another CameraBackend is given.
+        With separate_files, the camera uses its own control file, status
+        file, media folders etc., for running alongside other cameras.
+        """
+        self.backend = backend if backend else load_backend()
+        self.picam2 = self.backend.camera_class(camera_index)
+        self.camera_index = camera_index
+        self.separate_files = separate_files
+        self.config = self.default_config()
+
         # Set up internal flags
         self.current_status = (
             None  # Holds the current status string of the camera system
@@ -69,6 +134,17 @@ class CameraCoreModel:
             False  # Flag for whether still image capture is in progress
         )
         self.capturing_video = False  # Flag for whether video recording is in progress
+        self.still_worker = (
+            None  # Saves stills in the background, set up by the main process.
+        )
+        self.burst = None  # Current or last BurstCapture.
+        self.burst_ring = None  # Raw frame buffers reused by every burst.
+        self.timelapse = None  # Current or last Timelapse.
+        self.index_lock = threading.Lock()  # Guards claiming image indexes.
+        # Set to stop the preview, motion, burst and timelapse threads, and
+        # keeps the status at 'halted' until the camera is restarted.
+        self.stop_event = threading.Event()
+        self.lifecycle = CameraLifecycle()  # Running, standby after 'ru 0', ...
 
         self.motion_detection = False  # Flag for motion detection mode status
 
@@ -83,26 +159,81 @@ class CameraCoreModel:
         self.current_video_path = (
             None  # Stores filename of video currently being recorded.
         )
+        self.pre_event = (
+            None  # PreEventBuffer the encoder writes to while motion detection is on.
+        )
+        self.remux_pool = None  # RemuxPool making finished recordings into MP4s.
+        self.record_timer = None  # Timer stopping a timed recording ('ca 1 <secs>').
+        self.log_writer = LogWriter()  # Writes the log files in the background.
+        self.metrics = Metrics()  # Timings of each stage and the workers' stats.
+        self.motion_detector = None  # Set up by the motion detection thread.
+        self.media_index = (
+            None  # MediaIndex of the media files, set up with the file counts.
+        )
+        self.video_encoder = None  # Initialise video encoder as None
 
+        self.config_path = config_path  # Read again when user_config changes.
+        self.config_version = 0  # Counts changes applied while running.
         self.read_config_file(
             config_path
         )  # Loads config from the provided config file path
+        if separate_files:
+            self.config.update(camera_paths(self.config, camera_index))
 
         self.make_output_directories()
+        self.status_publisher = StatusPublisher(self.config["status_file"])
 
         # Set image/video file indexes based on detected thumbnail counts in the folder(s).
         self.make_filecounts()
 
+        self.configure_streams()
+
+        # Captures each request once and shares it between preview, motion and stills.
+        self.frame_hub = FrameHub(self.capture_request)
+        self.preview_scheduler = None  # Set up by the preview thread.
+        self.preview_stream = PreviewStream()  # Latest preview, for streaming clients.
+        self.thumbnails = ThumbnailWriter(self.config["preview_size"])
+        self.video_first_frame = (
+            None  # FirstFrame, or preview JPEG, of the start of the current video file.
+        )
+
+        # Set initial status of the camera depending on autostart flag
+        if self.config["autostart"]:
+            self.lifecycle.transition(CameraLifecycle.RUNNING)
+            self.picam2.start()
+            self.frame_hub.start()
+            # Set initial status of motion detection
+            if self.config["motion_detection"]:
+                self.motion_detection = True
+        else:
+            print("no autostart")
+
+    def configure_streams(self):
+        """
+        Configures the camera's streams for the current config and sets up the
+        encoders for them, stopping the camera first if it is in warm standby.
+        """
+        if self.picam2.started:
+            self.picam2.stop()
+        # With the 'lores' preview source, the ISP scales the lores stream to the
+        # preview size so previews never touch full resolution pixels. Motion
+        # detection then runs on the preview-sized lores stream too.
+        lores_size = (320, 240)
+        if self.config["preview_source"] == "lores":
+            preview_width, preview_height = self.config["preview_size"]
+            lores_size = (preview_width & ~1, preview_height & ~1)
+
         # Create and configure the camera for video capture
         # Note: Enabling raw stream seems to cut FPS down to 20fps when also using
         # FfmpegOutput to save as .mp4, without raw enabled it gets 30fps on both main and lores.
-        # Can still get 30fps when using FileOutput to output unencoded .h264 with Raw enabled.
+        # Can still get 30fps when using FileOutput to output unencoded .h264 with Raw enabled,
+        # as recordings do with video_remux set.
         video_config = self.picam2.create_video_configuration(
             main={
                 "size": (self.config["video_width"], self.config["video_height"]),
                 "format": "RGB888",
             },
-            lores={"size": (320, 240), "format": "YUV420"},
+            lores={"size": lores_size, "format": "YUV420"},
             raw={"size": self.picam2.sensor_resolution, "format": "SBGGR10"},
         )
 
@@ -119,23 +250,25 @@ class CameraCoreModel:
         print(self.picam2.camera_controls)
         print(self.picam2.camera_configuration())
 
-        self.video_encoder = None  # Initialise video encoder as None
         self.setup_encoders()  # Sets up JPEG and H264 encoders for image and video encoding
 
-        # Set initial status of the camera depending on autostart flag
-        if self.config["autostart"]:
-            self.picam2.start()
-            # Set initial status of motion detection
-            if self.config["motion_detection"]:
-                self.motion_detection = True
-        else:
-            print("no autostart")
-
     def stop_all(self):
-        """Stops the Picamera2 instance and any encoders currently running."""
+        """
+        Stops any encoders running and the frame hub, leaving the camera in
+        standby for restart(). The Picamera2 instance keeps its configuration
+        and buffers, and is only stopped in 'cold' standby.
+        """
+        self.lifecycle.transition(CameraLifecycle.STANDBY)
         if self.video_encoder.running:
             self.picam2.stop_encoder(self.video_encoder)
-        self.picam2.stop()
+        self.pre_event = None
+        if self.record_timer:
+            self.record_timer.cancel()
+            self.record_timer = None
+        self.frame_hub.stop()
+        self.frame_hub.release_pending()  # Nothing stale is picked up on resume.
+        if self.config["standby"] == "cold":
+            self.picam2.stop()
         self.reset_motion_state()
         self.capturing_video = False
         self.capturing_still = False
@@ -149,14 +282,25 @@ class CameraCoreModel:
         self.motion_active_count = 0
 
     def restart(self):
-        """Restarts the Picamera2 instance."""
-        self.picam2.stop()
-        self.picam2.start()
+        """
+        Resumes from standby, or starts the camera if it never was. The
+        Picamera2 instance is only stopped and started again to recover from
+        a failed frame capture.
+        """
+        if self.frame_hub.error is not None:
+            self.picam2.stop()
+        self.lifecycle.transition(CameraLifecycle.RUNNING)
+        if not self.picam2.started:
+            self.picam2.start()
+        self.frame_hub.start()
+        self.stop_event.clear()
 
     def teardown(self):
         """Stops and closes the camera when shutting down."""
         if self.video_encoder.running:
             self.picam2.stop_encoder(self.video_encoder)
+        self.thumbnails.stop()  # Write the thumbnails of anything just finished.
+        self.frame_hub.stop()
         self.picam2.stop()
         self.picam2.close()
         # Remove any preview images there may be in the directory.
@@ -180,36 +324,80 @@ class CameraCoreModel:
         status_path = os.path.dirname(self.config["status_file"])
         paths = [preview_path, im_path, tl_path, video_path, media_path, status_path]
         for path in paths:
-            if not os.path.exists(path):
-                os.makedirs(path)
+            # Cameras run side by side may make a shared folder at the same time.
+            os.makedirs(path, exist_ok=True)
 
     def setup_encoders(self):
         """Sets up the JPEG and H264 encoders for the camera."""
-        self.jpeg_encoder = JpegEncoder()  # JPEG encoder for still images
-        self.jpeg_encoder.output = FileOutput()  # Output destination for JPEG images
-        self.video_encoder = H264Encoder(
+        self.jpeg_encoder = self.backend.jpeg_encoder()  # JPEG encoder for still images
+        self.jpeg_encoder.output = (
+            self.backend.file_output()
+        )  # Output destination for JPEG images
+        self.video_encoder = self.backend.h264_encoder(
             bitrate=self.config["video_bitrate"], framerate=False
         )
         self.video_encoder.size = self.picam2.camera_config["main"]["size"]
         self.video_encoder.format = self.picam2.camera_config["main"]["format"]
 
     def read_config_file(self, config_path):
-        """Reads the configuration file and loads it into the model."""
+        """
+        Reads the configuration file and loads it into the model, followed by
+        the user configuration file RPi Cam Web Interface writes its changes
+        to, as RaspiMJPEG does.
+        """
         if not config_path:
             print("No configuration file provided. Using hardcoded defaults.")
             return
+        self.process_configs_from_file(
+            self.parse_config_files(config_path)
+        )  # Process the parsed configuration
+
+    def parse_config_files(self, config_path):
+        """
+        Parses the configuration file, then the user configuration file it names
+        over the top of it, if there is one.
+
+        Returns:
+            Dict of each setting in the files to its value, or None if empty.
+        """
+        configs_from_file = self.parse_config_file(config_path)
+        user_config = configs_from_file.get("user_config")
+        if user_config and os.path.exists(user_config):
+            configs_from_file.update(self.parse_config_file(user_config))
+        return configs_from_file
+
+    @staticmethod
+    def parse_config_file(path):
+        """Returns a dict of each setting in a config file to its value, or None if empty."""
         configs_from_file = {}
         # Parse each non-comment line in the configuration file
-        with open(config_path, "r") as cf_file:
+        with open(path, "r") as cf_file:
             for line in cf_file:
                 strippedline = line.strip()
                 if strippedline and strippedline[0] != "#":
                     setting = strippedline.split()
                     key, value = setting[0], " ".join(setting[1:])
                     configs_from_file[key] = value if value else None
-        self.process_configs_from_file(
-            configs_from_file
-        )  # Process the parsed configuration
+        return configs_from_file
+
+    def reload_config(self):
+        """
+        Reads the config files again without applying them.
+
+        Returns:
+            The config the files now give, or None if there is no config file.
+        """
+        if not self.config_path:
+            return None
+        running_config = self.config
+        self.config = dict(running_config)
+        try:
+            self.process_configs_from_file(self.parse_config_files(self.config_path))
+            if self.separate_files:
+                self.config.update(camera_paths(self.config, self.camera_index))
+            return self.config
+        finally:
+            self.config = running_config
 
     def process_configs_from_file(self, parsed_configs):
         """Processes the parsed configurations and applies them to the model.
@@ -280,6 +468,72 @@ class CameraCoreModel:
             )
         if parsed_configs["motion_stopframes"]:
             self.config["motion_stopframes"] = int(parsed_configs["motion_stopframes"])
+        # RasPyCam-only settings, so they may be missing from RaspiMJPEG config files.
+        if parsed_configs.get("preview_source"):
+            self.config["preview_source"] = parsed_configs["preview_source"]
+        if parsed_configs.get("preview_file"):
+            self.config["preview_file"] = parsed_configs["preview_file"] != "0"
+        if parsed_configs.get("preview_stream"):
+            self.config["preview_stream"] = parsed_configs["preview_stream"]
+        for key in [
+            "preview_fps",
+            "preview_idle_fps",
+            "preview_idle_timeout",
+            "preview_skip_threshold",
+        ]:
+            if parsed_configs.get(key):
+                self.config[key] = float(parsed_configs[key])
+        if parsed_configs.get("motion_decimation"):
+            self.config["motion_decimation"] = int(parsed_configs["motion_decimation"])
+        if parsed_configs.get("motion_block_size"):
+            self.config["motion_block_size"] = int(parsed_configs["motion_block_size"])
+        if parsed_configs.get("motion_detector"):
+            self.config["motion_detector"] = parsed_configs["motion_detector"]
+        if parsed_configs.get("motion_noise_floor"):
+            self.config["motion_noise_floor"] = float(
+                parsed_configs["motion_noise_floor"]
+            )
+        for key in [
+            "still_workers",
+            "still_queue_size",
+            "raw_develop_threads",
+            "raw_tile_rows",
+            "burst_buffers",
+        ]:
+            if parsed_configs.get(key):
+                self.config[key] = int(parsed_configs[key])
+        if parsed_configs.get("motion_process"):
+            self.config["motion_process"] = parsed_configs["motion_process"] != "0"
+        if parsed_configs.get("video_remux"):
+            self.config["video_remux"] = parsed_configs["video_remux"] != "0"
+        if parsed_configs.get("cameras"):
+            self.config["cameras"] = parsed_configs["cameras"]
+        if parsed_configs.get("standby"):
+            self.config["standby"] = parsed_configs["standby"]
+        if parsed_configs.get("status_socket"):
+            self.config["status_socket"] = parsed_configs["status_socket"]
+        if parsed_configs.get("stats_file"):
+            self.config["stats_file"] = parsed_configs["stats_file"]
+        if parsed_configs.get("stats_interval"):
+            self.config["stats_interval"] = float(parsed_configs["stats_interval"])
+        if parsed_configs.get("metrics_socket"):
+            self.config["metrics_socket"] = parsed_configs["metrics_socket"]
+        if parsed_configs.get("media_index"):
+            self.config["media_index"] = parsed_configs["media_index"]
+        if parsed_configs.get("remux_queue"):
+            self.config["remux_queue"] = parsed_configs["remux_queue"]
+        for key in ["remux_workers", "video_split", "video_split_mb"]:
+            if parsed_configs.get(key):
+                self.config[key] = int(parsed_configs[key])
+        for key in ["motion_pre_seconds", "motion_pre_max_mb"]:
+            if parsed_configs.get(key):
+                self.config[key] = float(parsed_configs[key])
+        if parsed_configs.get("tl_interval"):
+            self.config["timelapse_interval"] = int(parsed_configs["tl_interval"]) / 10
+        if parsed_configs.get("motion_background_rate"):
+            self.config["motion_background_rate"] = float(
+                parsed_configs["motion_background_rate"]
+            )
 
         # Set autostart and motion auto-start configs. Autostart values can be 'standard' or 'idle'.
         # We'll map them to True/False here and assume any value apart from 'standard' is False.
@@ -302,6 +556,7 @@ class CameraCoreModel:
         if parsed_configs["motion_logfile"]:
             self.config["motion_logfile"] = parsed_configs["motion_logfile"]
 
+    @timed("capture")
     def capture_request(self):
         """Wrapper for capturing a camera request."""
         return self.picam2.capture_request()
@@ -320,8 +575,10 @@ class CameraCoreModel:
                 self.current_status = status
                 return
 
-        if not self.picam2.started:
+        if self.stop_event.is_set() or not self.picam2.started:
             self.current_status = "halted"
+        elif self.frame_hub.error is not None:
+            self.current_status = "Error: frame capture failed"
         elif self.capturing_still:
             self.current_status = "image"
         elif self.capturing_video:
@@ -347,8 +604,15 @@ class CameraCoreModel:
                 else:
                     self.current_status = "ready"
 
-    def make_filename(self, name):
-        """Generates a file name based on the given naming scheme."""
+    def make_filename(self, name, image_index=None, lapse_index=0):
+        """
+        Generates a file name based on the given naming scheme.
+
+        Args:
+            name: Naming scheme, e.g. the image_output_path.
+            image_index: Index for '%i', or None for the next image index.
+            lapse_index: Frame number within a timelapse sequence, for '%t'.
+        """
         current_dt = datetime.now()  # Get the current date and time
         # Format various components of the filename such as date, time, and indices
         year_2d = ("%04d" % current_dt.year)[2:]
@@ -359,11 +623,15 @@ class CameraCoreModel:
         minute = "%02d" % current_dt.minute
         seconds = "%02d" % current_dt.second
         millisecs = "%03d" % round(current_dt.microsecond / 1000)
-        img_index = "%04d" % self.still_image_index
+        if image_index is None:
+            image_index = self.still_image_index
+        img_index = "%04d" % image_index
         vid_index = "%04d" % self.video_file_index
+        lapse_frame = "%04d" % lapse_index
 
         name = name.replace("%v", vid_index)
         name = name.replace("%i", img_index)
+        name = name.replace("%t", lapse_frame)
         name = name.replace("%y", year_2d)
         name = name.replace("%Y", year_4d)
         name = name.replace("%M", month)
@@ -374,84 +642,100 @@ class CameraCoreModel:
         name = name.replace("%u", millisecs)
         return name.replace("%%", "%")
 
+    def claim_image(self, name):
+        """
+        Generates the file name of the next image and claims its image index,
+        so images named from several threads never share an index.
+
+        Returns:
+            (file name, claimed image index)
+        """
+        with self.index_lock:
+            filename = self.make_filename(name)
+            index = self.still_image_index
+            self.still_image_index = index + 1
+        return filename, index
+
     def make_filecounts(self):
-        """Find the counts of all types of output files in their directory and
-        updates the config dict with them.... in theory. RaspiMJPEG actually does this
-        a somewhat boneheaded way by not actually looking at the files themselves,
-        but instead their thumbnails and extracts the type/count from the filenames of
-        those, by looking at the highest existing number for the type."""
-        image_count = 0
-        video_count = 0
-        # Find all thumbnails.
-        all_files = os.listdir(os.path.dirname(self.config["image_output_path"]))
-        all_files.extend(os.listdir(os.path.dirname(self.config["video_output_path"])))
-        all_files = set(all_files)
-        for f in all_files:
-            # Strip the extension off.
-            filename = os.path.basename(f)
-            file_without_ext = os.path.splitext(filename)[0]
-            # If the extensionless filename now ends with '.th', it is a thumbnail.
-            if file_without_ext.endswith(".th"):
-                # Attempt to strip the type+count portion off.
-                without_th = os.path.splitext(file_without_ext)[0]
-                typecount = os.path.splitext(without_th)
-                filetype = typecount[1][1:2]
-                filecount = typecount[1][2:]
-                # Skip any invalid files.
-                if (not filetype) or (not filecount):
-                    continue
-                elif filetype not in ["i", "t", "v"]:
-                    continue
-                elif not filecount.isdigit():
-                    continue
-                # Update image_count or video_count if file count is bigger.
-                filecount = int(filecount)
-                if filetype == "v":
-                    if filecount > video_count:
-                        video_count = filecount
-                else:
-                    if filecount > image_count:
-                        image_count = filecount
-        # Set the indexes to one greater than the last existing count.
-        # These will be used for the next thumbnails that will be generated.
-        self.still_image_index = image_count + 1
-        self.video_file_index = video_count + 1
-
-    def generate_thumbnail(self, filetype, filepath):
+        """Sets the next image and video indexes from the media index, which
+        only rescans the media folders' thumbnails if it is out of date."""
+        if not self.config["media_index"]:
+            video_dir = os.path.dirname(self.config["video_output_path"])
+            self.config["media_index"] = os.path.join(video_dir, ".media_index")
+        self.media_index = MediaIndex(
+            self.config["media_index"],
+            [
+                os.path.dirname(self.config["image_output_path"]),
+                os.path.dirname(self.config["video_output_path"]),
+            ],
+        )
+        self.still_image_index, self.video_file_index = self.media_index.load()
+        if self.media_index.rebuilt:
+            print("Media index rebuilt from the thumbnails in the media folders.")
+
+    def generate_thumbnail(self, filetype, filepath, count=None, frame=None):
         """Generates a thumbnail for a file of the given type and path.
         There are 3 types of files RaspiMJPEG differentiates between:
         Images ('i'), videos ('v') and timelapse sequences ('t'). The thumbnails
         are named slightly differently depending on which type it is.
-        As with RaspiMJPEG, just copies the preview JPG file to use as thumbnail.
+        The thumbnail is made from the file's own frame: a PIL image of it,
+        downscaled here, or a preview JPEG taken of it. Without one, the latest
+        preview is used, or failing that the next frame captured. It is
+        written in the background by self.thumbnails.
+        The count can be given if it was already claimed when the file was named.
         """
         filename = filepath
-        count = None
-        if (filetype == "i") or (filetype == "t"):
-            # Make thumbnail count for image files.
-            count = self.still_image_index
-            # Increment count for next image.
-            self.still_image_index = count + 1
-        elif filetype == "v":
-            # Make thumbnail count for video files.
-            count = self.video_file_index
-            # Increment count for next video.
-            self.video_file_index = count + 1
+        if count is None:  # Otherwise claimed when the file was named.
+            with self.index_lock:
+                if (filetype == "i") or (filetype == "t"):
+                    # Make thumbnail count for image files.
+                    count = self.still_image_index
+                    # Increment count for next image.
+                    self.still_image_index = count + 1
+                elif filetype == "v":
+                    # Make thumbnail count for video files.
+                    count = self.video_file_index
+                    # Increment count for next video.
+                    self.video_file_index = count + 1
+        # Index the file first, so it is counted even without a thumbnail.
+        self.media_index.add(filetype, count, filepath)
         # Make actual thumbnail.
         thumbnail_path = filename + "." + filetype + str(count) + ".th.jpg"
-        shutil.copyfile(self.config["preview_path"], thumbnail_path)
+        if frame is None:
+            frame = self.preview_stream.latest()
+        elif not isinstance(frame, bytes):
+            frame = self.thumbnails.make(frame)
+        if frame is None:
+            frame = self.next_frame_thumbnail()
+        if frame is None:
+            print("No frame to make the thumbnail from: " + thumbnail_path)
+            self.print_to_logfile("No thumbnail made for " + filepath)
+            return
+        self.thumbnails.submit(thumbnail_path, frame)
+
+    def next_frame_thumbnail(self, timeout=1.0):
+        """
+        Returns a thumbnail image of the next frame captured, or None if none
+        is captured before the timeout (e.g. the camera is halted).
+        """
+        frame = self.frame_hub.next_frame(timeout)
+        if frame is None:
+            return None
+        try:
+            return self.thumbnails.make(frame.request.make_image("main"))
+        finally:
+            frame.release()
 
     def print_to_logfile(self, message):
         """
         Writes message to the specified log file. If log size is 0, does not
-        write anything. No current functionality for limiting lines to log_size.
+        write anything, otherwise the file is kept to about log_size lines.
         RPi Cam Interface uses the same file to write its Sechduler logs to and
         differentiates between them by using [] for its own message timestamps while
         RaspiMJPEG uses {} for its message timestamps.
+        The message is written in the background by self.log_writer.
         """
-        timestring = "{" + datetime.now().strftime("%Y/%m/%d %H:%M:%S") + "} "
-        contents = timestring + message + "\n"
-        log_fd = os.open(self.config["log_file"], os.O_RDWR | os.O_NONBLOCK, 0o777)
-        log_file = os.fdopen(log_fd, "a")
         if self.config["log_size"] > 0:
-            log_file.write(contents)
-        log_file.close()
+            self.log_writer.log(
+                self.config["log_file"], message, self.config["log_size"]
+            )
@@ -0,0 +1,180 @@
+import http.server
+import os
+import socketserver
+import threading
+
+
+class PreviewStream:
+    """
+    Holds the most recent preview JPEG in memory for streaming clients.
+    Every client is sent the same bytes object, so a preview is encoded once
+    no matter how many clients are watching.
+    """
+
+    def __init__(self):
+        self.jpeg = None  # Latest preview JPEG.
+        self.sequence = 0  # Number of previews published, to spot new ones.
+        self.clients = 0  # Number of clients currently streaming.
+        self.closed = False
+        self._cond = threading.Condition()
+
+    def publish(self, jpeg):
+        """Makes jpeg the latest preview and wakes any waiting clients."""
+        with self._cond:
+            self.jpeg = jpeg
+            self.sequence += 1
+            self._cond.notify_all()
+
+    def latest(self):
+        """Returns the latest preview JPEG, or None if nothing is published yet."""
+        with self._cond:
+            return self.jpeg
+
+    def wait_for_frame(self, last_sequence, timeout=None):
+        """
+        Waits for a preview newer than last_sequence.
+
+        Returns:
+            (jpeg, sequence), with jpeg None on timeout or once closed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.sequence != last_sequence or self.closed, timeout
+            )
+            if self.closed or self.sequence == last_sequence:
+                return None, last_sequence
+            return self.jpeg, self.sequence
+
+    def add_client(self, delta):
+        with self._cond:
+            self.clients += delta
+
+    def close(self):
+        """Wakes all clients so they disconnect."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class PreviewStreamHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /stream.mjpg as a multipart MJPEG stream and /preview.jpg as the
+    latest single preview, both straight from the server's PreviewStream.
+    """
+
+    BOUNDARY = b"FRAME"
+
+    def do_GET(self):
+        stream = self.server.preview_stream
+        path = self.path.split("?")[0]
+        if path in ["/", "/stream.mjpg"]:
+            self.send_stream(stream)
+        elif path == "/preview.jpg":
+            self.send_jpeg(stream.latest())
+        else:
+            self.send_error(404)
+
+    def send_jpeg(self, jpeg):
+        if jpeg is None:
+            self.send_error(503, "No preview available yet")
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(jpeg)))
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(jpeg)
+
+    def send_stream(self, stream):
+        self.send_response(200)
+        self.send_header(
+            "Content-Type",
+            "multipart/x-mixed-replace; boundary=" + self.BOUNDARY.decode(),
+        )
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        stream.add_client(1)
+        try:
+            jpeg, sequence = stream.latest(), 0
+            while not stream.closed:
+                if jpeg is not None:
+                    self.wfile.write(
+                        b"--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n"
+                        % (self.BOUNDARY, len(jpeg))
+                    )
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b"\r\n")
+                    self.wfile.flush()
+                jpeg, sequence = stream.wait_for_frame(sequence, timeout=1.0)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away.
+        finally:
+            stream.add_client(-1)
+
+    def log_message(self, format, *args):
+        pass  # Don't print a line for every request.
+
+
+class TCPPreviewServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixPreviewServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def parse_stream_address(address):
+    """
+    Parses a preview_stream setting: a path for a Unix socket ('/tmp/preview.sock'),
+    or a TCP port, optionally with a host ('8080' or '0.0.0.0:8080').
+    TCP streams listen on localhost unless a host is given.
+
+    Returns:
+        Socket path string, or (host, port) tuple.
+    """
+    address = str(address).strip()
+    if address.startswith("/"):
+        return address
+    host, _, port = address.rpartition(":")
+    return (host if host else "127.0.0.1", int(port))
+
+
+def start_preview_server(cam):
+    """
+    Starts serving cam.preview_stream on the address in the preview_stream
+    setting, in its own thread.
+
+    Returns:
+        The server, or None if streaming is not configured or could not start.
+    """
+    if not cam.config["preview_stream"]:
+        return None
+    try:
+        address = parse_stream_address(cam.config["preview_stream"])
+        if isinstance(address, str):
+            if os.path.exists(address):
+                os.remove(address)  # Left over from a previous run.
+            server = UnixPreviewServer(address, PreviewStreamHandler)
+            os.chmod(address, 0o666)  # Let the web server connect.
+        else:
+            server = TCPPreviewServer(address, PreviewStreamHandler)
+    except (OSError, ValueError) as e:
+        print("ERROR: Could not start preview stream server. " + str(e))
+        cam.print_to_logfile("Preview stream server failed to start")
+        return None
+    server.preview_stream = cam.preview_stream
+    threading.Thread(target=server.serve_forever).start()
+    print("Streaming preview on " + str(cam.config["preview_stream"]))
+    return server
+
+
+def stop_preview_server(cam, server):
+    """Disconnects all streaming clients and shuts the server down."""
+    if server is None:
+        return
+    cam.preview_stream.close()
+    server.shutdown()
+    server.server_close()
+    if isinstance(server.server_address, str) and os.path.exists(server.server_address):
+        os.remove(server.server_address)
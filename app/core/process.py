@@ -1,20 +1,39 @@
 import os
+import queue
+import select
 import time
 import threading
 import signal
 
-from picamera2 import Picamera2
+from core.backend import load_backend
+from core.frame_hub import FrameSubscription
+from core.lifecycle import CameraLifecycle
+from core.metrics import (
+    start_metrics_server,
+    start_stats_writer,
+    stop_metrics_server,
+    stop_stats_writer,
+)
+from core.preview_stream import start_preview_server, stop_preview_server
+from core.status import start_status_server, stop_status_server
+from core.camera_paths import select_cameras
+from core.supervisor import CameraSupervisor
+from core.reconfigure import ConfigWatcher, apply_config_changes
 from core.model import CameraCoreModel
-from utilities.preview import generate_preview
-from utilities.record import toggle_cam_record
-from utilities.capture import capture_still_request
+from utilities.preview import generate_preview, PreviewScheduler
+from utilities.record import toggle_cam_record, start_record_timer
+from utilities.pre_event import start_pre_event_buffer, stop_pre_event_buffer
+from utilities.capture import capture_still_request, StillWorker
+from utilities.remux import RemuxPool
+from utilities.burst import parse_burst, start_burst
+from utilities.timelapse import start_timelapse, stop_timelapse
 from utilities.motion_detect import motion_detection_thread, setup_motion_pipe
 
 
 def on_sigint_sigterm(sig, frame):
     """
     Signal handler for SIGINT and SIGTERM.
-    Sets process_running to False, allowing graceful shutdown.
+    Stops the process, allowing graceful shutdown.
 
     Args:
         sig: Signal number.
@@ -22,7 +41,17 @@ def on_sigint_sigterm(sig, frame):
     """
     print("Received signal: ")
     print(sig)
+    stop_process()
+
+
+def stop_process():
+    """
+    Sets process_running to False and wakes the command intake thread, which
+    in turn wakes the main command loop so both can exit.
+    """
     CameraCoreModel.process_running = False
+    if CameraCoreModel.wake_fds:
+        os.write(CameraCoreModel.wake_fds[1], b"\0")
 
 
 # Register signal handlers for graceful shutdown
@@ -30,6 +59,9 @@ signal.signal(signal.SIGINT, on_sigint_sigterm)
 signal.signal(signal.SIGTERM, on_sigint_sigterm)
 
 
+status_lock = threading.Lock()  # Serialises status file updates between threads.
+
+
 def update_status_file(model):
     """
     Updates the status file with the current camera status.
@@ -37,22 +69,38 @@ def update_status_file(model):
     Args:
         model: CameraCoreModel instance containing the status and config.
     """
-    model.set_status()
-    current_status = model.current_status  # Get the current status from the model
-    status_filepath = model.config["status_file"]  # Path to the status file
-    status_dir = os.path.dirname(
-        status_filepath
-    )  # Get the directory of the status file
+    # Called from the command loop and the still worker threads.
+    with status_lock:
+        model.set_status()
+        # Only written when it changes, see StatusPublisher.
+        if model.current_status:
+            model.status_publisher.publish(model.current_status)
+
+
+def report_capture_error(model, error):
+    """
+    Called by the frame hub when capturing frames fails. Logs the failure and
+    shows the error status until the camera is restarted.
+
+    Args:
+        model: CameraCoreModel instance.
+        error: Exception raised by the capture.
+    """
+    model.print_to_logfile("Frame capture failed: " + str(error))
+    update_status_file(model)
 
-    # Create the status directory if it doesn't exist
-    if not os.path.exists(status_dir):
-        os.makedirs(status_dir)
 
-    # Write the current status to the status file
-    if current_status:
-        status_file = open(status_filepath, "w")
-        status_file.write(current_status)
-        status_file.close()
+def report_resume(model):
+    """
+    Called by the frame hub with the first frame after each start. Logs how
+    long the camera took to get going again.
+
+    Args:
+        model: CameraCoreModel instance.
+    """
+    latency = model.lifecycle.first_frame()
+    if latency is not None:
+        model.print_to_logfile("Running, first frame after %.1f ms" % (latency * 1000))
 
 
 def setup_fifo(path):
@@ -83,41 +131,82 @@ def setup_fifo(path):
     return True
 
 
+class CommandBatch(list):
+    """Commands read from the FIFO pipe together, with when they were read."""
+
+    def __init__(self, commands):
+        super().__init__(commands)
+        self.received = time.monotonic()
+
+
 def parse_incoming_commands():
     """
-    Continuously checks for incoming commands from the FIFO pipe.
-    Valid commands are added to the command queue.
+    Waits for incoming commands on the FIFO pipe and adds each batch of valid
+    ones to the command queue as soon as it arrives. Blocks in select() between commands,
+    so an idle process does not wake up at all. Exits when woken through
+    stop_process(), pushing None onto the queue to stop the command loop.
     """
+    fifo_fd = CameraCoreModel.fifo_fd  # Access the file descriptor for the FIFO pipe
+    wake_fd = CameraCoreModel.wake_fds[0]
     while CameraCoreModel.process_running:
-        # print("Checking for command...")
-        incoming_cmd = None
-        fifo_fd = (
-            CameraCoreModel.fifo_fd
-        )  # Access the file descriptor for the FIFO pipe
-        if fifo_fd:
+        readable, _, _ = select.select([fifo_fd, wake_fd], [], [])
+        if (wake_fd in readable) or (not CameraCoreModel.process_running):
+            break
+        try:
             # Read and validate incoming commands from the pipe
-            incoming_cmd = read_pipe(fifo_fd)
-        if incoming_cmd:
-            # Add the valid command to the command queue
-            CameraCoreModel.cmd_queue_lock.acquire()
-            CameraCoreModel.command_queue.append(incoming_cmd)
-            CameraCoreModel.cmd_queue_lock.release()
-        time.sleep(CameraCoreModel.fifo_interval)  # Wait before checking the pipe again
+            incoming_cmds = read_pipe(fifo_fd)
+        except BlockingIOError:
+            continue  # Another reader got there first, wait for the next write.
+        if incoming_cmds:
+            # Add the batch of valid commands to the command queue
+            CameraCoreModel.command_queue.put(CommandBatch(incoming_cmds))
+    CameraCoreModel.command_queue.put(None)
 
 
 def read_pipe(fd):
     """
-    Reads data from the FIFO pipe and checks if it is a valid command.
+    Reads data from the FIFO pipe and splits it into newline-separated commands.
+    Every complete command in the read is returned, so a burst of commands
+    written back to back is handled as one batch. Writes to a pipe of up to
+    PIPE_BUF bytes arrive whole, so a trailing command without a newline is
+    only held back for the next read if the read filled the buffer and may
+    have cut it short.
 
     Args:
         fd: File descriptor of the FIFO pipe.
 
+    Returns:
+        List of (command, parameters) tuples for the valid commands read.
+    """
+    read_size = CameraCoreModel.MAX_COMMAND_LEN * CameraCoreModel.FIFO_MAX
+    contents = os.read(fd, read_size)
+    lines = (CameraCoreModel.fifo_partial + contents).split(b"\n")
+    CameraCoreModel.fifo_partial = b""
+    if len(contents) == read_size:
+        partial = lines.pop()
+        # Anything longer than a command is not a command, don't keep growing it.
+        if len(partial) <= CameraCoreModel.MAX_COMMAND_LEN:
+            CameraCoreModel.fifo_partial = partial
+    commands = []
+    for line in lines:
+        command = parse_command(line.decode(errors="replace"))
+        if command:
+            commands.append(command)
+    return commands
+
+
+def parse_command(contents_str):
+    """
+    Checks if a single line read from the FIFO pipe is a valid command.
+
+    Args:
+        contents_str: String containing one command and its parameters.
+
     Returns:
         Tuple of command and parameters if valid, otherwise False.
     """
-    # Read the contents from the pipe and remove any trailing whitespace
-    contents = os.read(fd, CameraCoreModel.MAX_COMMAND_LEN)
-    contents_str = contents.decode().rstrip()
+    # Remove any surrounding whitespace (including a '\r' from CRLF line endings)
+    contents_str = contents_str.strip()
     cmd_code = contents_str[:2]  # Extract the command code (first 2 characters)
     cmd_param = contents_str[
         3:
@@ -134,6 +223,45 @@ def read_pipe(fd):
     return False  # Return False for invalid commands
 
 
+def reload_config(model, threads):
+    """
+    Applies changes made to the config files while running. The camera is
+    only stopped and started again if the changes need its streams
+    configuring again, such as a new video size; anything else is applied in
+    place without interrupting capture.
+
+    Args:
+        model: CameraCoreModel instance.
+        threads: List of the preview and motion detection threads.
+    """
+    new_config = model.reload_config()
+    if new_config is None:
+        return
+    applied, reconfigure = apply_config_changes(model, new_config)
+    if ("motion_pre_seconds" in applied) or ("motion_pre_max_mb" in applied):
+        # Start the pre-event buffer again at its new length, unless recording.
+        if model.pre_event and not model.pre_event.recording:
+            stop_pre_event_buffer(model)
+            start_pre_event_buffer(model)
+    if not reconfigure:
+        return
+    if not model.lifecycle.running:
+        model.configure_streams()  # Used from the next 'ru 1'.
+        model.config_version += 1  # The threads pick up the new stream sizes.
+        return
+    print("Configuring the camera's streams again for the new settings...")
+    if model.capturing_video:
+        toggle_cam_record(model, False)  # Can't change size part way through.
+    motion_detection = model.motion_detection
+    execute_command(("ru", "0"), model, threads)
+    model.configure_streams()
+    model.config_version += 1  # The threads pick up the new stream sizes.
+    execute_command(("ru", "1"), model, threads)
+    if motion_detection:
+        model.motion_detection = True
+        start_pre_event_buffer(model)
+
+
 def execute_command(cmd_tuple, model, threads):
     """
     Executes the given command based on its code.
@@ -145,48 +273,86 @@ def execute_command(cmd_tuple, model, threads):
     """
     cmd_code, cmd_param = cmd_tuple  # Unpack the command tuple
 
-    if cmd_code == "ru":  # 'ru' stands for "run"
+    if cmd_code == "reload":  # Queued by the ConfigWatcher, not read from the pipe.
+        reload_config(model, threads)
+
+    elif cmd_code == "ru":  # 'ru' stands for "run"
         if cmd_param.startswith("0"):
-            print("Stopping camera, encoders and preview/motion threads...")
+            print("Stopping encoders and putting the camera in standby...")
+            halt_start = time.monotonic()
             model.current_status = "halted"
-            # Stop preview and motion-detection threads
-            for t in threads:
-                t.join()
-            # Make new threads to replace them, but don't start them until restart is called.
-            preview_thread = threading.Thread(target=show_preview, args=(model,))
-            md_thread = threading.Thread(target=motion_detection_thread, args=(model,))
-            threads.clear()
-            threads.append(preview_thread)
-            threads.append(md_thread)
+            model.stop_event.set()
+            stop_timelapse(model)
+            if model.burst:
+                model.burst.join()  # Bursts stop on stop_event too.
+            # The preview and motion threads wait for the camera to resume,
+            # so they are left running.
             model.stop_all()
+            halt_time = time.monotonic() - halt_start
+            model.lifecycle.record_halt(halt_time)
+            model.print_to_logfile("Halted in %.1f ms" % (halt_time * 1000))
         else:
-            print("Restarting camera, encoders and preview/motion threads...")
+            print("Resuming camera from standby...")
             model.restart()
             model.set_status()
-            for t in threads:
-                if not t.is_alive():
-                    t.start()
+            for i, target in enumerate([show_preview, motion_detection_thread]):
+                if not threads[i].is_alive():
+                    if threads[i].ident is not None:
+                        # Stopped by itself after a frame capture failure.
+                        threads[i] = threading.Thread(target=target, args=(model,))
+                    threads[i].start()
 
     elif model.current_status != "halted":
         if cmd_code == "im":  # 'im' stands for "image capture"
-            capture_still_request(model)
+            try:
+                burst = parse_burst(cmd_param)
+            except ValueError:
+                burst = None
+                print("Invalid burst parameters, taking a single still: " + cmd_param)
+            if burst:
+                count, interval = burst
+                print(f"Starting burst of {count} stills...")
+                start_burst(model, count, interval)
+            else:
+                capture_still_request(model)
         elif cmd_code == "ca":  # 'ca' stands for "camera action" (start/stop video)
             if cmd_param.startswith("1"):
                 print("Starting video recording...")
                 toggle_cam_record(model, True)
-                if cmd_param[2:].isnumeric():
+                if cmd_param[2:].isnumeric() and model.capturing_video:
                     print(f"Record duration: {cmd_param[2:]}")
+                    # Stops in turn with the other commands, as if 'ca 0' was sent.
+                    start_record_timer(
+                        model,
+                        int(cmd_param[2:]),
+                        lambda: CameraCoreModel.command_queue.put([("ca", "0")]),
+                    )
             else:
                 print("Stopping video recording...")
                 toggle_cam_record(model, False)
+        elif cmd_code == "tl":  # 'tl' stands for "timelapse"
+            if cmd_param.startswith("1"):
+                print("Starting timelapse...")
+                start_timelapse(model, on_change=update_status_file)
+            else:
+                print("Stopping timelapse...")
+                stop_timelapse(model)
+        elif cmd_code == "tv":  # 'tv' sets the timelapse interval
+            # In tenths of a second, as RaspiMJPEG. Applies from the next timelapse.
+            if cmd_param.isnumeric() and int(cmd_param) > 0:
+                model.config["timelapse_interval"] = int(cmd_param) / 10
+            else:
+                print("Invalid timelapse interval: " + cmd_param)
         elif cmd_code == "md":  # 'md' stands for "motion detection"
             if (cmd_param == "0") or not cmd_param:
                 print("Stopping motion detection...")
                 model.motion_detection = False
+                stop_pre_event_buffer(model)
                 model.print_to_logfile("Internal motion detection stopped")
             else:
                 print("Starting motion detection...")
                 model.motion_detection = True
+                start_pre_event_buffer(model)
                 model.print_to_logfile("Internal motion detection started")
         elif cmd_code == "mx":
             # No implementation for Mode 1 yet.
@@ -213,51 +379,155 @@ def show_preview(cam):
     Args:
         cam: Camera instance used to generate preview.
     """
-    while cam.current_status != "halted":  # CameraCoreModel.process_running:
-        # Capture the current camera request
-        current_request = cam.capture_request()
-        # Generate a preview for the current frame
-        generate_preview(cam, current_request)
-        # Release the current request after processing
-        current_request.release()
-
+    scheduler = PreviewScheduler(cam)
+    cam.preview_scheduler = scheduler
+    config_version = cam.config_version
+    # Only the newest frame matters for the preview, skip any we fall behind on.
+    frames = cam.frame_hub.subscribe("preview", FrameSubscription.LATEST)
+    # Waits while the camera is in standby, exits once it is closed.
+    while cam.lifecycle.wait_until_running():
+        if cam.config_version != config_version:
+            # Pick up new preview rates from a config reload.
+            config_version = cam.config_version
+            scheduler = PreviewScheduler(cam)
+            cam.preview_scheduler = scheduler
+        # Sleep until the next preview is due at the current preview rate
+        if cam.preview_stream.clients:
+            scheduler.heartbeat()  # Someone is watching the stream.
+        delay = scheduler.time_until_due()
+        if delay > 0:
+            time.sleep(delay)
+        # Wait for the current frame, re-checking the status now and again
+        frame = frames.get(timeout=1.0)
+        if frame is None:
+            if frames.closed:
+                break  # Frame capture failed, restarted with 'ru 1'.
+            continue
+        # Generate a preview for the current frame, unless nothing has changed
+        if scheduler.should_publish(frame.request):
+            generate_preview(cam, frame.request)
+            scheduler.mark_published(frame.request)
+        # Release the current frame after processing
+        frame.release()
+    cam.frame_hub.unsubscribe(frames)
+
+
+def add_stats_sources(cam):
+    """
+    Adds the stats of the camera's workers and queues to its metrics. Each
+    is read through cam when a snapshot is taken, as they are replaced while
+    running.
 
-def start_background_process(config_filepath):
+    Args:
+        cam: CameraCoreModel instance.
+    """
+    metrics = cam.metrics
+    metrics.add_source("lifecycle", lambda: cam.lifecycle.stats())
+    metrics.add_source("frames", lambda: cam.frame_hub.stats())
+    metrics.add_source(
+        "preview", lambda: cam.preview_scheduler and cam.preview_scheduler.stats()
+    )
+    metrics.add_source(
+        "motion", lambda: cam.motion_detector and cam.motion_detector.stats()
+    )
+    metrics.add_source("stills", lambda: cam.still_worker and cam.still_worker.stats())
+    metrics.add_source("remux", lambda: cam.remux_pool and cam.remux_pool.stats())
+    metrics.add_source("thumbnails", lambda: cam.thumbnails.stats())
+    metrics.add_source("pre_event", lambda: cam.pre_event and cam.pre_event.stats())
+    metrics.add_source("log", lambda: cam.log_writer.stats())
+    metrics.add_source(
+        "commands", lambda: {"depth": CameraCoreModel.command_queue.qsize()}
+    )
+
+
+def start_background_process(
+    config_filepath, backend_name="picamera2", camera_num=None
+):
     """
     Main background process that sets up the camera and handles the command loop.
+    If the config selects several cameras, starts a CameraSupervisor instead,
+    which runs this for each camera in a process of its own.
 
     Args:
         config_filepath: Path to the configuration file.
+        backend_name: Name of the camera backend to use ('picamera2' or 'simulated').
+        camera_num: Camera to run alongside others, with its own files. None
+                    to run the cameras selected in the config.
     """
     print("Starting RasPyCam main process...")
-    all_cameras = (
-        Picamera2.global_camera_info()
-    )  # Get information about attached cameras
+    backend = load_backend(backend_name)
+    all_cameras = backend.global_camera_info()  # Get information about attached cameras
 
     # Check if any cameras are attached
     if not all_cameras:
         print("No attached cameras detected. Exiting program.")
         return
 
-    # Set up the first detected camera
-    first_cam = all_cameras[0]["Num"]
-    cam = CameraCoreModel(first_cam, config_filepath[0] if config_filepath else None)
+    config_path = config_filepath[0] if config_filepath else None
+    if camera_num is None:
+        # Set up the selected camera (by default the first detected one), or
+        # a supervisor running each of several.
+        config = CameraCoreModel.load_config(config_path)
+        camera_nums = select_cameras(config["cameras"], all_cameras)
+        if not camera_nums:
+            print("None of the selected cameras are attached. Exiting program.")
+            return
+        if len(camera_nums) > 1:
+            CameraSupervisor(config_filepath, backend_name, camera_nums, config).run()
+            return
+        cam = CameraCoreModel(camera_nums[0], config_path, backend)
+    else:
+        cam = CameraCoreModel(camera_num, config_path, backend, separate_files=True)
 
     # Setup FIFO for receiving commands
     if not setup_fifo(cam.config["control_file"]):
         cam.teardown()
         return
 
+    # Hold a write end of the FIFO open ourselves, so the read end never sees EOF
+    # when the web interface closes its end (which would leave select() spinning).
+    CameraCoreModel.fifo_keepalive_fd = os.open(
+        cam.config["control_file"], os.O_WRONLY | os.O_NONBLOCK
+    )
+    CameraCoreModel.wake_fds = os.pipe()
+
     # Setup motion pipe file
     setup_motion_pipe(cam.config["motion_pipe"])
 
     # Set the process to running
     CameraCoreModel.process_running = True
 
-    # Start a thread to continuously parse incoming commands
+    # Start a thread to wait for incoming commands
     cmd_processing_thread = threading.Thread(target=parse_incoming_commands)
     cmd_processing_thread.start()
 
+    # Convert and save stills in the background, so 'im' returns straight away.
+    cam.still_worker = StillWorker(
+        cam,
+        cam.config["still_workers"],
+        cam.config["still_queue_size"],
+        on_change=update_status_file,
+    )
+
+    # Make raw H.264 recordings into MP4s in the background, carrying on with
+    # any left from the last run.
+    cam.remux_pool = RemuxPool(
+        cam, cam.config["remux_workers"], cam.config["remux_queue"]
+    )
+
+    # Put a frame capture failure in the status file straight away.
+    cam.frame_hub.on_error = lambda error: report_capture_error(cam, error)
+    cam.frame_hub.on_first_frame = lambda: report_resume(cam)
+
+    # Serve the preview from memory, and push status changes, if configured.
+    preview_server = start_preview_server(cam)
+    status_server = start_status_server(cam)
+
+    # Write out the performance counters, and serve them, if configured.
+    add_stats_sources(cam)
+    stats_writer = start_stats_writer(cam)
+    metrics_server = start_metrics_server(cam)
+
     # Start another thread just for the preview.
     preview_thread = threading.Thread(target=show_preview, args=(cam,))
     preview_thread.start()
@@ -267,33 +537,67 @@ def start_background_process(config_filepath):
     md_thread.start()
 
     threads = [preview_thread, md_thread]
+
+    # Apply changes RPi Cam Web Interface makes to the user config as they're
+    # written, in turn with the other commands.
+    config_watcher = None
+    if cam.config_path and cam.config["user_config"]:
+        config_watcher = ConfigWatcher(
+            cam.config["user_config"],
+            lambda: CameraCoreModel.command_queue.put([("reload", "")]),
+        )
+        config_watcher.start()
+    if cam.motion_detection:
+        start_pre_event_buffer(cam)  # Motion detection was turned on at launch.
     update_status_file(cam)
 
-    # Execute commands off the queue as they come in.
+    # Execute commands off the queue as they come in. Blocks until the intake
+    # thread queues a batch of commands, or None once the process is stopping.
     while CameraCoreModel.process_running:
-        # Check if mutex lock can be acquired (i.e. FIFO thread is not writing to the command queue)
-        # before popping from the command queue and attempting to execute. If lock can't be acquiring,
-        # skip and check on the next loop cycle instead of blocking.
-        # Without being non-blocking, anyone spamming the FIFO with commands will freeze/delay this thread.
-        cmd_queue = CameraCoreModel.command_queue
-        cmd_queue_lock = CameraCoreModel.cmd_queue_lock
-        if (
-            (cmd_queue)
-            and (cmd_queue_lock.acquire(blocking=False))
-            and (cam.current_status)
-        ):
-            next_cmd = CameraCoreModel.command_queue.pop(0)  # Get the next command
-            cmd_queue_lock.release()
-            execute_command(next_cmd, cam, threads)
-
-        time.sleep(0.01)  # Small delay before next iteration
-
+        next_cmds = CameraCoreModel.command_queue.get()  # Get the next batch
+        if next_cmds is None:
+            break
+        cam.metrics.observe_depth(
+            "command_queue", CameraCoreModel.command_queue.qsize()
+        )
+        if isinstance(next_cmds, CommandBatch):
+            # Time from reading the commands to starting on them.
+            cam.metrics.observe("command_wait", time.monotonic() - next_cmds.received)
+        for next_cmd in next_cmds:
+            if cam.current_status:
+                with cam.metrics.timer("command_" + next_cmd[0]):
+                    execute_command(next_cmd, cam, threads)
+
+    if config_watcher:
+        config_watcher.stop()
     cam.current_status = "halted"
+    cam.stop_event.set()
+    cam.lifecycle.transition(CameraLifecycle.CLOSED)  # Lets the threads exit.
+    stop_process()  # Make sure the intake thread is woken if we stopped by ourselves.
     cmd_processing_thread.join()  # Wait for command processing thread to finish
     for t in threads:
         # Terminate preview and motion-detection threads.
         if t.is_alive():
             t.join()
+    stop_preview_server(cam, preview_server)
+    stop_timelapse(cam)  # Saves any frames already taken.
+    if cam.burst:
+        cam.burst.join()  # Bursts stop once the camera is halted.
+    cam.still_worker.stop()  # Finish saving any stills still in the queue.
+    cam.still_worker = None
     cam.teardown()  # Teardown the camera and stop it
+    cam.remux_pool.stop()  # Finish making recordings into MP4s.
+    cam.remux_pool = None
+    # Checkpoint the media index once nothing else will change the media folders.
+    cam.media_index.close(cam.still_image_index, cam.video_file_index)
     update_status_file(cam)  # Update the status file with halted status
+    stop_status_server(cam, status_server)
+    stop_metrics_server(metrics_server)
+    stop_stats_writer(stats_writer)  # Writes the final counters.
     os.close(CameraCoreModel.fifo_fd)  # Close the FIFO pipe
+    os.close(CameraCoreModel.fifo_keepalive_fd)
+    for fd in CameraCoreModel.wake_fds:
+        os.close(fd)
+    CameraCoreModel.wake_fds = None
+    CameraCoreModel.command_queue = queue.Queue()  # Drop anything left unexecuted.
+    cam.log_writer.stop()  # Write out the last of the log.
@@ -0,0 +1,130 @@
+import os
+import threading
+
+# Settings the camera's streams are configured with, so changing them means
+# stopping the camera to configure it again.
+STREAM_KEYS = ["video_width", "video_height", "preview_source"]
+
+# Settings only used while starting up, which need the program restarting.
+STARTUP_KEYS = [
+    "control_file",
+    "motion_pipe",
+    "status_file",
+    "status_socket",
+    "preview_stream",
+    "stats_file",
+    "metrics_socket",
+    "still_workers",
+    "still_queue_size",
+    "raw_develop_threads",
+    "raw_tile_rows",
+    "burst_buffers",
+    "remux_workers",
+    "remux_queue",
+    "media_index",
+    "user_config",
+    "autostart",
+    "motion_detection",
+    "cameras",
+]
+
+
+class ConfigWatcher:
+    """
+    Watches a file for changes by its modification time, calling on_change
+    from its own thread whenever it is written or created. Polled, as RPi Cam
+    Web Interface replaces the user config rather than writing it in place.
+    """
+
+    def __init__(self, path, on_change, interval=1.0):
+        """
+        Args:
+            path: Path of the file to watch.
+            on_change: Called with no arguments after each change.
+            interval: Seconds between checks.
+        """
+        self.path = path
+        self.on_change = on_change
+        self.interval = interval
+        self.changes = 0  # Changes seen.
+        self._mtime = self._read_mtime()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+
+    def _read_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def start(self):
+        self._thread.start()
+
+    def check(self):
+        """Calls on_change if the file changed since the last check."""
+        mtime = self._read_mtime()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is not None:
+            self.changes += 1
+            self.on_change()
+        return True
+
+    def _work(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+
+
+def changed_settings(running_config, new_config):
+    """Returns the keys of the settings that differ between two configs."""
+    return [key for key in new_config if new_config[key] != running_config.get(key)]
+
+
+def needs_stream_reconfigure(running_config, changed):
+    """
+    Returns whether the changed settings need the camera's streams configuring
+    again. The preview size only does when the ISP makes the preview.
+    """
+    if any(key in STREAM_KEYS for key in changed):
+        return True
+    return ("preview_size" in changed) and (running_config["preview_source"] == "lores")
+
+
+def apply_config_changes(cam, new_config):
+    """
+    Applies the settings in new_config that differ from the running config.
+    Those that can change while running take effect straight away: motion,
+    preview and log settings are picked up by the threads using them, output
+    paths from the next file and the bitrate from the next recording. Settings
+    only read on start up are logged and left as they are.
+
+    Args:
+        cam: CameraCoreModel instance.
+        new_config: Config read from the config files, e.g. by reload_config().
+
+    Returns:
+        (changed keys applied, whether the streams need configuring again).
+    """
+    changed = changed_settings(cam.config, new_config)
+    startup = [key for key in changed if key in STARTUP_KEYS]
+    if startup:
+        print("Settings that only apply on restart changed: " + ", ".join(startup))
+        cam.print_to_logfile("Restart to apply " + ", ".join(startup))
+    applied = [key for key in changed if key not in STARTUP_KEYS]
+    if not applied:
+        return [], False
+    reconfigure = needs_stream_reconfigure(cam.config, applied)
+    cam.config.update((key, new_config[key]) for key in applied)
+    if "preview_size" in applied:
+        cam.thumbnails.size = tuple(cam.config["preview_size"])
+    cam.make_output_directories()
+    cam.config_version += 1  # Lets the preview and motion threads notice.
+    print("Settings changed: " + ", ".join(applied))
+    cam.print_to_logfile("Settings changed: " + ", ".join(applied))
+    return applied, reconfigure
@@ -0,0 +1,141 @@
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+
+
+class StatusPublisher:
+    """
+    Publishes the camera status to the status file, only when it changes.
+    The file is written to a temporary file and renamed into place, so the
+    web interface never reads it empty or cut short, and anything watching
+    it with inotify sees one IN_MOVED_TO per change. Each change is also
+    timestamped and handed to any clients of the status socket.
+    """
+
+    HISTORY = 64  # Changes kept for socket clients that fall behind.
+
+    def __init__(self, path):
+        self.path = path
+        self.status = None  # Last status published.
+        self.changed_at = None  # Wall clock time of the last change.
+        self.transitions = 0  # Number of changes published.
+        self.closed = False
+        self._history = deque(maxlen=self.HISTORY)  # (transition, status, time).
+        self._made_dir = False
+        self._cond = threading.Condition()
+
+    def publish(self, status):
+        """
+        Writes status to the status file if it differs from the last one.
+
+        Returns:
+            Whether the status changed.
+        """
+        with self._cond:
+            if status == self.status:
+                return False
+            if not self._made_dir:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._made_dir = True
+            part_path = self.path + ".part"
+            with open(part_path, "w") as status_file:
+                status_file.write(status)
+            os.replace(part_path, self.path)
+            self.status = status
+            self.changed_at = time.time()
+            self.transitions += 1
+            self._history.append((self.transitions, status, self.changed_at))
+            self._cond.notify_all()
+            return True
+
+    def wait_for_changes(self, last_transition, timeout=None):
+        """
+        Waits for changes after the given number of transitions.
+
+        Returns:
+            ([(status, changed_at), ...], transitions), with no changes on
+            timeout or once closed.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.transitions != last_transition or self.closed, timeout
+            )
+            if self.closed:
+                return [], last_transition
+            changes = [
+                (status, changed_at)
+                for n, status, changed_at in self._history
+                if n > last_transition
+            ]
+            return changes, self.transitions
+
+    def close(self):
+        """Wakes all socket clients so they disconnect."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+
+class StatusStreamHandler(socketserver.StreamRequestHandler):
+    """
+    Sends a status socket client the current status, then each change as it
+    happens, one per line as '<status> <unix time of the change>'.
+    """
+
+    def handle(self):
+        publisher = self.server.publisher
+        # Start with the current status.
+        transitions = max(publisher.transitions - 1, 0)
+        try:
+            while not publisher.closed:
+                changes, transitions = publisher.wait_for_changes(
+                    transitions, timeout=1.0
+                )
+                for status, changed_at in changes:
+                    self.wfile.write(b"%s %.6f\n" % (status.encode(), changed_at))
+                if changes:
+                    self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # Client went away.
+
+
+class UnixStatusServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def start_status_server(cam):
+    """
+    Starts sending status changes to clients of the status_socket, in its own thread.
+
+    Returns:
+        The server, or None if the socket is not configured or could not start.
+    """
+    path = cam.config["status_socket"]
+    if not path:
+        return None
+    try:
+        if os.path.exists(path):
+            os.remove(path)  # Left over from a previous run.
+        server = UnixStatusServer(path, StatusStreamHandler)
+        os.chmod(path, 0o666)  # Let the web server connect.
+    except OSError as e:
+        print("ERROR: Could not start status socket. " + str(e))
+        cam.print_to_logfile("Status socket failed to start")
+        return None
+    server.publisher = cam.status_publisher
+    threading.Thread(target=server.serve_forever).start()
+    print("Sending status changes on " + path)
+    return server
+
+
+def stop_status_server(cam, server):
+    """Disconnects all status clients and shuts the server down."""
+    if server is None:
+        return
+    cam.status_publisher.close()
+    server.shutdown()
+    server.server_close()
+    if os.path.exists(server.server_address):
+        os.remove(server.server_address)
@@ -0,0 +1,263 @@
+import multiprocessing
+import os
+import select
+import socket
+import threading
+import time
+
+from core.camera_paths import camera_paths
+from core.model import CameraCoreModel
+from core.status import StatusPublisher
+
+
+def status_rank(status):
+    """Ranks a camera's status by how much it matters in the combined status."""
+    if not status or status == "halted":
+        return 0
+    if status.startswith("Error"):
+        return 6
+    if "video" in status:
+        return 5
+    if status == "image":
+        return 4
+    if status.startswith("tl") or status == "timelapse":
+        return 3
+    if status.startswith("md"):
+        return 2
+    return 1
+
+
+def combined_status(statuses):
+    """
+    Combines the statuses of several cameras into one for the status file:
+    any error, otherwise the busiest camera's status (recording over taking
+    stills over timelapse over motion detection over ready), or 'halted' if
+    no camera is running.
+    """
+    status = max(statuses, key=status_rank, default=None)
+    return status if status_rank(status) else "halted"
+
+
+def pipe_chunks(batch):
+    """Splits a batch of commands into whole lines of up to PIPE_BUF bytes."""
+    chunks = [b""]
+    for line in batch.splitlines(keepends=True):
+        if chunks[-1] and (len(chunks[-1]) + len(line) > select.PIPE_BUF):
+            chunks.append(b"")
+        chunks[-1] += line
+    return chunks
+
+
+def run_camera(config_filepath, backend_name, camera_num):
+    """Runs one camera's pipeline in a process of its own."""
+    from core.process import start_background_process
+
+    start_background_process(config_filepath, backend_name, camera_num)
+
+
+class CameraSupervisor:
+    """
+    Runs a pipeline for each of several cameras, each in its own process so
+    they don't share a GIL, with its own control file, status file and media
+    folders (see camera_paths()). The supervisor reads commands from the
+    main control file and passes them on: a command prefixed with a camera
+    number ('1:ca 1') goes to that camera, any other to every camera. Each
+    camera's status changes are followed through its status socket and
+    combined into the main status file. A camera process that fails is
+    started again, waiting longer after each failure in a row.
+    """
+
+    RESTART_DELAY = 1.0  # Seconds before starting a failed camera again.
+    RESTART_MAX_DELAY = 60.0
+    STABLE_TIME = 60.0  # Seconds running after which a camera's delay is reset.
+
+    def __init__(self, config_filepath, backend_name, camera_nums, config):
+        """
+        Args:
+            config_filepath: As given to start_background_process().
+            backend_name: Name of the camera backend the cameras use.
+            camera_nums: Numbers of the cameras to run.
+            config: Config read from the config files.
+        """
+        self.config_filepath = config_filepath
+        self.backend_name = backend_name
+        self.config = config
+        self.cameras = dict((num, camera_paths(config, num)) for num in camera_nums)
+        self.statuses = dict((num, None) for num in camera_nums)
+        self.restarts = dict((num, 0) for num in camera_nums)
+        self.status_publisher = StatusPublisher(config["status_file"])
+        self._processes = {}
+        self._started_at = {}
+        self._restart_at = {}  # Camera number -> when to start it again.
+        self._delays = dict((num, self.RESTART_DELAY) for num in camera_nums)
+        self._fifo_partial = b""
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._context = multiprocessing.get_context("spawn")  # No forked libcamera.
+
+    def _start_camera(self, num):
+        process = self._context.Process(
+            target=run_camera,
+            args=(self.config_filepath, self.backend_name, num),
+            name="camera" + str(num),
+        )
+        process.start()
+        self._processes[num] = process
+        self._started_at[num] = time.monotonic()
+        print("Started camera %d, process %d" % (num, process.pid))
+
+    def _follow_status(self, num):
+        """Follows a camera's status changes through its status socket until stopped."""
+        path = self.cameras[num]["status_socket"]
+        while not self._stopping.is_set():
+            try:
+                client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                client.connect(path)
+            except OSError:
+                client.close()
+                self._stopping.wait(0.5)  # Not started yet.
+                continue
+            try:
+                with client, client.makefile("rb") as lines:
+                    for line in lines:
+                        self._set_status(num, line.split()[0].decode())
+            except OSError:
+                pass  # Reset as the camera process ended.
+            self._set_status(num, None)  # The camera stopped.
+
+    def _set_status(self, num, status):
+        with self._lock:
+            self.statuses[num] = status
+            self.status_publisher.publish(combined_status(self.statuses.values()))
+
+    def route(self, data):
+        """
+        Passes the commands in data (bytes read from the main control file) on
+        to the cameras' control files.
+        """
+        lines = (self._fifo_partial + data).split(b"\n")
+        self._fifo_partial = lines.pop()
+        batches = dict((num, b"") for num in self.cameras)
+        for line in lines:
+            if not line.strip():
+                continue
+            target, sep, command = line.partition(b":")
+            if sep and target.strip().isdigit():
+                if int(target) not in batches:
+                    print(
+                        "No such camera for command: " + line.decode(errors="replace")
+                    )
+                    continue
+                batches[int(target)] += command.strip() + b"\n"
+            else:
+                for num in batches:
+                    batches[num] += line.strip() + b"\n"
+        for num, batch in batches.items():
+            if batch.strip():
+                self._send(num, batch)
+
+    def _send(self, num, batch):
+        try:
+            fd = os.open(self.cameras[num]["control_file"], os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            print("Camera %d is not reading commands, dropped them." % num)
+            return
+        chunks = pipe_chunks(batch)
+        try:
+            # Written in whole lines of up to PIPE_BUF bytes, which a pipe
+            # takes all or none of, so a command is never cut in half.
+            while chunks:
+                os.write(fd, chunks[0])
+                chunks.pop(0)
+        except OSError as e:
+            # The camera's pipe is full, it isn't keeping up with its commands.
+            dropped = b"".join(chunks).decode(errors="replace").strip()
+            print("Camera %d is busy, dropped commands: %s (%s)" % (num, dropped, e))
+        finally:
+            os.close(fd)
+
+    def _check_cameras(self):
+        """Schedules failed cameras to start again, and starts those due."""
+        now = time.monotonic()
+        for num, process in list(self._processes.items()):
+            if process.is_alive() or (num in self._restart_at):
+                continue
+            if process.exitcode == 0:
+                continue  # Stopped by itself, e.g. no camera.
+            if now - self._started_at[num] > self.STABLE_TIME:
+                self._delays[num] = self.RESTART_DELAY
+            print(
+                "Camera %d stopped with exit code %s, starting again in %.0f s"
+                % (num, process.exitcode, self._delays[num])
+            )
+            self._restart_at[num] = now + self._delays[num]
+            self._delays[num] = min(self._delays[num] * 2, self.RESTART_MAX_DELAY)
+        for num, due in list(self._restart_at.items()):
+            if now >= due:
+                del self._restart_at[num]
+                self.restarts[num] += 1
+                self._start_camera(num)
+
+    def _timeout(self):
+        if not self._restart_at:
+            return None
+        return max(min(self._restart_at.values()) - time.monotonic(), 0)
+
+    def run(self):
+        """Runs the cameras until the process is stopped."""
+        from core.process import setup_fifo
+
+        if not setup_fifo(self.config["control_file"]):
+            return
+        fifo_fd = CameraCoreModel.fifo_fd
+        keepalive_fd = os.open(self.config["control_file"], os.O_WRONLY | os.O_NONBLOCK)
+        CameraCoreModel.wake_fds = os.pipe()
+        CameraCoreModel.process_running = True
+        self.status_publisher.publish("halted")
+        followers = []
+        for num in self.cameras:
+            self._start_camera(num)
+            follower = threading.Thread(target=self._follow_status, args=(num,))
+            follower.start()
+            followers.append(follower)
+
+        # Wakes for commands, a camera process ending or a restart coming due.
+        wake_fd = CameraCoreModel.wake_fds[0]
+        while CameraCoreModel.process_running:
+            sentinels = [p.sentinel for p in self._processes.values() if p.is_alive()]
+            # Any camera that ended before its sentinel was listed is
+            # scheduled now, so its restart is in the timeout.
+            self._check_cameras()
+            readable, _, _ = select.select(
+                [fifo_fd, wake_fd] + sentinels, [], [], self._timeout()
+            )
+            if (wake_fd in readable) or (not CameraCoreModel.process_running):
+                break
+            if fifo_fd in readable:
+                try:
+                    self.route(
+                        os.read(
+                            fifo_fd,
+                            CameraCoreModel.MAX_COMMAND_LEN * CameraCoreModel.FIFO_MAX,
+                        )
+                    )
+                except BlockingIOError:
+                    pass
+
+        print("Stopping cameras...")
+        for process in self._processes.values():
+            if process.is_alive():
+                process.terminate()  # SIGTERM, which each camera handles cleanly.
+        for process in self._processes.values():
+            process.join(30)
+            if process.is_alive():
+                process.kill()
+        self._stopping.set()
+        for follower in followers:
+            follower.join()
+        self.status_publisher.publish("halted")
+        os.close(fifo_fd)
+        os.close(keepalive_fd)
+        for fd in CameraCoreModel.wake_fds:
+            os.close(fd)
+        CameraCoreModel.wake_fds = None
@@ -0,0 +1,89 @@
+import io
+import os
+import queue
+import threading
+
+from PIL import Image
+
+
+class ThumbnailWriter:
+    """
+    Writes thumbnails from a background thread, so nothing making them ever
+    waits on the file system. Each thumbnail is written to a temporary file
+    and renamed into place, so the web interface never reads half of one.
+    Images are downscaled by make() on the thread that has them, so only the
+    small copy waits in the queue.
+    """
+
+    def __init__(self, size, quality=85):
+        """
+        Args:
+            size: (width, height) the thumbnails are made to fit.
+            quality: JPEG quality of thumbnails made from images.
+        """
+        self.size = tuple(size)
+        self.quality = quality
+        self.written = 0
+        self.failed = 0
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def make(self, image):
+        """Returns a copy of a PIL image downscaled to fit the thumbnail size."""
+        thumbnail = image.copy()
+        thumbnail.thumbnail(self.size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        return thumbnail
+
+    def submit(self, path, source):
+        """
+        Queues a thumbnail to be written to path.
+
+        Args:
+            path: Path of the thumbnail.
+            source: JPEG bytes to write as they are, or a PIL image from make().
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work)
+                self._thread.start()
+        self._jobs.put((path, source))
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            path, source = job
+            try:
+                self._write(path, source)
+                self.written += 1
+            except OSError as e:
+                print("ERROR: Failed to write thumbnail " + path + ": " + str(e))
+                self.failed += 1
+
+    def _write(self, path, source):
+        if isinstance(source, Image.Image):
+            encoded = io.BytesIO()
+            source.convert("RGB").save(encoded, format="JPEG", quality=self.quality)
+            source = encoded.getvalue()
+        part_path = path + ".part"
+        with open(part_path, "wb") as part_file:
+            part_file.write(source)
+        os.replace(part_path, path)
+
+    def stats(self):
+        """Returns the number of thumbnails waiting, written and failed."""
+        return {
+            "depth": self._jobs.qsize(),
+            "written": self.written,
+            "failed": self.failed,
+        }
+
+    def stop(self):
+        """Waits for every queued thumbnail to be written, then stops the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._jobs.put(None)
+            thread.join()
@@ -1,4 +1,6 @@
 import argparse
+import multiprocessing
+from core.backend import BACKEND_NAMES
 from core.process import start_background_process
 
 
@@ -6,12 +8,15 @@ def main(args):
     """Main function to start the background process using provided config file."""
     config_filepath = args.config_filepath
     try:
-        start_background_process(config_filepath)
+        start_background_process(config_filepath, args.backend)
     except KeyboardInterrupt:
         print("Server stopped.")
 
 
 if __name__ == "__main__":
+    # Lets the camera and motion processes start from the PyInstaller build,
+    # which would otherwise run main again in each of them.
+    multiprocessing.freeze_support()
     # Argument parser for reading config file from command line input
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -21,5 +26,12 @@ if __name__ == "__main__":
         dest="config_filepath",
         help="Provide a filepath to the configuration file. If none provided, will use defaults.",
     )
+    parser.add_argument(
+        "--backend",
+        default="picamera2",
+        choices=BACKEND_NAMES,
+        dest="backend",
+        help="Camera backend to use. 'simulated' runs on synthetic frames without a camera.",
+    )
     args = parser.parse_args()
     main(args)
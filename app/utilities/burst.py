@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from core.frame_hub import FrameSubscription
+from utilities.capture import StillJob, save_still
+
+# Camera buffers a full rate burst leaves for everything else: the preview and
+# motion detection frames, one-off stills, and the frame being encoded while
+# recording. Queued burst frames are held camera buffers, so only the rest of
+# the camera's buffers can be queued without stalling capture.
+RESERVED_BUFFERS = 4
+
+
+class FrameRing:
+    """
+    Fixed set of raw frame buffers, allocated once and reused by every burst,
+    so capturing a burst frame is just a copy into a free buffer.
+    """
+
+    def __init__(self, slots, shape):
+        """
+        Args:
+            slots: Number of buffers.
+            shape: (height, stride) of the raw frames, in bytes.
+        """
+        self.shape = tuple(shape)
+        self.buffers = [np.empty(self.shape, dtype=np.uint8) for _ in range(slots)]
+        self._free = deque(range(slots))
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Returns the index of a free buffer, or None if all are in use."""
+        with self._lock:
+            return self._free.popleft() if self._free else None
+
+    def release(self, slot):
+        """Hands a buffer back to the ring."""
+        with self._lock:
+            self._free.append(slot)
+
+    def free(self):
+        with self._lock:
+            return len(self._free)
+
+
+def parse_burst(cmd_param):
+    """
+    Parses the parameters of an 'im' command: none for a single still,
+    '<count>' for a burst at the camera's full frame rate, or
+    '<count> <interval in ms>' for a burst at a set interval.
+
+    Returns:
+        (count, interval in seconds), or None for a single still.
+    """
+    parts = cmd_param.split()
+    if not parts:
+        return None
+    count = int(parts[0])
+    interval = (float(parts[1]) / 1000) if len(parts) > 1 else 0.0
+    if count < 1 or interval < 0:
+        raise ValueError("Burst count must be positive and interval not negative")
+    return count, interval
+
+
+class BurstCapture:
+    """
+    Captures 'count' stills, one per camera frame or one every 'interval'
+    seconds, from its own thread. Each raw frame is copied into a FrameRing
+    buffer and queued on the camera's StillWorker, so frames are developed and
+    saved in parallel while the burst carries on. A shot is dropped (rather
+    than waited for) if every ring buffer is still being saved; at the full
+    frame rate, frames the burst fell behind on count as dropped too.
+    """
+
+    def __init__(self, cam, count, interval=0.0):
+        self.cam = cam
+        self.count = count
+        self.interval = interval
+        self.captured = 0  # Stills captured and queued for saving.
+        self.dropped = 0  # Shots missed because no buffer was free or we fell behind.
+        self.fps = 0.0  # Achieved rate between the first and last captured frames.
+        self.running = False
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        if self.cam.still_worker:
+            self.cam.still_worker.hold()  # Keep the 'image' status for the whole burst.
+        self._thread = threading.Thread(target=self._run)
+        self._thread.start()
+
+    def join(self):
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _ring(self):
+        """Returns the camera's FrameRing, allocating it the first time."""
+        config = self.cam.picam2.camera_configuration()["raw"]
+        width, height = config["size"]
+        stride = config.get("stride", width * 2)
+        ring = self.cam.burst_ring
+        if (ring is None) or (ring.shape != (height, stride)):
+            ring = FrameRing(self.cam.config["burst_buffers"], (height, stride))
+            self.cam.burst_ring = ring
+        return ring, config
+
+    def _copy_raw(self, request, buffer):
+        """Copies the raw stream of a request straight into a ring buffer."""
+        with self.cam.backend.mapped_array(request, "raw", reshape=False) as mapped:
+            flat = buffer.reshape(-1)
+            np.copyto(flat, mapped.array[: flat.size])
+
+    def _run(self):
+        cam = self.cam
+        ring, raw_config = self._ring()
+        # At full rate every frame is a shot, so queue a few of them; at an
+        # interval only the newest frame when the shot is due matters.
+        if self.interval:
+            frames = cam.frame_hub.subscribe("burst", FrameSubscription.LATEST)
+        else:
+            buffer_count = cam.picam2.camera_configuration()["buffer_count"]
+            queued = max(min(len(ring.buffers), buffer_count - RESERVED_BUFFERS), 1)
+            frames = cam.frame_hub.subscribe(
+                "burst", FrameSubscription.QUEUE, maxlen=queued
+            )
+        first_ts = last_ts = None
+        next_due = time.monotonic()
+        shots = 0
+        try:
+            while shots < self.count and not cam.stop_event.is_set():
+                if self.interval:
+                    delay = next_due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    next_due += self.interval  # Scheduled off the start, so no drift.
+                frame = frames.get(timeout=2.0)
+                if frame is None:
+                    break
+                shots += 1
+                slot = ring.acquire()
+                if slot is None:
+                    self.dropped += 1
+                    frame.release()
+                    continue
+                self._copy_raw(frame.request, ring.buffers[slot])
+                metadata = frame.request.get_metadata()
+                frame.release()
+                timestamp = metadata.get("SensorTimestamp", time.monotonic_ns())
+                first_ts = timestamp if first_ts is None else first_ts
+                last_ts = timestamp
+                image_path, index = cam.claim_image(cam.config["image_output_path"])
+                job = StillJob(
+                    image_path,
+                    index,
+                    ring.buffers[slot],
+                    raw_config,
+                    metadata,
+                    on_raw_done=lambda slot=slot: ring.release(slot),
+                )
+                self.captured += 1
+                if cam.still_worker:
+                    cam.still_worker.submit(job, bounded=False)
+                else:
+                    save_still(cam, job)
+        finally:
+            if not self.interval:
+                self.dropped += frames.dropped
+            cam.frame_hub.unsubscribe(frames)
+            if self.captured > 1 and last_ts > first_ts:
+                self.fps = (self.captured - 1) / ((last_ts - first_ts) / 1e9)
+            self.running = False
+            report = "Burst captured %d of %d stills at %.1f fps, %d dropped" % (
+                self.captured,
+                self.count,
+                self.fps,
+                self.dropped,
+            )
+            print(report)
+            cam.print_to_logfile(report)
+            if cam.still_worker:
+                cam.still_worker.unhold()
+
+
+def start_burst(cam, count, interval=0.0):
+    """
+    Starts a burst of stills in the background, unless one is already running.
+
+    Returns:
+        The BurstCapture, or None if a burst is already running.
+    """
+    if cam.burst and cam.burst.running:
+        print("ERROR: A burst is already in progress.")
+        cam.print_to_logfile("Burst ignored, one already in progress")
+        return None
+    if cam.burst:
+        cam.burst.join()
+    cam.burst = BurstCapture(cam, count, interval)
+    cam.burst.start()
+    return cam.burst
@@ -1,49 +1,289 @@
-import cv2
+import queue
+import threading
+import time
+
+from core.metrics import timed
 from PIL import Image
+from utilities.raw_develop import RawDeveloper
 
 
+@timed("still")
 def capture_still_request(cam):
     """
-    Captures and saves a still image from the camera's lores stream.
+    Captures a still image from the camera's raw stream. The raw frame is
+    grabbed straight away and handed to cam.still_worker to be converted and
+    saved in the background, so the command loop is not held up. Without a
+    still worker the still is converted and saved before returning.
 
     Args:
         cam: CameraCoreModel instance.
-        request: Camera capture request containing the image data.
     """
     print("Taking still image...")
-    metadata = cam.picam2.capture_metadata()
-    img_array = cam.picam2.capture_array("raw")  # Extract raw image data.
-    image_path = cam.make_filename(
-        cam.config["image_output_path"]
-    )  # Generate output file name
-
-    # Convert the lores YUV image to RGB for saving as JPG
-    # NO LONGER USED.... But Bayer conversion also isn't done yet.
-
-    # img_array = request.make_array(
-    #    "lores"
-    # )  # Extract the low-resolution image data from the request
-    # lores_to_rgb = cv2.cvtColor(
-    #    img_array, cv2.COLOR_YUV420p2BGR
-    # )  # Convert YUV to RGB using OpenCV
-    # converted_image = Image.fromarray(
-    #    lores_to_rgb
-    # )  # Create a PIL Image from the RGB array
-
-    # Convert Bayer image to RGB for saving as JPG
-    # NOT COMPLETE!!
-    # This will get a JPG, but it's rubbish and obvously requires more
-    # processing. But at least it represents some of the processing
-    # power needed to do the full conversion for testing purposes.
-    bayer_to_rgb = cv2.cvtColor(
-        img_array, cv2.COLOR_BayerRG2BGR
-    )  # Convert Bayer image to RGB using OpenCV.
-    converted_image = Image.fromarray(
-        bayer_to_rgb
-    )  # Create a PIL Image from the RGB array
+    start = time.monotonic()
+    # Take the raw data and metadata from the same frame the preview and motion
+    # detection are getting, rather than capturing twice.
+    frame = cam.frame_hub.next_frame(timeout=5.0)
+    if frame is None:
+        print("ERROR: No frame available for still capture.")
+        cam.print_to_logfile("Still capture failed, no frame available")
+        return
+    metadata = frame.request.get_metadata()
+    img_array = frame.request.make_array("raw")  # Extract raw image data.
+    frame.release()
+    raw_config = cam.picam2.camera_configuration()["raw"]
+    # Take a place in the queue before claiming an index, so a dropped still
+    # doesn't leave a gap in the image numbers.
+    if cam.still_worker and not cam.still_worker.reserve():
+        return
+    # Name the file and claim its index now, so stills still being saved don't share one.
+    image_path, index = cam.claim_image(cam.config["image_output_path"])
+
+    job = StillJob(image_path, index, img_array, raw_config, metadata)
+    job.timings["capture"] = time.monotonic() - start
+    if cam.still_worker:
+        cam.still_worker.submit(job, reserved=True)
+    else:
+        save_still(cam, job)
+
+
+class StillJob:
+    """A captured raw frame waiting to be turned into a still image file."""
+
+    def __init__(self, image_path, index, raw, raw_config, metadata, on_raw_done=None):
+        """
+        Args:
+            image_path: Path to save the image to.
+            index: Image index claimed for the image, for its thumbnail name.
+            raw: Raw frame buffer, (height, stride) uint8.
+            raw_config: Configuration of the raw stream the frame came from.
+            metadata: Metadata of the frame.
+            on_raw_done: Function called once the raw buffer is no longer needed.
+        """
+        self.image_path = image_path
+        self.index = index
+        self.raw = raw
+        self.raw_size = raw_config["size"]
+        self.raw_format = raw_config["format"]
+        self.metadata = metadata
+        self.on_raw_done = on_raw_done
+        self.timings = {}  # Seconds spent in each stage.
+
+    def drop_raw(self):
+        """Lets go of the raw frame, e.g. handing its buffer back to a FrameRing."""
+        self.raw = None
+        if self.on_raw_done:
+            self.on_raw_done()
+            self.on_raw_done = None
+
+
+def save_still(cam, job, developer=None):
+    """
+    Develops a captured raw frame to RGB and saves it and its thumbnail.
+
+    Args:
+        cam: CameraCoreModel instance.
+        job: StillJob to save.
+        developer: RawDeveloper to use, or None to develop on this thread alone.
+    """
+    start = time.monotonic()
+    if developer is None:
+        developer = RawDeveloper(threads=1, tile_rows=cam.config["raw_tile_rows"])
+    width, height = job.raw_size
+    rgb = developer.develop(job.raw, width, height, job.raw_format, job.metadata)
+    converted_image = Image.fromarray(rgb)  # Create a PIL Image from the RGB array
+    job.drop_raw()  # Let go of the raw frame as soon as possible.
+    job.timings["convert"] = time.monotonic() - start
 
     # Save the converted image using camera helper functions
-    cam.picam2.helpers.save(converted_image, metadata, image_path)
+    start = time.monotonic()
+    cam.picam2.helpers.save(converted_image, job.metadata, job.image_path)
+    job.timings["save"] = time.monotonic() - start
 
     # Save a thumbnail for this image.
-    cam.generate_thumbnail("i", image_path)
+    start = time.monotonic()
+    cam.generate_thumbnail("i", job.image_path, job.index, converted_image)
+    job.timings["thumbnail"] = time.monotonic() - start
+
+
+class StillWorker:
+    """
+    Bounded pool of threads that convert, encode and save captured stills.
+    At most 'max_pending' stills are waiting or being saved at once; stills
+    captured beyond that are dropped rather than making the command loop wait.
+    The camera's capturing_still flag is set while any still is unsaved or a
+    burst is in progress, and 'on_change' is called (e.g. to update the status
+    file) when it changes.
+    """
+
+    STAGES = ["capture", "convert", "save", "thumbnail"]
+
+    def __init__(self, cam, workers=2, max_pending=4, on_change=None):
+        """
+        Args:
+            cam: CameraCoreModel instance.
+            workers: Number of stills saved in parallel.
+            max_pending: Most stills waiting or being saved at once.
+            on_change: Function called with cam when capturing_still changes.
+        """
+        self.cam = cam
+        # Shared by the worker threads, each still's tiles are developed in parallel.
+        self.developer = RawDeveloper(
+            cam.config["raw_develop_threads"], cam.config["raw_tile_rows"]
+        )
+        self.max_pending = max(int(max_pending), 1)
+        self.on_change = on_change
+        self.pending = 0  # Stills queued or being saved.
+        self.holds = 0  # Bursts in progress, see hold().
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0  # Stills dropped because the queue was full.
+        self.totals = dict((stage, 0.0) for stage in self.STAGES)
+        self.last = dict((stage, 0.0) for stage in self.STAGES)
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        self._threads = []
+        for _ in range(max(int(workers), 1)):
+            thread = threading.Thread(target=self._work)
+            thread.start()
+            self._threads.append(thread)
+
+    def reserve(self, bounded=True):
+        """
+        Takes a place in the queue for a still about to be submitted, without
+        waiting, so it can be dropped before its file is named.
+
+        Args:
+            bounded: Whether to drop the still if max_pending are already
+                     pending. Bursts are already bounded by their FrameRing.
+        Returns:
+            False if the still was dropped because too many are pending.
+        """
+        with self._lock:
+            full = bounded and (self.pending >= self.max_pending)
+            if full:
+                self.rejected += 1
+            else:
+                self.pending += 1
+                started = self._set_capturing()
+        if full:
+            print("ERROR: Still capture queue full, dropping still.")
+            self.cam.print_to_logfile("Still capture queue full")
+            return False
+        if started:
+            self._changed()
+        return True
+
+    def submit(self, job, bounded=True, reserved=False):
+        """
+        Queues a StillJob without waiting.
+
+        Args:
+            job: StillJob to save.
+            bounded: As for reserve().
+            reserved: Whether a place was already taken with reserve().
+        Returns:
+            False if the still was dropped because too many are pending.
+        """
+        if not (reserved or self.reserve(bounded)):
+            return False
+        self._jobs.put(job)
+        return True
+
+    def hold(self):
+        """Keeps capturing_still set, e.g. for the length of a burst, until unhold()."""
+        with self._lock:
+            self.holds += 1
+            started = self._set_capturing()
+        if started:
+            self._changed()
+
+    def unhold(self):
+        with self._lock:
+            self.holds -= 1
+            idle = self._clear_capturing()
+        if idle:
+            self._changed()
+
+    def _set_capturing(self):
+        """Sets capturing_still, returning whether it was clear. Call with the lock held."""
+        started = not self.cam.capturing_still
+        self.cam.capturing_still = True
+        return started
+
+    def _clear_capturing(self):
+        """Clears capturing_still if nothing is pending or held. Call with the lock held."""
+        idle = (self.pending == 0) and (self.holds == 0)
+        if idle:
+            self.cam.capturing_still = False
+        return idle
+
+    def _work(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            try:
+                save_still(self.cam, job, self.developer)
+                ok = True
+            except Exception as e:
+                print("ERROR: Saving still " + job.image_path + " failed. " + str(e))
+                self.cam.print_to_logfile("Still capture failed")
+                job.drop_raw()
+                ok = False
+            with self._lock:
+                self.pending -= 1
+                if ok:
+                    self.completed += 1
+                    for stage, seconds in job.timings.items():
+                        self.totals[stage] += seconds
+                        self.last[stage] = seconds
+                else:
+                    self.failed += 1
+                depth = self.pending
+                idle = self._clear_capturing()
+            if ok:
+                print(
+                    "Saved still "
+                    + job.image_path
+                    + " (queue depth "
+                    + str(depth)
+                    + ", "
+                    + ", ".join(
+                        "%s %.0f ms" % (stage, 1000 * job.timings.get(stage, 0))
+                        for stage in self.STAGES
+                    )
+                    + ")"
+                )
+            if idle:
+                self._changed()
+
+    def _changed(self):
+        if self.on_change:
+            self.on_change(self.cam)
+
+    def stats(self):
+        """Returns the queue depth, counts, and mean and last time of each stage."""
+        with self._lock:
+            done = self.completed
+            return {
+                "depth": self.pending,
+                "completed": done,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "mean_ms": dict(
+                    (stage, (1000 * total / done) if done else 0.0)
+                    for stage, total in self.totals.items()
+                ),
+                "last_ms": dict(
+                    (stage, 1000 * seconds) for stage, seconds in self.last.items()
+                ),
+            }
+
+    def stop(self):
+        """Waits for every pending still to be saved, then stops the threads."""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self.developer.close()
@@ -1,6 +1,7 @@
 import os
-import numpy as np
-from datetime import datetime
+from core.frame_hub import FrameSubscription
+from utilities.motion_detectors import make_motion_detector
+from utilities.motion_process import MotionProcess
 
 
 def setup_motion_pipe(md_path):
@@ -16,12 +17,34 @@ def setup_motion_pipe(md_path):
         os.mkfifo(md_path, 0o6666)
 
 
-def print_to_motion_log(log_path, message):
-    timestring = "{" + datetime.now().strftime("%Y/%m/%d %H:%M:%S") + "} "
-    contents = timestring + message + "\n"
-    motion_log = open(log_path, "a")
-    motion_log.write(contents)
-    motion_log.close()
+def detector_settings(config):
+    """Returns the settings the motion detector is made with, to spot changes."""
+    return [
+        config[key]
+        for key in [
+            "motion_detector",
+            "motion_decimation",
+            "motion_block_size",
+            "motion_noise_floor",
+            "motion_background_rate",
+            "motion_process",
+        ]
+    ]
+
+
+def start_motion_detector(config, width, height):
+    """
+    Makes the motion detector selected in the config, scoring frames in a
+    process of its own if motion_process is set.
+    """
+    if config["motion_process"]:
+        return MotionProcess(width, height, config)
+    return make_motion_detector(config, width, height)
+
+
+def print_to_motion_log(cam, message):
+    """Writes message to the motion log file, in the background as print_to_logfile()."""
+    cam.log_writer.log(cam.config["motion_logfile"], message, cam.config["log_size"])
 
 
 def send_motion_command(path, cmd):
@@ -42,10 +65,11 @@ def send_motion_command(path, cmd):
 def motion_detection_thread(cam):
     """
     Motion detection function. Runs in its own thread. Uses the lores
-    stream to check for motion by comparing pixels between two consecutive
-    frames and finding the mean-square-error of the difference. If the
-    difference is above a given threshold (default: 7), reports motion.
-    If there is no MSE for a given number of frames, reports motion has
+    stream to check for motion, scoring each frame with the motion detector
+    selected in the config (see motion_detectors.py). By default this is the
+    mean-square-error of the difference between two consecutive frames. If the
+    score is above a given threshold (default: 7), reports motion.
+    If there is no motion for a given number of frames, reports motion has
     ceased.
 
     Adapted from the example/sample program available on Picamera2's repo here:
@@ -60,16 +84,45 @@ def motion_detection_thread(cam):
     send_motion_command(cam.config["motion_pipe"], "9")  # Reset the motion pipe.
     motion_init_count = cam.config["motion_initframes"]
     motion_threshold = cam.config["motion_threshold"]
+    detector = start_motion_detector(cam.config, w, h)
+    cam.motion_detector = detector
+    settings = detector_settings(cam.config)
+    config_version = cam.config_version
 
-    while cam.current_status != "halted":  # CameraCoreModel.process_running:
-        cur = cam.picam2.capture_buffer("lores")
-        cur = cur[: w * h].reshape(h, w)
+    # Share frames with the preview instead of capturing lores separately.
+    frames = cam.frame_hub.subscribe("motion", FrameSubscription.LATEST)
+    # Waits while the camera is in standby, exits once it is closed.
+    while cam.lifecycle.wait_until_running():
+        frame = frames.get(timeout=1.0)
+        if frame is None:
+            if frames.closed:
+                break  # Frame capture failed, restarted with 'ru 1'.
+            continue
+        # Rows of the lores stream can be padded, so take the Y plane by rows.
+        cur = frame.request.make_array("lores")[:h, :w]
+        frame.release()
+        if cam.config_version != config_version:
+            # Settings were changed while running. Only make a new detector
+            # (which starts its background afresh) if its own settings or the
+            # lores size changed.
+            config_version = cam.config_version
+            motion_threshold = cam.config["motion_threshold"]
+            size = tuple(cam.picam2.camera_configuration()["lores"]["size"])
+            if (detector_settings(cam.config) != settings) or (size != (w, h)):
+                settings = detector_settings(cam.config)
+                w, h = size
+                detector.close()
+                detector = start_motion_detector(cam.config, w, h)
+                cam.motion_detector = detector
+                prev = None
+            if cur.shape != (h, w):
+                continue  # Captured before the streams were configured again.
         # Delay until initframes have been satisfied, unless on Monitor mode.
         if motion_init_count > 1:
             if cam.config["motion_mode"] == "monitor":
                 motion_init_count = 0
             else:
-                if prev:
+                if prev is not None:
                     if (cur == prev).all():
                         # Frame has passed
                         motion_init_count -= 1
@@ -77,13 +130,14 @@ def motion_detection_thread(cam):
                 continue
         # Main processing.
         if cam.motion_detection:
-            if prev is not None:
-                # Measure pixels differences between current and
-                # previous frame
-                mse = np.square(np.subtract(cur, prev)).mean()
-                if mse > motion_threshold:
+            # Score the frame with the configured detector. Gives None until
+            # the detector has seen enough frames to compare against.
+            with cam.metrics.timer("motion"):
+                score = detector.detect(cur)
+            if score is not None:
+                if score > motion_threshold:
                     cam.motion_still_count = 0
-                    print("motion detect: ", mse)
+                    print("motion detect: ", score)
                     if not cam.detected_motion:
                         cam.motion_active_count += 1
                         if cam.motion_active_count >= cam.config["motion_startframes"]:
@@ -91,10 +145,7 @@ def motion_detection_thread(cam):
                             if cam.config["motion_mode"] == "internal":
                                 send_motion_command(cam.config["motion_pipe"], "1")
                             elif cam.config["motion_mode"] == "monitor":
-                                print_to_motion_log(
-                                    cam.config["motion_logfile"],
-                                    "Motion start detected",
-                                )
+                                print_to_motion_log(cam, "Motion start detected")
                             print("Motion start detected")
                 else:
                     # Increment count of still frames and set detection to
@@ -108,8 +159,11 @@ def motion_detection_thread(cam):
                             if cam.config["motion_mode"] == "internal":
                                 send_motion_command(cam.config["motion_pipe"], "0")
                             elif cam.config["motion_mode"] == "monitor":
-                                print_to_motion_log(
-                                    cam.config["motion_logfile"], "Motion stop detected"
-                                )
+                                print_to_motion_log(cam, "Motion stop detected")
                             print("Motion stop detected")
+        else:
+            detector.reset()  # Start afresh when motion detection is switched on.
         prev = cur
+    cam.motion_detector = None
+    detector.close()
+    cam.frame_hub.unsubscribe(frames)
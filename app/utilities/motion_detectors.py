@@ -0,0 +1,113 @@
+from abc import ABC, abstractmethod
+
+import numpy as np
+from utilities.motion_score import MotionScorer
+
+
+class MotionDetector(ABC):
+    """
+    Base class for motion detectors used by motion_detection_thread.
+    A detector is fed the lores Y plane of every frame through detect() and
+    returns a score on the same scale as motion_threshold (a mean-square-error),
+    or None while it is still gathering the frames it needs.
+    """
+
+    def __init__(self, width, height, config):
+        self.width = width
+        self.height = height
+        self.decimation = max(int(config["motion_decimation"]), 1)
+
+    @abstractmethod
+    def detect(self, y_plane):
+        """Scores a (height, width) uint8 Y plane. Must not allocate per frame."""
+
+    @abstractmethod
+    def reset(self):
+        """Forgets any history, e.g. when motion detection is switched back on."""
+
+    def close(self):
+        """Frees anything the detector holds once it is no longer used."""
+
+    def stats(self):
+        """Returns the detector's counters for the metrics, or None if it has none."""
+        return None
+
+
+class MSEMotionDetector(MotionDetector):
+    """
+    Frame-to-frame mean-square-error, as in Picamera2's capture_motion example.
+    Cheap, but sensor noise and lighting flicker both add to the score.
+    """
+
+    def __init__(self, width, height, config):
+        super().__init__(width, height, config)
+        self.block_size = config["motion_block_size"]
+        self.scorer = MotionScorer(width, height, self.decimation, self.block_size)
+
+    def detect(self, y_plane):
+        score = self.scorer.update(y_plane)
+        if (score is not None) and self.block_size:
+            score = self.scorer.max_block_score()
+        return score
+
+    def reset(self):
+        self.scorer.reset()
+
+
+class BackgroundMotionDetector(MotionDetector):
+    """
+    Compares each frame against an exponentially-weighted running average of
+    previous frames instead of just the last one. Before scoring, the mean
+    difference is subtracted to cancel global brightness changes (flicker,
+    auto-exposure), and differences within the noise floor are ignored, so
+    the score is the mean-square of what is left over.
+    """
+
+    def __init__(self, width, height, config):
+        super().__init__(width, height, config)
+        self.noise_floor = float(config["motion_noise_floor"])
+        self.rate = float(config["motion_background_rate"])
+        shape = (-(-height // self.decimation), -(-width // self.decimation))
+        self._cur = np.empty(shape, dtype=np.float32)
+        self._diff = np.empty(shape, dtype=np.float32)
+        self._background = np.empty(shape, dtype=np.float32)
+        self._primed = False
+
+    def detect(self, y_plane):
+        np.copyto(self._cur, y_plane[:: self.decimation, :: self.decimation])
+        if not self._primed:
+            np.copyto(self._background, self._cur)
+            self._primed = True
+            return None
+        diff = self._diff
+        np.subtract(self._cur, self._background, out=diff)
+        diff -= diff.mean()  # Cancel any change in overall brightness.
+        np.abs(diff, out=diff)
+        diff -= self.noise_floor
+        np.maximum(diff, 0, out=diff)
+        np.multiply(diff, diff, out=diff)
+        score = float(diff.mean())
+        # Move the background towards the current frame.
+        np.subtract(self._cur, self._background, out=diff)
+        diff *= self.rate
+        self._background += diff
+        return score
+
+    def reset(self):
+        self._primed = False
+
+
+# Detectors selectable with the motion_detector config setting.
+MOTION_DETECTORS = {
+    "mse": MSEMotionDetector,
+    "background": BackgroundMotionDetector,
+}
+
+
+def make_motion_detector(config, width, height):
+    """Creates the motion detector named by config['motion_detector']."""
+    name = config["motion_detector"]
+    if name not in MOTION_DETECTORS:
+        print("ERROR: Unknown motion detector '" + str(name) + "', using 'mse'.")
+        name = "mse"
+    return MOTION_DETECTORS[name](width, height, config)
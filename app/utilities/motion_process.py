@@ -0,0 +1,193 @@
+import math
+import multiprocessing
+import struct
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+from utilities.motion_detectors import MotionDetector, make_motion_detector
+
+# Messages to the worker: operation, frame sequence number, ring slot.
+FRAME_MESSAGE = struct.Struct("<BIi")
+# Messages back: frame sequence number, ring slot, score (NaN for no score).
+RESULT_MESSAGE = struct.Struct("<Iid")
+
+SCORE, RESET, STOP = 0, 1, 2  # Operations sent to the worker.
+
+
+def motion_worker(shm_name, shape, slots, config, frames, results):
+    """
+    Scores the Y planes a MotionProcess puts in the shared memory ring, in a
+    process of its own, with the detector selected in the config.
+
+    Args:
+        shm_name: Name of the shared memory holding the ring.
+        shape: (height, width) of each Y plane.
+        slots: Number of Y planes the ring holds.
+        config: Config of the camera, for the detector settings.
+        frames: Connection messages for the worker are received on.
+        results: Connection the scores are sent back on.
+    """
+    # Spawned processes share the camera process's resource tracker, so the
+    # memory is left for the MotionProcess to remove.
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((slots,) + tuple(shape), dtype=np.uint8, buffer=shm.buf)
+    detector = make_motion_detector(config, shape[1], shape[0])
+    try:
+        while True:
+            try:
+                operation, sequence, slot = FRAME_MESSAGE.unpack(frames.recv_bytes())
+            except EOFError:
+                break  # The camera process went away.
+            if operation == STOP:
+                break
+            if operation == RESET:
+                detector.reset()
+                continue
+            score = detector.detect(ring[slot])
+            results.send_bytes(
+                RESULT_MESSAGE.pack(
+                    sequence, slot, math.nan if score is None else score
+                )
+            )
+    finally:
+        del ring  # Must not be left pointing into the memory as it closes.
+        shm.close()
+
+
+class MotionProcess(MotionDetector):
+    """
+    Runs another motion detector in a worker process, so scoring doesn't
+    compete for the GIL with preview encoding, commands and Picamera2's
+    callbacks. Each Y plane is copied into a ring of slots in shared memory
+    and only the slot number is sent over a pipe, with the score sent back
+    as a few bytes, so nothing is pickled per frame.
+
+    Scoring is pipelined: detect() hands the worker the new frame and returns
+    the score of an earlier one (usually the frame before), or None if no
+    score has come back yet. If every slot is still waiting to be scored the
+    new frame is dropped. Should the worker die, scoring carries on in this
+    process instead.
+    """
+
+    SLOTS = 4  # Frames that can be waiting to be scored at once.
+
+    def __init__(self, width, height, config):
+        super().__init__(width, height, config)
+        self.config = dict(config)
+        self.scored = 0  # Scores received from the worker.
+        self.dropped = 0  # Frames dropped with every slot busy.
+        self._local = None  # Detector used in this process if the worker dies.
+        self._shm = shared_memory.SharedMemory(
+            create=True, size=self.SLOTS * width * height
+        )
+        self._ring = np.ndarray(
+            (self.SLOTS, height, width), dtype=np.uint8, buffer=self._shm.buf
+        )
+        self._free = list(range(self.SLOTS))
+        self._scores = deque()  # Scores received, not yet returned by detect().
+        self._sequence = 0  # Sequence number of the last frame sent.
+        self._reset_sequence = 0  # Scores of frames sent before a reset are ignored.
+        context = multiprocessing.get_context("spawn")  # No forked libcamera.
+        frames, self._frames = context.Pipe(duplex=False)
+        self._results, results = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=motion_worker,
+            args=(
+                self._shm.name,
+                (height, width),
+                self.SLOTS,
+                self.config,
+                frames,
+                results,
+            ),
+            name="motion",
+            daemon=True,
+        )
+        self._process.start()
+        # Only the worker holds these ends, so a dead worker shows up as EOF.
+        frames.close()
+        results.close()
+
+    def _collect(self):
+        """Takes in the scores the worker has sent back, freeing their slots."""
+        while self._results.poll():
+            sequence, slot, score = RESULT_MESSAGE.unpack(self._results.recv_bytes())
+            self._free.append(slot)
+            self.scored += 1
+            if (sequence > self._reset_sequence) and not math.isnan(score):
+                self._scores.append(score)
+
+    def _fail(self, error):
+        print("ERROR: Motion process failed, scoring motion in-process. " + str(error))
+        self._local = make_motion_detector(self.config, self.width, self.height)
+
+    def detect(self, y_plane):
+        if self._local:
+            return self._local.detect(y_plane)
+        try:
+            self._collect()
+            if self._free:
+                slot = self._free.pop()
+                np.copyto(self._ring[slot], y_plane)
+                self._sequence += 1
+                self._frames.send_bytes(FRAME_MESSAGE.pack(SCORE, self._sequence, slot))
+            else:
+                self.dropped += 1
+        except (OSError, EOFError) as e:
+            self._fail(e)
+            return None
+        return self._scores.popleft() if self._scores else None
+
+    def wait(self, timeout=None):
+        """
+        Waits for the worker to score every frame sent to it.
+
+        Returns:
+            Whether every frame was scored before the timeout.
+        """
+        try:
+            while len(self._free) < self.SLOTS:
+                if not self._results.poll(timeout):
+                    return False
+                self._collect()
+        except (OSError, EOFError):
+            return False  # The worker died.
+        return True
+
+    def reset(self):
+        self._scores.clear()
+        if self._local:
+            self._local.reset()
+            return
+        if self._reset_sequence == self._sequence:
+            return  # Nothing sent since the last reset, it is called every frame.
+        self._reset_sequence = self._sequence
+        try:
+            self._frames.send_bytes(FRAME_MESSAGE.pack(RESET, self._sequence, -1))
+        except OSError as e:
+            self._fail(e)
+
+    def stats(self):
+        """Returns the frames scored by the worker and dropped, and where scoring runs."""
+        return {
+            "scored": self.scored,
+            "dropped": self.dropped,
+            "in_process": self._local is not None,
+        }
+
+    def close(self):
+        """Stops the worker and frees the shared memory."""
+        try:
+            self._frames.send_bytes(FRAME_MESSAGE.pack(STOP, self._sequence, -1))
+        except OSError:
+            pass  # Already stopped.
+        self._process.join(2.0)
+        if self._process.is_alive():
+            self._process.terminate()
+            self._process.join()
+        self._frames.close()
+        self._results.close()
+        del self._ring
+        self._shm.close()
+        self._shm.unlink()
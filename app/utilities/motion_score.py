@@ -0,0 +1,99 @@
+import numpy as np
+
+
+class MotionScorer:
+    """
+    Scores the difference between two lores Y planes as a mean-square-error.
+    Pixels are widened into int32 work buffers allocated once up front, and
+    differenced, squared and summed in place, so scoring a frame allocates
+    nothing and does not wrap around on negative differences like uint8
+    arithmetic does. Frames can be decimated (only every n-th pixel of every
+    n-th row is scored) and scored per block of pixels as well as as a whole.
+    """
+
+    def __init__(self, width, height, decimation=1, block_size=0):
+        """
+        Args:
+            width: Width of the Y plane.
+            height: Height of the Y plane.
+            decimation: Score every n-th pixel in both directions.
+            block_size: Size of the square blocks (in decimated pixels) to score
+                        separately, or 0 to only score whole frames. Capped at
+                        the size of the decimated frame.
+        """
+        self.decimation = max(int(decimation), 1)
+        rows = -(-height // self.decimation)  # Rows left after decimation.
+        cols = -(-width // self.decimation)  # Columns left after decimation.
+        # Blocks bigger than the decimated frame are shrunk to fit, so there is
+        # always at least one block to score.
+        self.block_size = min(max(int(block_size), 0), rows, cols)
+        self.shape = (rows, cols)
+        self._cur = np.empty(self.shape, dtype=np.int32)
+        self._square = np.empty(self.shape, dtype=np.int32)
+        # Squares are at most 255^2, so a row sum only overflows int32 for rows
+        # over 33000 pixels wide. The row sums are then added up in int64.
+        self._row_sums = np.empty(rows, dtype=np.int32)
+        self._frames = [np.zeros(self.shape, dtype=np.uint8) for _ in range(2)]
+        self._current = 0
+        self._primed = False
+        if self.block_size:
+            self.blocks = (rows // self.block_size, cols // self.block_size)
+            self._block_sums = np.empty(self.blocks, dtype=np.int32)
+            self.block_scores = np.empty(self.blocks, dtype=np.float64)
+
+    def _decimate(self, plane):
+        """Returns a strided (no copy) view of the pixels that get scored."""
+        if self.decimation == 1:
+            return plane
+        return plane[:: self.decimation, :: self.decimation]
+
+    def score(self, cur, prev):
+        """
+        Returns the mean-square-error between two Y planes of the configured size.
+        With block scoring enabled, also fills in block_scores with the MSE of
+        each block.
+        """
+        return self._score(self._decimate(cur), self._decimate(prev))
+
+    def _score(self, cur, prev):
+        """Scores two already decimated planes."""
+        np.copyto(self._cur, cur)
+        np.copyto(self._square, prev)
+        np.subtract(self._cur, self._square, out=self._square)
+        np.multiply(self._square, self._square, out=self._square)
+        if self.block_size:
+            self._score_blocks()
+        self._square.sum(axis=1, out=self._row_sums)
+        return float(self._row_sums.sum(dtype=np.int64)) / self._square.size
+
+    def _score_blocks(self):
+        rows, cols = self.blocks
+        size = self.block_size
+        blocks = self._square[: rows * size, : cols * size].reshape(
+            rows, size, cols, size
+        )
+        blocks.sum(axis=(1, 3), out=self._block_sums)
+        np.divide(self._block_sums, size * size, out=self.block_scores)
+
+    def max_block_score(self):
+        """Returns the highest block MSE from the last score() call."""
+        return float(self.block_scores.max())
+
+    def update(self, cur):
+        """
+        Copies the (decimated) Y plane into the scorer's own frame buffers and
+        returns its MSE against the previous update, or None for the first one.
+        The caller does not need to hold on to cur afterwards.
+        """
+        previous = self._frames[self._current]
+        self._current ^= 1
+        current = self._frames[self._current]
+        np.copyto(current, self._decimate(cur))
+        if not self._primed:
+            self._primed = True
+            return None
+        return self._score(current, previous)
+
+    def reset(self):
+        """Forgets the previous frame given to update()."""
+        self._primed = False
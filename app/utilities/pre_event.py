@@ -0,0 +1,188 @@
+import threading
+from collections import deque
+
+
+class PreEventBuffer:
+    """
+    Encoder output keeping the last few seconds of encoded H.264 in memory
+    while motion detection is on, so that recordings started on motion also
+    hold what happened just before it was detected. Frames are kept in whole
+    groups of pictures (a keyframe and the frames after it), so the buffer
+    always starts on a keyframe and can be decoded. Groups are dropped from
+    the front once the rest still covers 'seconds', or whenever the buffer
+    would use more than 'max_bytes'.
+
+    When a recording starts, the buffer is written to the recording's output
+    and every frame after it goes straight there, so the recording carries on
+    from the buffer without restarting the encoder. Once it stops, buffering
+    starts again.
+
+    A snapshot (the latest preview) is kept with each group's keyframe, so a
+    recording's thumbnail can show roughly how it starts, within a preview
+    interval, rather than the moment motion was detected.
+    """
+
+    def __init__(self, seconds, max_bytes, snapshot=None):
+        """
+        Args:
+            seconds: Seconds of video to keep from before a recording starts.
+            max_bytes: Most bytes of encoded video to keep.
+            snapshot: Function returning an image of the current frame, kept
+                      with each keyframe. None to keep none.
+        """
+        self.span_us = int(seconds * 1000000)  # Encoder timestamps are in us.
+        self.max_bytes = int(max_bytes)
+        self.bytes = 0  # Bytes of encoded video held.
+        self.peak_bytes = 0  # Most bytes held at once.
+        self.discarded = 0  # Frames thrown away waiting for a keyframe.
+        self.flushed = (
+            None  # (seconds, bytes) written at the start of the last recording.
+        )
+        self._gops = deque()  # Lists of (frame, timestamp), each led by a keyframe.
+        self._snapshots = deque()  # Snapshot taken at each group's keyframe.
+        self.snapshot = snapshot
+        self.first_snapshot = None  # Snapshot of the start of the last recording.
+        self._sink = None  # Output of the recording in progress, if any.
+        self._frames = 0  # Frames written to the current recording.
+        self._first_ts = None  # Timestamps of the first and last of them.
+        self._last_ts = None
+        self._lock = threading.Lock()
+
+    @property
+    def recording(self):
+        return self._sink is not None
+
+    # Picamera2 Output interface, called by the encoder.
+
+    def start(self):
+        pass
+
+    def stop(self):
+        """Called when the encoder stops. Ends any recording and empties the buffer."""
+        self.stop_recording()
+        with self._lock:
+            self._gops.clear()
+            self._snapshots.clear()
+            self.bytes = 0
+
+    def outputframe(
+        self, frame, keyframe=True, timestamp=None, packet=None, audio=False
+    ):
+        with self._lock:
+            if self._sink is not None:
+                self._write(frame, keyframe, timestamp)
+                return
+            if keyframe:
+                self._gops.append([])
+                self._snapshots.append(self.snapshot() if self.snapshot else None)
+            elif not self._gops:
+                self.discarded += 1  # Can't be decoded without its keyframe.
+                return
+            frame = bytes(frame)  # Hold on to a copy, not the encoder's buffer.
+            self._gops[-1].append((frame, timestamp))
+            self.bytes += len(frame)
+            self.peak_bytes = max(self.peak_bytes, self.bytes)
+            self._trim(timestamp)
+
+    def _trim(self, newest):
+        """Drops groups of frames from the front that are no longer needed."""
+        gops = self._gops
+        # The second group starting 'seconds' before the newest frame means
+        # the first is not needed to cover them.
+        while (len(gops) > 1) and (gops[1][0][1] <= newest - self.span_us):
+            self._drop_first()
+        while gops and self.bytes > self.max_bytes:
+            self._drop_first()
+
+    def _drop_first(self):
+        self._snapshots.popleft()
+        for frame, _ in self._gops.popleft():
+            self.bytes -= len(frame)
+
+    def _write(self, frame, keyframe, timestamp):
+        self._sink.outputframe(frame, keyframe, timestamp)
+        self._frames += 1
+        if self._first_ts is None:
+            self._first_ts = timestamp
+        self._last_ts = timestamp
+
+    def start_recording(self, sink):
+        """
+        Writes the buffered video to a started output, then carries on writing
+        every new frame to it.
+        """
+        with self._lock:
+            self._frames = 0
+            self._first_ts = self._last_ts = None
+            self._sink = sink
+            self.first_snapshot = self._snapshots[0] if self._snapshots else None
+            flushed_bytes = self.bytes
+            for gop in self._gops:
+                for i, (frame, timestamp) in enumerate(gop):
+                    self._write(frame, i == 0, timestamp)
+            self._gops.clear()
+            self._snapshots.clear()
+            self.bytes = 0
+            seconds = 0.0
+            if self._frames > 1:
+                seconds = (self._last_ts - self._first_ts) / 1000000
+            self.flushed = (seconds, flushed_bytes)
+
+    def stop_recording(self):
+        """
+        Stops writing to the recording's output and stops it, going back to
+        buffering.
+        """
+        with self._lock:
+            sink, self._sink = self._sink, None
+            if sink is not None:
+                sink.stop()
+
+    def stats(self):
+        """Returns the memory used and the length of video held."""
+        with self._lock:
+            seconds = 0.0
+            if self._gops:
+                seconds = (self._gops[-1][-1][1] - self._gops[0][0][1]) / 1000000
+            return {
+                "bytes": self.bytes,
+                "peak_bytes": self.peak_bytes,
+                "max_bytes": self.max_bytes,
+                "seconds": seconds,
+                "discarded": self.discarded,
+            }
+
+
+def start_pre_event_buffer(cam):
+    """
+    Starts encoding into a PreEventBuffer, if it is turned on in the config
+    and the encoder isn't already busy recording.
+    """
+    if cam.config["motion_pre_seconds"] <= 0 or cam.video_encoder.running:
+        return
+    cam.pre_event = PreEventBuffer(
+        cam.config["motion_pre_seconds"],
+        cam.config["motion_pre_max_mb"] * 1000000,
+        snapshot=cam.preview_stream.latest,
+    )
+    cam.video_encoder.bitrate = cam.config["video_bitrate"]
+    cam.picam2.start_encoder(cam.video_encoder, cam.pre_event, name="main")
+    cam.print_to_logfile(
+        "Pre-event buffer started, %.1f s up to %.1f MB"
+        % (cam.config["motion_pre_seconds"], cam.config["motion_pre_max_mb"])
+    )
+
+
+def stop_pre_event_buffer(cam):
+    """
+    Stops the pre-event buffer's encoder, unless a recording is using it, in
+    which case it stops along with the recording.
+    """
+    if cam.pre_event is None or cam.pre_event.recording:
+        return
+    stats = cam.pre_event.stats()
+    cam.picam2.stop_encoder(cam.video_encoder)
+    cam.pre_event = None
+    cam.print_to_logfile(
+        "Pre-event buffer stopped, peak %.1f MB" % (stats["peak_bytes"] / 1000000)
+    )
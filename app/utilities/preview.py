@@ -1,23 +1,210 @@
+import io
 import os
+import time
+from collections import deque
 
+import numpy as np
+from core.metrics import timed
+from PIL import Image
+from utilities.motion_score import MotionScorer
 
+
+@timed("preview")
 def generate_preview(cam, request):
     """
-    Generate a preview image from the camera request and save it to the specified preview path.
-    The preview is temporarily saved and then renamed to prevent flickering issues.
+    Generate a preview image from the camera request, publish it to any streaming
+    clients and save it to the specified preview path. The preview is encoded
+    once in memory, then temporarily saved and renamed to prevent flickering issues.
+    """
+    if cam.config["preview_source"] == "lores":
+        # The lores stream is already at the preview size, just encode it.
+        jpeg = encode_lores_jpeg(cam, request)
+    else:
+        preview_width = cam.config["preview_size"][0]  # Preview width from config
+        preview_height = cam.config["preview_size"][1]  # Preview height from config
+
+        # Create the preview image using specified dimensions
+        preview_img = request.make_image("main", preview_width, preview_height)
+
+        # Encode the preview image and related metadata
+        encoded = io.BytesIO()
+        cam.picam2.helpers.save(
+            preview_img, request.get_metadata(), encoded, format="jpeg"
+        )
+        jpeg = encoded.getvalue()
+
+    # Streaming clients all share this one buffer.
+    cam.preview_stream.publish(jpeg)
+
+    if cam.config["preview_file"]:
+        preview_path = cam.config["preview_path"]
+        # Temporarily save the preview image to avoid conflicts when updating the file
+        temp_path = preview_path + ".part.jpg"
+        with open(temp_path, "wb") as preview_file:
+            preview_file.write(jpeg)
+        # Rename the temporary file to the actual preview path (avoids preview flickering)
+        os.rename(temp_path, preview_path)
+
+
+def encode_lores_jpeg(cam, request):
+    """
+    Encodes the YUV420 lores stream of a request as a JPEG. Uses simplejpeg
+    (installed with Picamera2) to encode the YUV planes directly, falling back
+    to an OpenCV colour conversion and Pillow if it is not available.
+
+    Returns:
+        Bytes of the JPEG image.
+    """
+    w, h = cam.picam2.camera_configuration()["lores"]["size"]
+    quality = cam.picam2.options.get("quality", 90)
+    yuv = request.make_array("lores")
+    stride = yuv.shape[1]
+    y_plane = yuv[:h, :w]
+    # The U and V planes each hold h/2 rows of stride/2 bytes after the Y plane.
+    # They are sliced by byte offset, as they don't start on a row of the array
+    # unless h is a multiple of 4.
+    y_size = h * stride
+    chroma = yuv.reshape(-1)[y_size:]
+    chroma_size = (h // 2) * (stride // 2)
+    u_plane = chroma[:chroma_size].reshape(h // 2, stride // 2)[:, : w // 2]
+    v_plane = chroma[chroma_size:].reshape(h // 2, stride // 2)[:, : w // 2]
+    try:
+        import simplejpeg
+
+        return simplejpeg.encode_jpeg_yuv_planes(
+            y_plane, u_plane, v_plane, quality=quality
+        )
+    except ImportError:
+        import cv2
+
+        planes = np.concatenate(
+            [y_plane.reshape(-1), u_plane.reshape(-1), v_plane.reshape(-1)]
+        )
+        rgb = cv2.cvtColor(planes.reshape(h * 3 // 2, w), cv2.COLOR_YUV2RGB_I420)
+        encoded = io.BytesIO()
+        Image.fromarray(rgb).save(encoded, format="JPEG", quality=quality)
+        return encoded.getvalue()
+
+
+class PreviewScheduler:
+    """
+    Decides when the preview thread should generate a new preview image.
+    Previews are generated at most 'preview_fps' times a second, dropping to
+    'preview_idle_fps' when nobody has read the preview file (going by its
+    access time) or sent a heartbeat() for 'preview_idle_timeout' seconds.
+    Reads only update the access time on filesystems not mounted noatime, so
+    while the preview file is written the rate is only dropped once a read
+    has been seen.
+    Frames whose lores image hardly differs from the last published preview
+    are skipped instead of encoded, but a preview is still published at least
+    once every UNCHANGED_MAX_AGE seconds so that reads can keep being seen.
     """
-    preview_path = cam.config["preview_path"]
-    preview_width = cam.config["preview_size"][0]  # Preview width from config
-    preview_height = cam.config["preview_size"][1]  # Preview height from config
 
-    # Create the preview image using specified dimensions
-    preview_img = request.make_image("main", preview_width, preview_height)
+    UNCHANGED_MAX_AGE = 1.0  # Longest time an unchanged preview is left in place.
+    READ_CHECK_INTERVAL = 1.0  # How often the preview file's access time is checked.
+
+    def __init__(self, cam):
+        config = cam.config
+        self.preview_path = config["preview_path"]
+        self.preview_file = config["preview_file"]
+        self.max_fps = float(config["preview_fps"])
+        self.idle_fps = float(config["preview_idle_fps"])
+        self.idle_timeout = float(config["preview_idle_timeout"])
+        self.skip_threshold = float(config["preview_skip_threshold"])
+        self.width, self.height = cam.picam2.camera_configuration()["lores"]["size"]
+        # Heavily decimated, since this only needs to spot a static scene.
+        self.scorer = MotionScorer(self.width, self.height, decimation=4)
+        self._published_y = np.zeros((self.height, self.width), dtype=np.uint8)
+        self._candidate_y = None
+        self.published = 0  # Previews generated.
+        self.skipped_unchanged = 0  # Frames skipped because nothing changed.
+        self.idle = False  # Whether the preview is being generated at the idle rate.
+        self.last_check = None  # When the last frame was considered.
+        self.last_publish = None  # When the last preview was generated.
+        self.last_activity = time.monotonic()  # Last read of the preview or heartbeat.
+        self.reads_seen = False  # Whether a read of the preview file has been seen.
+        self._last_read_check = 0.0
+        self._publish_times = deque(maxlen=64)
+
+    def heartbeat(self):
+        """Marks the preview as being watched, e.g. by a streaming client."""
+        self.last_activity = time.monotonic()
+
+    def _check_reads(self, now):
+        """Counts a read of the current preview file as activity."""
+        if now - self._last_read_check < self.READ_CHECK_INTERVAL:
+            return
+        self._last_read_check = now
+        try:
+            st = os.stat(self.preview_path)
+        except FileNotFoundError:
+            return
+        # Each preview is a new file, so its atime only passes its mtime once read.
+        if st.st_atime_ns > st.st_mtime_ns:
+            self.reads_seen = True
+            self.last_activity = now
+
+    def interval(self, now):
+        """Returns the minimum time between previews at the current rate."""
+        self._check_reads(now)
+        # Without atime updates (noatime) reads can't be seen, so never back off.
+        reads_visible = self.reads_seen or not self.preview_file
+        self.idle = (
+            (self.idle_timeout > 0)
+            and reads_visible
+            and (now - self.last_activity > self.idle_timeout)
+        )
+        fps = self.idle_fps if self.idle else self.max_fps
+        return (1.0 / fps) if fps > 0 else 0.0
+
+    def time_until_due(self):
+        """Returns how long to wait before the next frame should be considered."""
+        if self.last_check is None:
+            return 0.0
+        now = time.monotonic()
+        return max(0.0, self.interval(now) - (now - self.last_check))
+
+    def should_publish(self, request):
+        """Returns whether a preview should be generated from this request."""
+        now = time.monotonic()
+        self.last_check = now
+        self._candidate_y = None
+        if (self.skip_threshold <= 0) or (self.last_publish is None):
+            return True
+        y_plane = request.make_array("lores")[: self.height, : self.width]
+        if now - self.last_publish < self.UNCHANGED_MAX_AGE:
+            if self.scorer.score(y_plane, self._published_y) < self.skip_threshold:
+                self.skipped_unchanged += 1
+                return False
+        self._candidate_y = y_plane
+        return True
 
-    # Temporarily save the preview image to avoid conflicts when updating the file
-    temp_path = preview_path + ".part.jpg"
+    def mark_published(self, request):
+        """Records that a preview has been generated from this request."""
+        now = time.monotonic()
+        if self.skip_threshold > 0:
+            if self._candidate_y is None:
+                y_plane = request.make_array("lores")[: self.height, : self.width]
+                self._candidate_y = y_plane
+            np.copyto(self._published_y, self._candidate_y)
+            self._candidate_y = None
+        self.last_publish = now
+        self.published += 1
+        self._publish_times.append(now)
 
-    # Save the preview image and related metadata
-    cam.picam2.helpers.save(preview_img, request.get_metadata(), temp_path)
+    def achieved_fps(self):
+        """Returns the preview rate over the recently published previews."""
+        times = [t for t in self._publish_times if time.monotonic() - t < 5.0]
+        if len(times) < 2:
+            return 0.0
+        return (len(times) - 1) / (times[-1] - times[0])
 
-    # Rename the temporary file to the actual preview path (avoids preview flickering)
-    os.rename(temp_path, preview_path)
+    def stats(self):
+        """Returns the achieved rate and skip counts, for tuning the settings."""
+        return {
+            "fps": self.achieved_fps(),
+            "published": self.published,
+            "skipped_unchanged": self.skipped_unchanged,
+            "idle": self.idle,
+            "reads_seen": self.reads_seen,
+        }
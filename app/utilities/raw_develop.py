@@ -0,0 +1,186 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# OpenCV names Bayer patterns after the second row of the mosaic, so the
+# sensor's top-left BGGR pattern is OpenCV's 'RG' pattern and so on.
+DEMOSAIC_CODES = {
+    "BGGR": cv2.COLOR_BayerRG2RGB,
+    "GBRG": cv2.COLOR_BayerGR2RGB,
+    "GRBG": cv2.COLOR_BayerGB2RGB,
+    "RGGB": cv2.COLOR_BayerBG2RGB,
+}
+
+WORKING_BITS = 12  # Precision of the linear values between the LUTs.
+WORKING_MAX = (1 << WORKING_BITS) - 1
+# Rows of context either side of a tile, so demosaicing sees across tile edges.
+TILE_OVERLAP = 2
+
+
+def parse_raw_format(raw_format):
+    """
+    Splits a raw stream format such as 'SBGGR10' or 'SBGGR10_CSI2P'.
+
+    Returns:
+        (bayer order, bit depth, whether the data is CSI-2 packed)
+    """
+    name, _, packing = raw_format.partition("_")
+    order = name[1:5]
+    if (not name.startswith("S")) or (order not in DEMOSAIC_CODES):
+        raise ValueError("Unsupported raw format: " + str(raw_format))
+    return order, int(name[5:]), packing == "CSI2P"
+
+
+def unpack_rows(raw, width, bits, packed):
+    """
+    Unpacks rows of a raw buffer (uint8, one row of 'stride' bytes per line)
+    into uint16 pixel values.
+    """
+    if not packed:
+        # Little-endian 16-bit words holding one pixel each.
+        return raw[:, : width * 2].view("<u2")
+    if bits != 10:
+        raise ValueError("Only 10-bit CSI-2 packed raw is supported")
+    # Every 5 bytes hold the top 8 bits of 4 pixels, then their low 2 bits.
+    groups = raw[:, : width * 5 // 4].reshape(raw.shape[0], -1, 5)
+    pixels = groups[:, :, :4].astype(np.uint16) << 2
+    for i in range(4):
+        pixels[:, :, i] |= (groups[:, :, 4] >> (2 * i)) & 3
+    return pixels.reshape(raw.shape[0], -1)
+
+
+def make_gamma_lut(gamma="srgb"):
+    """
+    Builds the LUT taking linear working values to 8-bit output, using the
+    sRGB curve (a linear toe then a power of 1/2.4) unless a plain power law
+    gamma is given. Look ups clip, so values above the working range (from
+    the colour matrix) saturate at 255.
+    """
+    x = np.arange(WORKING_MAX + 1, dtype=np.float64) / WORKING_MAX
+    if gamma == "srgb":
+        y = np.where(x <= 0.0031308, 12.92 * x, 1.055 * np.power(x, 1 / 2.4) - 0.055)
+    else:
+        y = np.power(x, 1 / float(gamma))
+    return np.clip(np.round(y * 255), 0, 255).astype(np.uint8)
+
+
+class RawDeveloper:
+    """
+    Develops raw Bayer frames into 8-bit RGB images: unpacks the sensor data,
+    subtracts the black level and applies the white balance gains (both
+    through one precomputed LUT per Bayer channel), demosaics, applies the
+    colour correction matrix and then the gamma curve through a LUT.
+    The frame is split into tiles of rows that are developed in parallel on
+    a thread pool (NumPy and OpenCV release the GIL), so only a few tiles'
+    worth of intermediate buffers exist at a time.
+    """
+
+    def __init__(self, threads=None, tile_rows=128, gamma="srgb"):
+        """
+        Args:
+            threads: Number of tiles developed at once, None for one per CPU.
+            tile_rows: Rows of the frame in each tile.
+            gamma: 'srgb' for the sRGB curve, or a power law gamma (e.g. 2.2).
+        """
+        self.threads = max(int(threads if threads else os.cpu_count() or 1), 1)
+        self.tile_rows = max(int(tile_rows) & ~1, 2)  # Keep the Bayer phase.
+        self.gamma_lut = make_gamma_lut(gamma)
+        self._pool = None
+        if self.threads > 1:
+            self._pool = ThreadPoolExecutor(self.threads)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown()
+            self._pool = None
+
+    def make_channel_luts(self, order, bits, metadata):
+        """
+        Builds the LUT for each of the 4 positions in the 2x2 Bayer pattern,
+        taking raw values to black-level-subtracted, white-balanced linear
+        working values.
+
+        Returns:
+            Dict of (row, column) in the pattern -> uint16 LUT.
+        """
+        raw_max = (1 << bits) - 1
+        # Black levels are reported in 16-bit units, in R, Gr, Gb, B order.
+        levels = metadata.get("SensorBlackLevels", (4096, 4096, 4096, 4096))
+        levels = dict(zip(["R", "Gr", "Gb", "B"], [v >> (16 - bits) for v in levels]))
+        red_gain, blue_gain = metadata.get("ColourGains", (1.0, 1.0))
+        gains = {"R": red_gain, "Gr": 1.0, "Gb": 1.0, "B": blue_gain}
+        values = np.arange(raw_max + 1, dtype=np.float64)
+        luts = {}
+        for row in range(2):
+            row_colours = order[:2] if row == 0 else order[2:]
+            for col in range(2):
+                colour = row_colours[col]
+                if colour == "G":
+                    colour = "Gr" if "R" in row_colours else "Gb"
+                black = levels[colour]
+                scale = gains[colour] * WORKING_MAX / max(raw_max - black, 1)
+                lut = np.clip(np.round((values - black) * scale), 0, WORKING_MAX)
+                luts[(row, col)] = lut.astype(np.uint16)
+        return luts
+
+    def develop(self, raw, width, height, raw_format, metadata):
+        """
+        Develops a raw frame.
+
+        Args:
+            raw: uint8 raw buffer as returned by make_array('raw'), one row per line.
+            width: Width of the raw stream in pixels.
+            height: Height of the raw stream in pixels.
+            raw_format: Raw stream format, e.g. 'SBGGR10'.
+            metadata: Request metadata, for the black levels, white balance
+                      gains and colour correction matrix.
+        Returns:
+            (height, width, 3) uint8 RGB array.
+        """
+        order, bits, packed = parse_raw_format(raw_format)
+        luts = self.make_channel_luts(order, bits, metadata)
+        ccm = np.array(
+            metadata.get("ColourCorrectionMatrix", (1, 0, 0, 0, 1, 0, 0, 0, 1)),
+            dtype=np.float32,
+        ).reshape(3, 3)
+        params = (order, bits, packed, luts, ccm, width)
+        height = height & ~1
+        rgb = np.empty((height, width, 3), dtype=np.uint8)
+        tiles = range(0, height, self.tile_rows)
+        if self._pool is None:
+            for top in tiles:
+                self._develop_tile(raw, rgb, top, params)
+        else:
+            # list() waits for every tile, raising the first error if any failed.
+            list(
+                self._pool.map(
+                    lambda top: self._develop_tile(raw, rgb, top, params), tiles
+                )
+            )
+        return rgb
+
+    def _develop_tile(self, raw, rgb, top, params):
+        """Develops rows top..top+tile_rows of raw into rgb."""
+        order, bits, packed, luts, ccm, width = params
+        height = rgb.shape[0]
+        bottom = min(top + self.tile_rows, height)
+        # Develop a few extra rows either side so demosaicing is seamless.
+        start = max(top - TILE_OVERLAP, 0)
+        end = min(bottom + TILE_OVERLAP, height)
+        pixels = unpack_rows(raw[start:end], width, bits, packed)
+        mosaic = np.empty(pixels.shape, dtype=np.uint16)
+        # np.take is much faster than fancy indexing, and clipping keeps any
+        # stray bits above the sensor's bit depth inside the LUTs.
+        for (row, col), lut in luts.items():
+            # start is even, so the tile keeps the frame's Bayer phase.
+            np.take(
+                lut, pixels[row::2, col::2], mode="clip", out=mosaic[row::2, col::2]
+            )
+        linear = cv2.cvtColor(mosaic, DEMOSAIC_CODES[order])
+        # Saturates below 0, and the gamma LUT clips anything over the working
+        # range to white.
+        corrected = cv2.transform(linear, ccm)
+        first, last = top - start, bottom - start
+        rgb[top:bottom] = np.take(self.gamma_lut, corrected[first:last], mode="clip")
@@ -1,4 +1,10 @@
-from picamera2.outputs import FfmpegOutput
+import os
+import threading
+
+from core.metrics import timed
+from utilities.pre_event import start_pre_event_buffer, stop_pre_event_buffer
+from utilities.remux import pts_path
+from utilities.segments import SegmentedOutput
 
 # Global variables to track recording state
 recording_started = False
@@ -6,6 +12,7 @@ recording_thread = None
 output_filename = None
 
 
+@timed("start_recording")
 def start_recording(cam):
     """
     Starts video recording. Creates the output file and starts encoder in
@@ -23,20 +30,57 @@ def start_recording(cam):
         cam.config["video_output_path"]
     )  # Generate output file name
     cam.current_video_path = output_path  # Remember pathname.
-    cam.video_encoder.output = FfmpegOutput(
+    if cam.pre_event:
+        # The encoder is already running for the pre-event buffer, so carry
+        # on from it. FfmpegOutput would timestamp the buffered frames as they
+        # are written, so the stream is saved as it is and made into an MP4
+        # once each file is finished.
+        output = segmented_output(cam, output_path)
+        output.start()
+        cam.pre_event.start_recording(output)
+        # The recording starts with the buffered video, so its thumbnail is
+        # the preview kept from when that started, if any was buffered.
+        cam.video_first_frame = cam.pre_event.first_snapshot or FirstFrame(cam)
+        seconds, size = cam.pre_event.flushed
+        cam.print_to_logfile(
+            "Recording started with %.1f s (%.1f MB) from before motion"
+            % (seconds, size / 1000000)
+        )
+        cam.capturing_video = True
+        cam.set_status("video")
+        return
+    # The bitrate may have changed in the config since the last recording.
+    cam.video_encoder.bitrate = cam.config["video_bitrate"]
+    if (
+        cam.config["video_remux"]
+        or cam.config["video_split"]
+        or cam.config["video_split_mb"]
+    ):
+        # Write the raw stream, made into MP4s in the background as each file
+        # is finished. Keeps ffmpeg off the capture path, and lets recordings
+        # be split on keyframes.
+        output = segmented_output(cam, output_path)
+        cam.picam2.start_encoder(cam.video_encoder, output, name="main")
+        cam.video_first_frame = FirstFrame(cam)
+        cam.capturing_video = True
+        cam.set_status("video")
+        return
+    cam.video_encoder.output = cam.backend.ffmpeg_output(
         output_path
     )  # Set FfmpegOutput as output for video encoding to immediately get an MP4.
 
-    # Note: May be a better idea to use FileOutput instead for .h264 (better FPS and efficiency).
+    # Note: Set video_remux to record through FileOutput instead (better FPS and efficiency).
     # Note 2: FfmpegOutput won't work with Pyinstaller, as it uses subprocess, which Pyinstaller can't handle.
 
     cam.picam2.start_encoder(
         cam.video_encoder, cam.video_encoder.output, name="main"
     )  # Start the video encoder
+    cam.video_first_frame = FirstFrame(cam)
     cam.capturing_video = True  # Update flag to indicate video is being captured
     cam.set_status("video")  # Set camera status to 'video'
 
 
+@timed("stop_recording")
 def stop_recording(cam):
     """
     Stops recording. Generates the thumbnail and resets any motion detection
@@ -50,10 +94,22 @@ def stop_recording(cam):
         cam.print_to_logfile("Already stopped. Ignore")
         return
     cam.print_to_logfile("Capturing stopped")
-    if cam.video_encoder.running:  # Stop the encoder if it's running
+    cancel_record_timer(cam)
+    if cam.pre_event and cam.pre_event.recording:
+        # Go back to buffering, or stop if motion detection has been turned off.
+        # Stopping the recording's output finishes its last segment.
+        cam.pre_event.stop_recording()
+        if not cam.motion_detection:
+            stop_pre_event_buffer(cam)
+        cam.current_video_path = None
+    elif cam.video_encoder.running:  # Stop the encoder if it's running
+        segmented = isinstance(cam.video_encoder.output, SegmentedOutput)
         cam.picam2.stop_encoder()
-        cam.generate_thumbnail("v", cam.current_video_path)
+        if not segmented:  # Segments get their thumbnails as they finish.
+            cam.generate_thumbnail("v", cam.current_video_path, frame=first_frame(cam))
         cam.current_video_path = None  # Reset current video pathname.
+        if cam.motion_detection:
+            start_pre_event_buffer(cam)  # Buffer for the next motion event.
 
     cam.capturing_video = False  # Update flag to indicate video capture has stopped
     cam.reset_motion_state()  # Reset motion detection
@@ -72,3 +128,94 @@ def toggle_cam_record(cam, status):
         start_recording(cam)
     else:  # Stop video recording
         stop_recording(cam)
+
+
+def start_record_timer(cam, seconds, on_expired):
+    """
+    Calls on_expired after the given number of seconds, to stop a timed
+    recording. Replaces any timer already running.
+    """
+    cancel_record_timer(cam)
+    cam.record_timer = threading.Timer(seconds, on_expired)
+    cam.record_timer.daemon = True  # Never holds up shutting down.
+    cam.record_timer.start()
+
+
+def cancel_record_timer(cam):
+    """Cancels the timer of a timed recording, if there is one."""
+    if cam.record_timer:
+        cam.record_timer.cancel()
+        cam.record_timer = None
+
+
+class FirstFrame:
+    """
+    Makes the thumbnail of a recording (or segment of one) from the first
+    frame captured after it starts, on a thread of its own so neither the
+    command loop nor the encoder waits for the frame.
+    """
+
+    TIMEOUT = 1.0  # Seconds to wait for the frame.
+
+    def __init__(self, cam):
+        self.image = None  # PIL thumbnail, once made.
+        self._thread = threading.Thread(target=self._grab, args=(cam,))
+        self._thread.start()
+
+    def _grab(self, cam):
+        # None if no frame comes, when generate_thumbnail() uses the preview.
+        self.image = cam.next_frame_thumbnail(self.TIMEOUT)
+
+    def result(self):
+        """Waits for the thumbnail and returns it, or None if no frame came."""
+        self._thread.join()
+        return self.image
+
+
+def first_frame(cam):
+    """Returns the thumbnail image of the current recording's first frame, or None."""
+    frame = cam.video_first_frame
+    if isinstance(frame, FirstFrame):
+        return frame.result()
+    return frame
+
+
+def segmented_output(cam, output_path):
+    """
+    Makes a SegmentedOutput for a recording to output_path, split at the
+    video_split and video_split_mb limits, if any.
+    """
+    return SegmentedOutput(
+        lambda path: cam.backend.file_output(path, pts=pts_path(path)),
+        (output_path, h264_path(output_path)),
+        lambda: next_segment_paths(cam),
+        lambda path, raw_path: finish_segment(cam, path, raw_path),
+        cam.config["video_split"],
+        cam.config["video_split_mb"] * 1000000,
+    )
+
+
+def next_segment_paths(cam):
+    """Names the next segment of a recording from the video_output_path."""
+    output_path = cam.make_filename(cam.config["video_output_path"])
+    cam.current_video_path = output_path
+    cam.video_first_frame = FirstFrame(cam)
+    return output_path, h264_path(output_path)
+
+
+def finish_segment(cam, output_path, raw_path):
+    """
+    Gives a finished segment of a recording its thumbnail (and so its video
+    index), and queues it to be made into an MP4 in the background.
+    """
+    if raw_path != output_path:
+        cam.remux_pool.submit(raw_path, output_path)
+    cam.generate_thumbnail("v", output_path, frame=first_frame(cam))
+    cam.print_to_logfile("Video file finished: " + os.path.basename(output_path))
+
+
+def h264_path(output_path):
+    """Returns where the raw H.264 stream of a recording to output_path goes."""
+    if output_path.endswith(".h264"):
+        return output_path
+    return os.path.splitext(output_path)[0] + ".h264"
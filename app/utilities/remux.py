@@ -0,0 +1,156 @@
+import os
+import queue
+import subprocess
+import threading
+
+DEFAULT_FRAMERATE = 30.0  # Used for recordings without any timestamps.
+
+
+def pts_path(raw_path):
+    """Returns where the timestamps of a raw H.264 recording are written."""
+    return os.path.splitext(raw_path)[0] + ".pts"
+
+
+def read_framerate(path):
+    """
+    Works out the average frame rate of a recording from its timestamps file,
+    in Picamera2's 'timecode format v2' (one time in milliseconds per line).
+
+    Returns:
+        Frames per second, or None if there are too few timestamps.
+    """
+    times = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                times.append(float(line))
+    if (len(times) < 2) or (times[-1] <= times[0]):
+        return None
+    return (len(times) - 1) / ((times[-1] - times[0]) / 1000)
+
+
+def lower_priority(niceness=10):
+    """Lowers the priority of the calling thread, and so of processes it starts."""
+    try:
+        # Niceness is per thread on Linux, and inherited by child processes.
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+    except (AttributeError, OSError):
+        pass  # Not supported here, run at normal priority.
+
+
+class RemuxPool:
+    """
+    Bounded pool of low priority threads that package finished raw H.264
+    recordings as MP4s, away from the capture path. Recordings waiting to be
+    packaged are listed in the 'queue_path' file, so any left over when the
+    program is stopped or killed are picked up again the next time it starts.
+    """
+
+    def __init__(self, cam, workers=1, queue_path=None):
+        """
+        Args:
+            cam: CameraCoreModel instance.
+            workers: Number of recordings packaged in parallel.
+            queue_path: File listing the recordings waiting, None to not keep one.
+        """
+        self.cam = cam
+        self.queue_path = queue_path
+        self.completed = 0
+        self.failed = 0
+        self._pending = []  # (raw path, MP4 path) of each recording not yet packaged.
+        self._lock = threading.Lock()
+        self._jobs = queue.Queue()
+        for job in self._load():
+            self._pending.append(job)
+            self._jobs.put(job)
+        if self._pending:
+            print("Packaging %d recordings left from before" % len(self._pending))
+        self._threads = []
+        for _ in range(max(int(workers), 1)):
+            thread = threading.Thread(target=self._work)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, raw_path, output_path):
+        """Queues a finished raw recording to be packaged as output_path."""
+        job = (raw_path, output_path)
+        with self._lock:
+            self._pending.append(job)
+            self._save()
+        self._jobs.put(job)
+
+    def _load(self):
+        """Reads the queue file, skipping recordings that no longer exist."""
+        if (not self.queue_path) or (not os.path.exists(self.queue_path)):
+            return []
+        jobs = []
+        with open(self.queue_path) as f:
+            for line in f:
+                paths = line.rstrip("\n").split("\t")
+                if (len(paths) == 2) and os.path.exists(paths[0]):
+                    jobs.append((paths[0], paths[1]))
+        return jobs
+
+    def _save(self):
+        """Rewrites the queue file. Call with the lock held."""
+        if not self.queue_path:
+            return
+        part_path = self.queue_path + ".part"
+        with open(part_path, "w") as f:
+            for raw_path, output_path in self._pending:
+                f.write(raw_path + "\t" + output_path + "\n")
+        os.replace(part_path, self.queue_path)  # Never leaves half a queue file.
+
+    def _work(self):
+        lower_priority()
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            ok = self._remux(*job)
+            with self._lock:
+                self._pending.remove(job)
+                self._save()
+                if ok:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+
+    def _remux(self, raw_path, output_path):
+        """Packages one recording, removing the raw stream and its timestamps."""
+        timestamps = pts_path(raw_path)
+        framerate = None
+        if os.path.exists(timestamps):
+            framerate = read_framerate(timestamps)
+        try:
+            self.cam.backend.remux(
+                raw_path, output_path, framerate if framerate else DEFAULT_FRAMERATE
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            print("ERROR: Failed to make MP4 of " + raw_path + ": " + str(e))
+            self.cam.print_to_logfile("MP4 packaging failed, kept " + raw_path)
+            return False
+        for path in [raw_path, timestamps]:
+            if os.path.exists(path):
+                os.remove(path)
+        if self.cam.media_index:
+            self.cam.media_index.update_size(output_path)
+        return True
+
+    def stats(self):
+        """Returns the number of recordings waiting and packaged."""
+        with self._lock:
+            return {
+                "depth": len(self._pending),
+                "completed": self.completed,
+                "failed": self.failed,
+            }
+
+    def stop(self):
+        """Waits for every queued recording to be packaged, then stops the threads."""
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
@@ -0,0 +1,77 @@
+class SegmentedOutput:
+    """
+    Encoder output writing a recording as raw H.264, rolling over to a new
+    file on the first keyframe once a segment is 'max_seconds' long or
+    'max_bytes' big (0 for no limit). Every segment starts on a keyframe and
+    the switch happens between two frames, so no frame is lost and each
+    segment can be played on its own.
+
+    next_paths() is called for the name of each new segment, returning its
+    (final path, raw H.264 path), and on_finish(final path, raw path) once
+    each segment is closed, including the last.
+    """
+
+    def __init__(
+        self, file_output, paths, next_paths, on_finish, max_seconds=0, max_bytes=0
+    ):
+        """
+        Args:
+            file_output: FileOutput-compatible class to write each segment with.
+            paths: (final path, raw path) of the first segment.
+            next_paths: Function naming the next segment.
+            on_finish: Function called with each closed segment.
+            max_seconds: Length of a segment before rolling over, 0 for no limit.
+            max_bytes: Size of a segment before rolling over, 0 for no limit.
+        """
+        self.file_output = file_output
+        self.paths = paths
+        self.next_paths = next_paths
+        self.on_finish = on_finish
+        self.max_us = int(max_seconds * 1000000)  # Encoder timestamps are in us.
+        self.max_bytes = int(max_bytes)
+        self.segments = 0  # Segments finished.
+        self._file = None
+        self._frames = 0  # Frames in the current segment.
+        self._bytes = 0  # Bytes in the current segment.
+        self._first_ts = None  # Timestamp of its first frame.
+
+    def start(self):
+        self._open(self.paths)
+
+    def stop(self):
+        if self._file is not None:
+            self._close()
+
+    def outputframe(
+        self, frame, keyframe=True, timestamp=None, packet=None, audio=False
+    ):
+        if keyframe and self._full(timestamp):
+            self._close()
+            self._open(self.next_paths())
+        self._file.outputframe(frame, keyframe, timestamp)
+        self._frames += 1
+        self._bytes += len(frame)
+        if self._first_ts is None:
+            self._first_ts = timestamp
+
+    def _full(self, timestamp):
+        """Whether the current segment has reached its length or size."""
+        if self._frames == 0:
+            return False
+        if self.max_us and (timestamp - self._first_ts >= self.max_us):
+            return True
+        return bool(self.max_bytes) and (self._bytes >= self.max_bytes)
+
+    def _open(self, paths):
+        self.paths = paths
+        self._file = self.file_output(paths[1])
+        self._file.start()
+        self._frames = 0
+        self._bytes = 0
+        self._first_ts = None
+
+    def _close(self):
+        self._file.stop()
+        self._file = None
+        self.segments += 1
+        self.on_finish(self.paths[0], self.paths[1])
@@ -0,0 +1,175 @@
+import queue
+import threading
+import time
+
+import numpy as np
+from core.frame_hub import FrameSubscription
+from PIL import Image
+
+
+class Timelapse:
+    """
+    Saves a frame of the running main stream every 'interval' seconds to the
+    lapse_output_path, numbering the frames of the sequence with '%t'.
+    Frame times are scheduled off the start of the sequence on the monotonic
+    clock, so they never drift however long a frame takes to grab or save;
+    if a whole interval is missed, that frame is skipped rather than taken
+    late. The newest frame is kept from a 'latest' frame hub subscription,
+    so one is ready the moment a frame is due. The camera is not
+    reconfigured and the hub never waits for the timelapse, so preview,
+    motion detection and recording carry on untouched. Frames are encoded
+    and saved on a separate thread. A frame is dropped (rather than waited
+    for) if the saving thread falls more than 'max_pending' frames behind.
+    If the sequence ends by itself, because the camera halted or frame
+    capture failed, the camera's timelapse_on flag is cleared and
+    'on_change' is called (e.g. to update the status file).
+    """
+
+    def __init__(self, cam, interval, max_pending=2, on_change=None):
+        self.cam = cam
+        self.interval = interval
+        self.on_change = on_change
+        self.index = None  # Image index of the sequence, shared by all its frames.
+        self.frames = 0  # Frames grabbed and queued for saving.
+        self.saved = 0  # Frames saved.
+        self.skipped = 0  # Frames not taken because a whole interval was missed.
+        self.dropped = 0  # Frames dropped because saving had fallen behind.
+        self.max_late = 0.0  # Longest a frame was grabbed after it was due, in seconds.
+        self.running = False
+        self._stop = threading.Event()
+        self._pending = queue.Queue(max_pending)
+        self._threads = []
+
+    def start(self):
+        # The whole sequence shares one image index, and one thumbnail.
+        _, self.index = self.cam.claim_image(self.cam.config["lapse_output_path"])
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._schedule),
+            threading.Thread(target=self._save_frames),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops taking frames and waits for those already taken to be saved."""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _stopping(self):
+        return self._stop.is_set() or self.cam.stop_event.is_set()
+
+    def _wait_until(self, due):
+        """Sleeps until due, returning False if the timelapse is stopped first."""
+        while not self._stopping():
+            delay = due - time.monotonic()
+            if delay <= 0:
+                return True
+            # Wake now and again to notice the camera being halted.
+            self._stop.wait(min(delay, 1.0))
+        return False
+
+    def _schedule(self):
+        frames = self.cam.frame_hub.subscribe("timelapse", FrameSubscription.LATEST)
+        start = time.monotonic()
+        slot = 0  # Number of the frame due next, counted from the start.
+        try:
+            while self._wait_until(start + slot * self.interval):
+                frame = frames.get(timeout=1.0)
+                if frame is not None:
+                    self._grab(frame, start + slot * self.interval)
+                elif frames.closed:
+                    break  # Frame capture failed.
+                # Carry on from the next slot still to come, so a slow grab
+                # skips frames instead of bunching them up.
+                now_slot = int((time.monotonic() - start) / self.interval) + 1
+                next_slot = max(slot + 1, now_slot)
+                self.skipped += next_slot - slot - 1
+                slot = next_slot
+        finally:
+            self.cam.frame_hub.unsubscribe(frames)
+            self._pending.put(None)  # Wakes the saving thread to finish up.
+
+    def _grab(self, frame, due):
+        """Queues a frame to be saved, releasing it."""
+        self.max_late = max(self.max_late, time.monotonic() - due)
+        if self._pending.full():
+            frame.release()
+            self.dropped += 1
+            return
+        # Copy the frame out so the camera gets its buffer straight back.
+        array = np.array(frame.request.make_array("main"))
+        metadata = frame.request.get_metadata()
+        frame.release()
+        self.frames += 1
+        self._pending.put((self.frames, array, metadata))
+
+    def _save_frames(self):
+        cam = self.cam
+        while True:
+            item = self._pending.get()
+            if item is None:
+                break
+            number, array, metadata = item
+            path = cam.make_filename(
+                cam.config["lapse_output_path"], self.index, number
+            )
+            # Main stream buffers are stored in BGR(X) order.
+            image = Image.fromarray(np.ascontiguousarray(array[:, :, 2::-1]))
+            try:
+                cam.picam2.helpers.save(image, metadata, path)
+            except OSError as e:
+                print("ERROR: Failed to save timelapse frame: " + str(e))
+                cam.print_to_logfile("Timelapse frame failed to save: " + path)
+                continue
+            self.saved += 1
+            if number == 1:
+                cam.generate_thumbnail("t", path, self.index, image)
+        # Not stopped with stop(), so nothing else will clear the flag.
+        ended = not self._stop.is_set() and (cam.timelapse is self)
+        if ended:
+            cam.timelapse_on = False
+        self.running = False
+        report = "Timelapse saved %d frames, %d skipped, %d dropped" % (
+            self.saved,
+            self.skipped,
+            self.dropped,
+        )
+        print(report)
+        cam.print_to_logfile(report)
+        if ended and self.on_change:
+            self.on_change(cam)
+
+
+def start_timelapse(cam, on_change=None):
+    """
+    Starts a timelapse sequence, unless one is already running.
+
+    Args:
+        cam: CameraCoreModel instance.
+        on_change: Function called with cam if the sequence ends by itself.
+    Returns:
+        The Timelapse, or None if one is already running.
+    """
+    if cam.timelapse and cam.timelapse.running:
+        print("ERROR: A timelapse is already in progress.")
+        return None
+    cam.timelapse_on = True
+    cam.timelapse = Timelapse(
+        cam, cam.config["timelapse_interval"], on_change=on_change
+    )
+    cam.timelapse.start()
+    cam.print_to_logfile("Timelapse started")
+    return cam.timelapse
+
+
+def stop_timelapse(cam):
+    """Stops the timelapse sequence, if any, once its frames are saved."""
+    cam.timelapse_on = False
+    if cam.timelapse:
+        was_running = cam.timelapse.running
+        cam.timelapse.stop()
+        if was_running:
+            cam.print_to_logfile("Timelapse stopped")
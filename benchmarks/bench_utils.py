@@ -0,0 +1,122 @@
+import os
+import sys
+import time
+
+# Benchmarks import the application modules the same way main.py does.
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+if APP_DIR not in sys.path:
+    sys.path.insert(0, APP_DIR)
+
+
+# Every setting CameraCoreModel expects in a config file, with all paths in a
+# temporary directory. Settings left blank keep their defaults.
+CONFIG_TEMPLATE = """
+status_file {tmp}/status_cam.txt
+control_file {tmp}/FIFO
+motion_pipe {tmp}/motionFIFO
+fifo_interval
+preview_path {tmp}/preview/cam_preview.jpg
+media_path {tmp}/media
+image_path {tmp}/media/im_%i_%Y%M%D_%h%m%s.jpg
+lapse_path {tmp}/media/tl_%i_%t_%Y%M%D_%h%m%s.jpg
+video_path {tmp}/media/vi_%v_%Y%M%D_%h%m%s.mp4
+width
+video_width
+video_height
+video_bitrate
+motion_external
+motion_threshold
+motion_initframes
+motion_startframes
+motion_stopframes
+autostart standard
+motion_detection
+user_config {tmp}/uconfig
+log_file {tmp}/scheduleLog.txt
+log_size
+motion_logfile {tmp}/motionLog.txt
+"""
+
+
+def write_config(tmp, settings=None):
+    """
+    Writes a config file (and the log files it names) into the directory tmp.
+
+    Args:
+        tmp: Directory to put the config file and all outputs in.
+        settings: Dict of settings to override or add. None/empty leaves them blank.
+    Returns:
+        Path of the config file.
+    """
+    settings = dict(settings) if settings else {}
+    lines = []
+    for line in CONFIG_TEMPLATE.format(tmp=tmp).strip().splitlines():
+        key = line.split()[0]
+        if key in settings:
+            value = settings.pop(key)
+            line = key + " " + (str(value) if value else "")
+        lines.append(line.strip())
+    for key, value in settings.items():
+        lines.append((key + " " + (str(value) if value else "")).strip())
+    config_path = os.path.join(tmp, "raspimjpeg")
+    with open(config_path, "w") as config_file:
+        config_file.write("\n".join(lines) + "\n")
+    for log in ["scheduleLog.txt", "motionLog.txt"]:
+        open(os.path.join(tmp, log), "a").close()
+    return config_path
+
+
+def summarise(samples, duration=None):
+    """
+    Summarises a list of durations (in seconds).
+
+    Args:
+        samples: List of durations in seconds.
+        duration: Wall-clock length of the run, used to work out the rate.
+    Returns:
+        Dict with count, rate (per second), and mean/p50/p95/max in milliseconds.
+    """
+    ordered = sorted(samples)
+    count = len(ordered)
+    summary = {"count": count, "rate": None, "mean": None, "p50": None}
+    summary.update({"p95": None, "max": None})
+    if duration:
+        summary["rate"] = count / duration
+    if count:
+        summary["mean"] = 1000 * sum(ordered) / count
+        summary["p50"] = 1000 * ordered[int(0.50 * (count - 1))]
+        summary["p95"] = 1000 * ordered[int(0.95 * (count - 1))]
+        summary["max"] = 1000 * ordered[-1]
+    return summary
+
+
+def format_table(rows):
+    """
+    Formats {name: summary} rows (as returned by summarise()) as a text table.
+    """
+    columns = ["count", "rate", "mean", "p50", "p95", "max"]
+    headings = ["count", "rate/s", "mean ms", "p50 ms", "p95 ms", "max ms"]
+    width = max([len(name) for name in rows] + [5]) + 2
+    lines = ["stage".ljust(width) + "".join(h.rjust(10) for h in headings)]
+    for name, summary in rows.items():
+        line = name.ljust(width)
+        for column in columns:
+            value = summary.get(column)
+            if value is None:
+                line += "-".rjust(10)
+            elif isinstance(value, int):
+                line += str(value).rjust(10)
+            else:
+                line += ("%.2f" % value).rjust(10)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def time_repeated(func, repeats, *args):
+    """Calls func(*args) 'repeats' times and returns the list of durations in seconds."""
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(*args)
+        durations.append(time.perf_counter() - start)
+    return durations
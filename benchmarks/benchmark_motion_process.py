@@ -0,0 +1,173 @@
+"""
+Out-of-process motion detection benchmark.
+
+Runs the full pipeline against the simulated camera with motion detection on,
+scoring motion in the camera process and then in a worker process
+(motion_process), and reports the camera process's CPU use, the worker's,
+and the jitter of the intervals between previews and between motion frames.
+
+Usage:
+    python benchmarks/benchmark_motion_process.py [--duration 10] [--fps 30]
+        [--detector background] [--width 1920] [--height 1080]
+        [--preview-source lores] [--preview-width 1024]
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from bench_utils import format_table, summarise, write_config
+from core import process
+from core.model import CameraCoreModel
+from core.simulated import MotionScene, SimulatedPicamera2
+from utilities import motion_detect
+
+
+def child_cpu_time():
+    """Returns the CPU seconds used so far by this process's live children."""
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    for child in multiprocessing.active_children():
+        try:
+            with open("/proc/%d/stat" % child.pid) as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        total += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+    return total
+
+
+def intervals(times):
+    return [b - a for a, b in zip(times, times[1:])]
+
+
+def jitter(times):
+    """Returns the standard deviation of the intervals between times, in ms."""
+    gaps = intervals(times)
+    return 1000 * statistics.pstdev(gaps) if len(gaps) > 1 else None
+
+
+def run(motion_in_process, args):
+    """Runs the pipeline once and returns its measurements."""
+    tmp = tempfile.mkdtemp(prefix="raspycam-motion-")
+    config_path = write_config(
+        tmp,
+        {
+            "video_width": args.width,
+            "video_height": args.height,
+            "motion_detection": "true",
+            "motion_detector": args.detector,
+            "motion_process": "0" if motion_in_process else "1",
+            "preview_source": args.preview_source,
+            "width": args.preview_width,
+            "preview_fps": args.fps,
+            "preview_idle_timeout": 0,
+            "preview_skip_threshold": 0,
+            "log_size": 0,
+        },
+    )
+    SimulatedPicamera2.framerate = args.fps
+    SimulatedPicamera2.scene = MotionScene.from_string("still:2,motion:2")
+    preview_times, motion_times = [], []
+
+    # Time each motion frame as the detector is handed it.
+    start_motion_detector = motion_detect.start_motion_detector
+
+    def timed_detector(*detector_args):
+        detector = start_motion_detector(*detector_args)
+        detect = detector.detect
+
+        def timed_detect(y_plane):
+            motion_times.append(time.monotonic())
+            return detect(y_plane)
+
+        detector.detect = timed_detect
+        return detector
+
+    generate_preview = process.generate_preview
+
+    def timed_preview(cam, request):
+        generate_preview(cam, request)
+        preview_times.append(time.monotonic())
+
+    motion_detect.start_motion_detector = timed_detector
+    process.generate_preview = timed_preview
+    CameraCoreModel.process_running = False
+    runner = threading.Thread(
+        target=process.start_background_process, args=([config_path], "simulated")
+    )
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            runner.start()
+            time.sleep(args.warmup)
+            del preview_times[:], motion_times[:]
+            cpu, child_cpu = time.process_time(), child_cpu_time()
+            wall = time.monotonic()
+            time.sleep(args.duration)
+            cpu = time.process_time() - cpu
+            child_cpu = child_cpu_time() - child_cpu
+            wall = time.monotonic() - wall
+            previews, motion = list(preview_times), list(motion_times)
+            process.stop_process()
+            runner.join()
+    finally:
+        motion_detect.start_motion_detector = start_motion_detector
+        process.generate_preview = generate_preview
+    return {
+        "cpu": 100 * cpu / wall,
+        "child_cpu": 100 * child_cpu / wall,
+        "preview": previews,
+        "motion": motion,
+        "duration": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--detector", default="background")
+    parser.add_argument("--width", type=int, default=1920, help="Main stream width.")
+    parser.add_argument("--height", type=int, default=1080, help="Main stream height.")
+    parser.add_argument(
+        "--preview-source",
+        default="lores",
+        help="'lores' also runs motion detection at the preview size.",
+    )
+    parser.add_argument("--preview-width", type=int, default=1024)
+    args = parser.parse_args()
+
+    results = {}
+    for name, in_process in [("in-process", True), ("motion_process", False)]:
+        results[name] = run(in_process, args)
+    rows = {}
+    for name, result in results.items():
+        for stage in ["preview", "motion"]:
+            rows[name + " " + stage + " interval"] = summarise(
+                intervals(result[stage]), result["duration"]
+            )
+    print(format_table(rows))
+    print()
+    for name, result in results.items():
+        print(
+            "%-15s camera process CPU %5.1f%%, motion worker CPU %5.1f%%, "
+            "preview jitter %.2f ms, motion jitter %.2f ms"
+            % (
+                name,
+                result["cpu"],
+                result["child_cpu"],
+                jitter(result["preview"]) or 0,
+                jitter(result["motion"]) or 0,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
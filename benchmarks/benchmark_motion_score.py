@@ -0,0 +1,159 @@
+"""
+Motion scoring micro-benchmark.
+
+Compares the original np.square(np.subtract(cur, prev)).mean() expression
+with MotionScorer on synthetic lores Y planes, reporting time and memory
+allocated per frame, and the MSE each one reports. Then runs each motion
+detector over a sequence with sensor noise and lighting flicker followed by
+real motion, reporting time per frame and how often each one triggers.
+
+Usage:
+    python benchmarks/benchmark_motion_score.py [--width 320] [--height 240] [--frames 2000]
+"""
+
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from bench_utils import format_table, summarise, time_repeated
+from utilities.motion_detectors import MOTION_DETECTORS
+from utilities.motion_score import MotionScorer
+
+
+def make_frames(width, height):
+    """Two Y planes with a moved bright box and some sensor noise."""
+    rng = np.random.default_rng(0)
+    base = np.tile(np.linspace(16, 240, width, dtype=np.uint8), (height, 1))
+    frames = []
+    for left in [width // 4, width // 4 + 12]:
+        frame = base.copy()
+        top, right, bottom = height // 3, left + width // 5, height // 3 + height // 4
+        frame[top:bottom, left:right] = 230
+        noise = rng.integers(-3, 4, frame.shape)
+        frames.append(np.clip(frame + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def make_sequence(width, height, frames, noise, flicker):
+    """
+    Y planes of a static scene with sensor noise and brightness flicker for the
+    first half, and a box moving across it for the second half.
+    """
+    rng = np.random.default_rng(1)
+    base = np.tile(np.linspace(16, 240, width), (height, 1))
+    sequence = []
+    for i in range(frames):
+        frame = base + rng.normal(0, noise, base.shape)
+        frame += flicker if i % 2 else -flicker
+        if i >= frames // 2:
+            left = (4 * i) % (width - width // 5)
+            right, top, bottom = (
+                left + width // 5,
+                height // 3,
+                height // 3 + height // 4,
+            )
+            frame[top:bottom, left:right] = 230
+        sequence.append(np.clip(frame, 0, 255).astype(np.uint8))
+    return sequence
+
+
+def benchmark_detectors(args):
+    """Runs every motion detector over a noisy sequence with motion in its second half."""
+    config = {
+        "motion_decimation": args.decimation,
+        "motion_block_size": 0,
+        "motion_noise_floor": args.noise_floor,
+        "motion_background_rate": 0.05,
+    }
+    sequence = make_sequence(args.width, args.height, 200, args.noise, args.flicker)
+    rows = {}
+    details = []
+    for name, detector_class in MOTION_DETECTORS.items():
+        detector = detector_class(args.width, args.height, config)
+        scores = [detector.detect(frame) for frame in sequence]  # Also warms up.
+        half = len(scores) // 2
+        still = [s for s in scores[:half] if s is not None]
+        moving = scores[half:]
+        details.append(
+            "%-20s false triggers %3d/%d   motion detected %3d/%d"
+            % (
+                name,
+                sum(s > args.threshold for s in still),
+                len(still),
+                sum(s > args.threshold for s in moving),
+                len(moving),
+            )
+        )
+        frame = iter(sequence * (args.frames // len(sequence) + 1))
+        rows[name + " detector"] = summarise(
+            time_repeated(lambda: detector.detect(next(frame)), args.frames)
+        )
+        details.append(
+            "%-20s allocated %8d bytes/frame"
+            % (name, allocated_per_call(detector.detect, sequence[-1]))
+        )
+    print(format_table(rows))
+    print(
+        "\nthreshold %.1f, noise sigma %.1f, flicker +/-%.1f"
+        % (args.threshold, args.noise, args.flicker)
+    )
+    print("\n".join(details))
+
+
+def allocated_per_call(func, *args):
+    """Peak bytes allocated by one call of func, as seen by tracemalloc."""
+    func(*args)  # Warm up any lazily allocated state first.
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--width", type=int, default=320)
+    parser.add_argument("--height", type=int, default=240)
+    parser.add_argument("--frames", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=7.0)
+    parser.add_argument("--decimation", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=2.0, help="Sensor noise sigma.")
+    parser.add_argument(
+        "--flicker", type=float, default=3.0, help="Brightness flicker."
+    )
+    parser.add_argument("--noise-floor", type=float, default=6.0)
+    args = parser.parse_args()
+
+    cur, prev = make_frames(args.width, args.height)
+
+    def original(cur, prev):
+        return np.square(np.subtract(cur, prev)).mean()
+
+    candidates = {"original expression": original}
+    for decimation, block_size in [(1, 0), (2, 0), (1, 16), (2, 8)]:
+        scorer = MotionScorer(args.width, args.height, decimation, block_size)
+        name = "MotionScorer d=%d" % decimation
+        if block_size:
+            name += " blocks=%d" % block_size
+        candidates[name] = scorer.score
+
+    rows = {}
+    details = []
+    true_mse = np.square(cur.astype(np.int64) - prev).mean()
+    for name, func in candidates.items():
+        rows[name] = summarise(time_repeated(func, args.frames, cur, prev))
+        details.append(
+            "%-30s MSE %10.3f   allocated %8d bytes/frame"
+            % (name, func(cur, prev), allocated_per_call(func, cur, prev))
+        )
+    print(format_table(rows))
+    print("\nexact MSE %.3f" % true_mse)
+    print("\n".join(details))
+    print()
+    benchmark_detectors(args)
+
+
+if __name__ == "__main__":
+    main()
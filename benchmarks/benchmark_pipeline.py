@@ -0,0 +1,419 @@
+"""
+End-to-end pipeline benchmark.
+
+Runs the full start_background_process() pipeline against the simulated camera
+backend, sends commands through the control FIFO like RPi Cam Web Interface
+does, and reports per-stage throughput and latency. Runs on any Linux box.
+
+Usage:
+    python benchmarks/benchmark_pipeline.py [--duration 10] [--fps 30]
+        [--scene still:2,motion:2] [--stills 3] [--record 2] [--json out.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import select
+import tempfile
+import threading
+import time
+from collections import deque
+
+from bench_utils import format_table, summarise, write_config
+from core import process
+from core.frame_hub import FrameSubscription
+from core.model import CameraCoreModel
+from core.simulated import MotionScene, SimulatedPicamera2
+
+
+class StageTimer:
+    """Records call durations of the pipeline functions it wraps."""
+
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, value):
+        with self.lock:
+            self.samples.setdefault(name, []).append(value)
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+
+    def wrap(self, name, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.record(name, time.perf_counter() - start)
+
+        return timed
+
+
+class CommandSender:
+    """
+    Writes commands into the control FIFO and measures how long each takes to
+    reach execute_command(). Each command waits for the previous one to be
+    dispatched, so commands are never merged into a single pipe read.
+    """
+
+    def __init__(self, fifo_path, timer):
+        self.fifo_path = fifo_path
+        self.timer = timer
+        self.pending = deque()
+        self.dispatched = threading.Event()
+
+    def wrap_execute(self, func):
+        def execute(cmd_tuple, *args, **kwargs):
+            if self.pending:
+                self.timer.record(
+                    "command latency", time.monotonic() - self.pending.popleft()
+                )
+            try:
+                return self.timer.wrap("command " + cmd_tuple[0], func)(
+                    cmd_tuple, *args, **kwargs
+                )
+            finally:
+                self.dispatched.set()
+
+        return execute
+
+    def send(self, command, timeout=5.0):
+        self.dispatched.clear()
+        self.pending.append(time.monotonic())
+        fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+        os.write(fd, (command + "\n").encode())
+        os.close(fd)
+        if not self.dispatched.wait(timeout):
+            self.pending.clear()
+            return False
+        return True
+
+
+class MotionPipeReader:
+    """Reads the motion FIFO and records when motion start/stop codes arrive."""
+
+    def __init__(self, path):
+        self.fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+        self.events = []
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            ready, _, _ = select.select([self.fd], [], [], 0.05)
+            if ready:
+                now = time.monotonic()
+                try:
+                    data = os.read(self.fd, 64)
+                except BlockingIOError:
+                    continue
+                for code in data.decode():
+                    self.events.append((now, code))
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.fd)
+
+
+def wrap_subscription_get(timer, get, seen):
+    """
+    Wraps FrameSubscription.get to record how long each consumer spends on a
+    frame, i.e. the time from one get() returning to the next get() call.
+    Subscriptions are collected into 'seen' to report their drop counts.
+    """
+    last_return = {}
+
+    def timed_get(subscription, *args, **kwargs):
+        if subscription.name == "oneshot":
+            return get(subscription, *args, **kwargs)
+        called = time.monotonic()
+        seen[subscription.name] = subscription
+        if subscription.name in last_return:
+            timer.record(
+                subscription.name + " work", called - last_return[subscription.name]
+            )
+        frame = get(subscription, *args, **kwargs)
+        last_return[subscription.name] = time.monotonic()
+        return frame
+
+    return timed_get
+
+
+class PreviewViewer:
+    """Reads the preview file at a fixed rate, like a browser showing the web UI."""
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.interval = 1.0 / fps
+        self.reads = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                with open(self.path, "rb") as preview:
+                    preview.read()
+                self.reads += 1
+            except FileNotFoundError:
+                pass
+            time.sleep(self.interval)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+def wait_for(condition, timeout):
+    """Polls condition() until it is true or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def capture_summary(camera, kind, field, since, duration):
+    """Summarises the wait (field 1) or work (field 2) timings of a capture call type."""
+    stats = camera.capture_stats.get(kind, [])
+    samples = [s[field] for s in list(stats) if s[0] >= since and s[field] is not None]
+    return summarise(samples, duration)
+
+
+def run_benchmark(args):
+    tmp = tempfile.mkdtemp(prefix="raspycam-bench-")
+    config_path = write_config(
+        tmp,
+        {
+            "video_width": args.width,
+            "video_height": args.height,
+            "motion_detection": "true" if args.motion else "",
+            "motion_detector": args.detector,
+            "preview_source": args.preview_source,
+        },
+    )
+
+    SimulatedPicamera2.framerate = args.fps
+    SimulatedPicamera2.noise = args.noise
+    SimulatedPicamera2.scene = MotionScene.from_string(args.scene)
+
+    timer = StageTimer()
+    sender = CommandSender(os.path.join(tmp, "FIFO"), timer)
+    originals = {
+        name: getattr(process, name)
+        for name in [
+            "generate_preview",
+            "capture_still_request",
+            "toggle_cam_record",
+            "execute_command",
+        ]
+    }
+    models = []
+    timed_preview = timer.wrap("preview", process.generate_preview)
+
+    def generate_preview(cam, request):
+        if not models:
+            models.append(cam)  # Keep hold of the model to read its stats.
+        return timed_preview(cam, request)
+
+    process.generate_preview = generate_preview
+    process.capture_still_request = timer.wrap(
+        "still capture", process.capture_still_request
+    )
+    process.toggle_cam_record = timer.wrap("record toggle", process.toggle_cam_record)
+    process.execute_command = sender.wrap_execute(process.execute_command)
+    original_get = FrameSubscription.get
+    subscriptions = {}
+    FrameSubscription.get = wrap_subscription_get(timer, original_get, subscriptions)
+
+    errors = []
+
+    def pipeline():
+        try:
+            process.start_background_process([config_path], "simulated")
+        except Exception as e:
+            errors.append(e)
+            CameraCoreModel.process_running = False
+
+    log = io.StringIO()
+    results = {}
+    still_worker = None
+    quiet = (
+        contextlib.redirect_stdout(log)
+        if not args.verbose
+        else contextlib.nullcontext()
+    )
+    with quiet:
+        pipeline_thread = threading.Thread(target=pipeline)
+        pipeline_thread.start()
+        try:
+            if not wait_for(
+                lambda: CameraCoreModel.process_running
+                and SimulatedPicamera2.instances,
+                30,
+            ):
+                raise RuntimeError("Pipeline did not start: " + repr(errors))
+            camera = SimulatedPicamera2.instances[-1]
+            motion_reader = MotionPipeReader(os.path.join(tmp, "motionFIFO"))
+            viewer = None
+            if args.viewer_fps > 0:
+                viewer = PreviewViewer(
+                    os.path.join(tmp, "preview", "cam_preview.jpg"), args.viewer_fps
+                )
+            time.sleep(args.warmup)
+
+            timer.reset()
+            dropped_before = {n: sub.dropped for n, sub in subscriptions.items()}
+            cpu_start = time.process_time()
+            start = time.monotonic()
+            for _ in range(args.stills):
+                sender.send("im")
+            if args.record > 0:
+                sender.send("ca 1")
+                time.sleep(args.record)
+                sender.send("ca 0")
+            remaining = args.duration - (time.monotonic() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+            elapsed = time.monotonic() - start
+            cpu = time.process_time() - cpu_start
+            if models and models[0].preview_scheduler:
+                results["preview"] = models[0].preview_scheduler.stats()
+            still_worker = models[0].still_worker if models else None
+        finally:
+            process.stop_process()
+            pipeline_thread.join()  # Also waits for any stills still being saved.
+            for name, func in originals.items():
+                setattr(process, name, func)
+            FrameSubscription.get = original_get
+    if still_worker:
+        results["stills"] = still_worker.stats()
+    motion_reader.stop()
+    if viewer:
+        viewer.stop()
+
+    rows = {
+        "capture_request wait": capture_summary(camera, "request", 1, start, elapsed),
+    }
+    for name in sorted(timer.samples):
+        rows[name] = summarise(timer.samples[name], elapsed)
+
+    # Motion trigger latency: time from each scripted motion start to the '1' on the motion pipe.
+    scene_starts = [
+        camera._start_time + t
+        for t in SimulatedPicamera2.scene.motion_starts(elapsed + args.warmup + 60)
+    ]
+    trigger_latencies = []
+    for event_time, code in motion_reader.events:
+        if code == "1" and event_time >= start:
+            previous = [s for s in scene_starts if s <= event_time]
+            if previous:
+                trigger_latencies.append(event_time - previous[-1])
+    rows["motion trigger latency"] = summarise(trigger_latencies, elapsed)
+
+    results["stages"] = rows
+    results["dropped_frames"] = {
+        name: sub.dropped - dropped_before.get(name, 0)
+        for name, sub in subscriptions.items()
+        if name != "oneshot"
+    }
+    results["duration"] = elapsed
+    results["camera_fps"] = args.fps
+    results["cpu_percent"] = 100 * cpu / elapsed
+    results["errors"] = [repr(e) for e in errors]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Measured seconds."
+    )
+    parser.add_argument("--warmup", type=float, default=1.0, help="Unmeasured seconds.")
+    parser.add_argument("--fps", type=float, default=30.0, help="Simulated frame rate.")
+    parser.add_argument("--width", type=int, default=1920, help="Main stream width.")
+    parser.add_argument("--height", type=int, default=1080, help="Main stream height.")
+    parser.add_argument("--noise", type=int, default=0, help="Sensor noise amplitude.")
+    parser.add_argument(
+        "--scene",
+        default="still:2,motion:2",
+        help="Scripted scene, e.g. still:2,motion:2",
+    )
+    parser.add_argument(
+        "--stills", type=int, default=3, help="Number of 'im' commands."
+    )
+    parser.add_argument(
+        "--record",
+        type=float,
+        default=2.0,
+        help="Seconds of 'ca 1' recording, 0 to skip.",
+    )
+    parser.add_argument(
+        "--no-motion",
+        action="store_false",
+        dest="motion",
+        help="Leave motion detection off.",
+    )
+    parser.add_argument(
+        "--detector", default="mse", help="Motion detector: mse or background."
+    )
+    parser.add_argument(
+        "--preview-source", default="main", help="Preview source: main or lores."
+    )
+    parser.add_argument("--json", default=None, help="Also write results to this file.")
+    parser.add_argument(
+        "--viewer-fps",
+        type=float,
+        default=5.0,
+        help="Rate at which a simulated viewer reads the preview, 0 for no viewer.",
+    )
+    parser.add_argument("--verbose", action="store_true", help="Show pipeline output.")
+    args = parser.parse_args()
+
+    results = run_benchmark(args)
+    print(format_table(results["stages"]))
+    print(
+        "\nduration %.1fs, camera %.0f fps, process CPU %.1f%% of one core"
+        % (results["duration"], results["camera_fps"], results["cpu_percent"])
+    )
+    dropped = ", ".join("%s %d" % item for item in results["dropped_frames"].items())
+    print("frames dropped by consumer: " + (dropped if dropped else "none"))
+    if "preview" in results:
+        preview = results["preview"]
+        print(
+            "preview scheduler: %.1f fps, %d published, %d skipped unchanged, idle %s"
+            % (
+                preview["fps"],
+                preview["published"],
+                preview["skipped_unchanged"],
+                preview["idle"],
+            )
+        )
+    if results.get("stills", {}).get("completed"):
+        stills = results["stills"]
+        print(
+            "still worker: %d saved, %d dropped, mean ms per stage: %s"
+            % (
+                stills["completed"],
+                stills["rejected"],
+                ", ".join("%s %.0f" % item for item in stills["mean_ms"].items()),
+            )
+        )
+    for error in results["errors"]:
+        print("pipeline error: " + error)
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
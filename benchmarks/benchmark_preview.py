@@ -0,0 +1,79 @@
+"""
+Preview generation benchmark.
+
+Generates previews from the simulated camera with each preview source and
+reports the CPU time and wall time spent per preview frame: 'main' downscales
+the full resolution main stream in software, 'lores' encodes the lores stream
+the ISP has already scaled to the preview size.
+
+Usage:
+    python benchmarks/benchmark_preview.py [--frames 50] [--width 1920] [--height 1080]
+"""
+
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+
+from bench_utils import format_table, summarise, write_config
+from core.backend import load_backend
+from core.model import CameraCoreModel
+from utilities.preview import generate_preview
+
+
+def time_previews(source, args):
+    """Returns (cpu times, wall times) of generating previews with the given source."""
+    tmp = tempfile.mkdtemp(prefix="raspycam-preview-")
+    config_path = write_config(
+        tmp,
+        {
+            "video_width": args.width,
+            "video_height": args.height,
+            "width": args.preview_width,
+            "preview_source": source,
+        },
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        cam = CameraCoreModel(0, config_path, load_backend("simulated"))
+    cpu_times, wall_times = [], []
+    try:
+        for _ in range(args.frames):
+            request = cam.capture_request()
+            wall, cpu = time.perf_counter(), time.thread_time()
+            generate_preview(cam, request)
+            cpu_times.append(time.thread_time() - cpu)
+            wall_times.append(time.perf_counter() - wall)
+            request.release()
+    finally:
+        cam.teardown()
+    return cpu_times, wall_times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--frames", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1920, help="Main stream width.")
+    parser.add_argument("--height", type=int, default=1080, help="Main stream height.")
+    parser.add_argument("--preview-width", type=int, default=512)
+    args = parser.parse_args()
+
+    rows = {}
+    mean_cpu = {}
+    for source in ["main", "lores"]:
+        cpu_times, wall_times = time_previews(source, args)
+        rows[source + " cpu"] = summarise(cpu_times)
+        rows[source + " wall"] = summarise(wall_times)
+        mean_cpu[source] = rows[source + " cpu"]["mean"]
+    print(format_table(rows))
+    print(
+        "\nlores saves %.2f ms of CPU per preview frame (%.0f%%)"
+        % (
+            mean_cpu["main"] - mean_cpu["lores"],
+            100 * (mean_cpu["main"] - mean_cpu["lores"]) / mean_cpu["main"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Raw development benchmark.
+
+Develops synthetic 10-bit Bayer frames at the full resolutions of the common
+Raspberry Pi camera sensors, comparing the original single cv2.cvtColor call
+(on the raw bytes, with no black level, white balance, colour matrix or gamma)
+with RawDeveloper on one thread and on a thread pool. Reports time per frame,
+megapixels per second and the peak memory allocated while developing.
+
+Usage:
+    python benchmarks/benchmark_raw_develop.py [--repeats 5] [--threads 4] [--tile-rows 128]
+"""
+
+import argparse
+import os
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from bench_utils import format_table, summarise, time_repeated
+from utilities.raw_develop import RawDeveloper
+
+# Full sensor resolutions (width, height) of Raspberry Pi camera modules.
+SENSORS = {
+    "OV5647 (v1)": (2592, 1944),
+    "IMX219 (v2)": (3280, 2464),
+    "IMX708 (v3)": (4608, 2592),
+    "IMX477 (HQ)": (4056, 3040),
+}
+
+METADATA = {
+    "SensorBlackLevels": (4096, 4096, 4096, 4096),
+    "ColourGains": (1.8, 1.5),
+    "ColourCorrectionMatrix": (1.7, -0.5, -0.2, -0.3, 1.6, -0.3, -0.05, -0.6, 1.65),
+}
+
+
+def make_raw(width, height, packed):
+    """A SBGGR10 frame of a gradient with sensor noise, unpacked or CSI-2 packed."""
+    rng = np.random.default_rng(0)
+    ramp = np.linspace(64, 1000, width, dtype=np.float32)
+    pixels = np.tile(ramp, (height, 1))
+    pixels += rng.normal(0, 8, pixels.shape).astype(np.float32)
+    pixels = np.clip(pixels, 0, 1023).astype(np.uint16)
+    if not packed:
+        return pixels.view(np.uint8)
+    groups = pixels.reshape(height, width // 4, 4)
+    raw = np.empty((height, width // 4, 5), dtype=np.uint8)
+    raw[:, :, :4] = groups >> 2
+    raw[:, :, 4] = 0
+    for i in range(4):
+        raw[:, :, 4] |= ((groups[:, :, i] & 3) << (2 * i)).astype(np.uint8)
+    return raw.reshape(height, -1)
+
+
+def peak_memory(func, *args):
+    """Returns the peak bytes allocated while running func(*args)."""
+    tracemalloc.start()
+    func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--threads", type=int, default=os.cpu_count() or 1, help="Pool size."
+    )
+    parser.add_argument("--tile-rows", type=int, default=128)
+    parser.add_argument(
+        "--packed", action="store_true", help="Use CSI-2 packed raw (SBGGR10_CSI2P)."
+    )
+    args = parser.parse_args()
+
+    raw_format = "SBGGR10_CSI2P" if args.packed else "SBGGR10"
+    single = RawDeveloper(threads=1, tile_rows=args.tile_rows)
+    pooled = RawDeveloper(threads=args.threads, tile_rows=args.tile_rows)
+
+    def original(raw, width, height):
+        return cv2.cvtColor(raw, cv2.COLOR_BayerRG2BGR)
+
+    candidates = {
+        "original cvtColor": original,
+        "develop 1 thread": lambda raw, w, h: single.develop(
+            raw, w, h, raw_format, METADATA
+        ),
+        "develop %d threads"
+        % args.threads: lambda raw, w, h: pooled.develop(
+            raw, w, h, raw_format, METADATA
+        ),
+    }
+
+    rows = {}
+    details = []
+    for sensor, (width, height) in SENSORS.items():
+        raw = make_raw(width, height, args.packed)
+        megapixels = width * height / 1e6
+        for name, func in candidates.items():
+            if args.packed and name.startswith("original"):
+                continue  # The original only handled unpacked raw.
+            func(raw, width, height)  # Warm up.
+            durations = time_repeated(func, args.repeats, raw, width, height)
+            summary = summarise(durations)
+            rows[sensor + ", " + name] = summary
+            details.append(
+                "%s, %s: %.1f MP/s, peak %.1f MB allocated"
+                % (
+                    sensor,
+                    name,
+                    megapixels / (summary["mean"] / 1000),
+                    peak_memory(func, raw, width, height) / 1e6,
+                )
+            )
+    single.close()
+    pooled.close()
+
+    print(format_table(rows))
+    print()
+    print("\n".join(details))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from core.backend import load_backend  # type: ignore
+from core.frame_hub import FrameHub  # type: ignore
+from core.simulated import SimulatedPicamera2  # type: ignore
+
+
+@pytest.fixture
+def simulated_camera(monkeypatch):
+    """
+    Factory for configured and started simulated cameras. Keyword arguments
+    set SimulatedPicamera2's class-wide settings (framerate, scene, ...),
+    which are put back after the test. Every camera made is closed afterwards.
+    """
+    cameras = []
+
+    def make(streams, **settings):
+        for name, value in settings.items():
+            monkeypatch.setattr(SimulatedPicamera2, name, value)
+        camera = SimulatedPicamera2(0)
+        camera.configure(camera.create_video_configuration(**streams))
+        camera.start()
+        cameras.append(camera)
+        return camera
+
+    yield make
+    for camera in cameras:
+        camera.close()
+
+
+@pytest.fixture
+def simulated_cam(simulated_camera):
+    """
+    Factory for a mock CameraCoreModel around a started simulated camera,
+    with its FrameHub running. Afterwards stop_event is set, so any burst or
+    timelapse thread the test left running winds down, and the hub is stopped.
+    """
+    cams = []
+
+    def make(streams, config=None, **settings):
+        cam = MagicMock()
+        cam.picam2 = simulated_camera(streams, **settings)
+        cam.backend = load_backend("simulated")
+        cam.config = dict(config) if config else {}
+        cam.stop_event = threading.Event()
+        cam.frame_hub = FrameHub(cam.picam2.capture_request)
+        cam.frame_hub.start()
+        cams.append(cam)
+        return cam
+
+    yield make
+    for cam in cams:
+        cam.stop_event.set()
+        cam.frame_hub.stop()
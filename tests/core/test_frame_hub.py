@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+from core.frame_hub import FrameHub, FrameSubscription  # type: ignore
+
+
+def test_frame_hub_fan_out_and_drop_policy():
+    requests = []
+
+    def capture():
+        request = MagicMock()
+        requests.append(request)
+        return request
+
+    hub = FrameHub(capture)
+    latest = hub.subscribe("latest", FrameSubscription.LATEST)
+    queued = hub.subscribe("queued", FrameSubscription.QUEUE, maxlen=3)
+    hub.start()
+    # Let the hub capture a few frames that neither consumer picks up.
+    while hub.captured < 5:
+        pass
+    hub.stop()
+
+    # Both consumers share the same request objects, captured once.
+    frame = latest.get(timeout=1)
+    assert frame.request is requests[-1]
+    assert latest.dropped == hub.captured - 1
+    assert queued.dropped == hub.captured - 3
+    frame.release()
+
+    # Requests are only released once every consumer has released them.
+    assert not requests[-1].release.called
+    hub.unsubscribe(queued)
+    assert requests[-1].release.called
+    hub.unsubscribe(latest)
+    assert all(request.release.call_count == 1 for request in requests)
+
+
+def test_frame_hub_closes_subscriptions_when_capture_fails():
+    def capture():
+        raise OSError("camera unplugged")
+
+    on_error = MagicMock()
+    hub = FrameHub(capture, on_error=on_error)
+    preview = hub.subscribe("preview")
+    hub.start()
+    # The consumer is woken straight away, not after its timeout.
+    assert preview.get(timeout=5) is None
+    assert preview.closed
+    assert not hub.running
+    assert isinstance(hub.error, OSError)
+    on_error.assert_called_once_with(hub.error)
+    # Late subscribers find out at once too, until the hub is restarted.
+    assert hub.subscribe("still").closed
+    hub.stop()
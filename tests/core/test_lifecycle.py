@@ -0,0 +1,42 @@
+import threading
+import pytest
+from core.lifecycle import CameraLifecycle  # type: ignore
+
+
+def test_workers_wait_in_standby_and_exit_once_closed():
+    lifecycle = CameraLifecycle()
+    lifecycle.transition(CameraLifecycle.RUNNING)
+    assert lifecycle.wait_until_running(timeout=0)
+    lifecycle.transition(CameraLifecycle.STANDBY)
+    assert not lifecycle.wait_until_running(timeout=0.01)
+
+    results = []
+    worker = threading.Thread(
+        target=lambda: results.append(lifecycle.wait_until_running())
+    )
+    worker.start()
+    lifecycle.transition(CameraLifecycle.RUNNING)
+    worker.join(timeout=2)
+    assert results == [True]
+
+    lifecycle.transition(CameraLifecycle.CLOSED)
+    assert not lifecycle.wait_until_running()
+
+
+def test_invalid_transitions_are_refused():
+    lifecycle = CameraLifecycle()
+    lifecycle.transition(CameraLifecycle.CLOSED)
+    with pytest.raises(ValueError):
+        lifecycle.transition(CameraLifecycle.RUNNING)
+
+
+def test_resume_latency_is_measured_to_the_first_frame():
+    lifecycle = CameraLifecycle()
+    lifecycle.transition(CameraLifecycle.RUNNING)
+    assert lifecycle.first_frame() >= 0
+    assert lifecycle.first_frame() is None  # Only the first frame counts.
+    lifecycle.record_halt(0.002)
+    stats = lifecycle.stats()
+    assert stats["state"] == "running"
+    assert stats["resume"]["count"] == 1
+    assert stats["halt"]["last_ms"] == pytest.approx(2.0)
@@ -0,0 +1,68 @@
+import fcntl
+import re
+import threading
+import time
+from core.log_writer import LogWriter  # type: ignore
+
+
+def test_log_is_written_in_order_and_kept_to_its_line_limit(tmp_path):
+    log_path = str(tmp_path / "scheduleLog.txt")
+    with open(log_path, "w") as f:
+        f.write("[2026/01/01 00:00:00] Written by the scheduler\n" * 5)
+    writer = LogWriter()
+
+    def produce(n):
+        for i in range(50):
+            writer.log(log_path, "thread %d message %d" % (n, i), max_lines=40)
+
+    threads = [threading.Thread(target=produce, args=(n,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    writer.stop()
+    lines = open(log_path).read().splitlines()
+    assert 20 <= len(lines) <= 40
+    assert writer.written == 200
+    assert writer.trims > 0
+    assert all(
+        re.match(r"\{\d{4}/\d\d/\d\d \d\d:\d\d:\d\d\} thread", line) for line in lines
+    )
+    # Each thread's messages stay in the order they were logged.
+    for n in range(4):
+        numbers = [int(line.split()[-1]) for line in lines if "thread %d " % n in line]
+        assert numbers == sorted(numbers)
+    assert lines[-1].endswith("message 49")
+
+
+def test_lines_appended_by_the_scheduler_survive_trims(tmp_path):
+    log_path = str(tmp_path / "scheduleLog.txt")
+    open(log_path, "w").close()
+    writer = LogWriter()
+    done = threading.Event()
+
+    def scheduler():
+        # Holds the log open, as the scheduler may, locking each append.
+        with open(log_path, "a") as log_file:
+            for i in range(300):
+                fcntl.flock(log_file, fcntl.LOCK_EX)
+                log_file.write("[scheduler] line %d\n" % i)
+                log_file.flush()
+                fcntl.flock(log_file, fcntl.LOCK_UN)
+                time.sleep(0.0005)
+        done.set()
+
+    appender = threading.Thread(target=scheduler)
+    appender.start()
+    i = 0
+    while not done.is_set():
+        writer.log(log_path, "message %d" % i, max_lines=40)
+        i += 1
+        time.sleep(0.0002)
+    appender.join()
+    writer.stop()
+    assert writer.trims > 0
+    lines = open(log_path).read().splitlines()
+    numbers = [int(line.split()[-1]) for line in lines if "[scheduler]" in line]
+    # Trims only drop the oldest lines, so every line after them is still there.
+    assert numbers and (numbers == list(range(300 - len(numbers), 300)))
@@ -0,0 +1,43 @@
+import os
+from core.media_index import MediaIndex  # type: ignore
+
+
+def touch(path, size=0):
+    with open(path, "wb") as f:
+        f.write(bytes(size))
+
+
+def test_index_is_only_rebuilt_when_out_of_date(tmp_path):
+    media = str(tmp_path)
+    index_path = os.path.join(media, ".media_index")
+    touch(os.path.join(media, "im_0003.jpg"), 100)
+    touch(os.path.join(media, "im_0003.jpg.i3.th.jpg"))
+    touch(os.path.join(media, "tl_0005_0001.jpg.t5.th.jpg"))
+    touch(os.path.join(media, "vi_0002.mp4.v2.th.jpg"))
+    touch(os.path.join(media, "notes.txt.th.jpg"))  # Not a media thumbnail.
+
+    index = MediaIndex(index_path, [media, media])
+    assert index.load() == (6, 3)
+    assert index.rebuilt
+    index.add("v", 3, os.path.join(media, "vi_0003.mp4"))
+    touch(os.path.join(media, "vi_0003.mp4"), 50)
+    index.update_size(os.path.join(media, "vi_0003.mp4"))
+    index.close(6, 4)
+
+    # Stopped cleanly and nothing changed, so the checkpoint is used as it is.
+    index = MediaIndex(index_path, [media])
+    assert index.load() == (6, 4)
+    assert not index.rebuilt
+    summary = index.summary()
+    assert summary["i"]["bytes"] == 100
+    assert summary["v"]["files"] == 2
+    assert summary["v"]["bytes"] == 50
+    assert summary["v"]["newest"] == os.path.join(media, "vi_0003.mp4")
+    assert summary["v"]["oldest"] == os.path.join(media, "vi_0002.mp4")
+
+    # Media deleted while the program wasn't running.
+    os.remove(os.path.join(media, "im_0003.jpg.i3.th.jpg"))
+    index = MediaIndex(index_path, [media])
+    assert index.load() == (6, 3)  # vi_0003 never got its thumbnail.
+    assert index.rebuilt
+    assert index.summary()["i"]["files"] == 0
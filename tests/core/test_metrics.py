@@ -0,0 +1,52 @@
+import json
+from unittest.mock import MagicMock
+from core.metrics import Histogram, Metrics, StatsWriter, timed  # type: ignore
+
+
+def test_histogram_counts_values_into_buckets():
+    histogram = Histogram(buckets=(1, 2, 4))
+    for value in [0.5, 1, 3, 3, 10]:
+        histogram.observe(value)
+    assert histogram.counts == [2, 0, 2, 1]
+    assert histogram.quantile(0.5) == 4  # Upper bound of the median's bucket.
+    assert histogram.quantile(0.2) == 1
+    summary = histogram.summary(1000, "_ms")
+    assert summary["count"] == 5
+    assert summary["mean_ms"] == 3500
+    assert summary["max_ms"] == summary["last_ms"] == 10000
+
+
+def test_stages_and_sources_are_exported_for_prometheus():
+    cam = MagicMock()
+    cam.metrics = Metrics()
+
+    @timed("preview")
+    def generate_preview(cam):
+        return "jpeg"
+
+    assert generate_preview(cam) == "jpeg"
+    cam.metrics.observe_depth("command_queue", 3)
+    cam.metrics.add_source("lifecycle", lambda: {"state": "running", "halt": {}})
+    cam.metrics.add_source("frames", lambda: {"consumers": {"motion": {"dropped": 2}}})
+    cam.metrics.add_source("motion", lambda: None)  # No detector running.
+
+    text = cam.metrics.prometheus()
+    assert 'raspycam_preview_seconds_bucket{le="+Inf"} 1' in text
+    assert "raspycam_preview_seconds_count 1" in text
+    assert 'raspycam_command_queue_depth_bucket{le="4"} 1' in text
+    assert 'raspycam_lifecycle_state{value="running"} 1' in text
+    assert "raspycam_frames_consumers_motion_dropped 2" in text
+    assert "raspycam_motion" not in text
+
+
+def test_stats_file_is_written_as_json(tmp_path):
+    cam = MagicMock()
+    cam.metrics = Metrics()
+    cam.metrics.observe("capture", 0.03)
+    cam.metrics.add_source("log", lambda: {"depth": 0, "written": 4})
+    cam.config = {"stats_file": str(tmp_path / "stats.json")}
+    StatsWriter(cam).write()
+    stats = json.loads((tmp_path / "stats.json").read_text())
+    assert stats["timings"]["capture"]["count"] == 1
+    assert stats["log"] == {"depth": 0, "written": 4}
+    assert not (tmp_path / "stats.json.part").exists()
@@ -0,0 +1,40 @@
+import threading
+from unittest.mock import MagicMock
+from core.model import CameraCoreModel  # type: ignore
+
+
+def test_status_stays_halted_until_restart():
+    cam = MagicMock()
+    cam.picam2.started = True
+    cam.frame_hub.error = None
+    cam.capturing_still = False
+    cam.capturing_video = False
+    cam.motion_detection = False
+    cam.timelapse_on = False
+    cam.stop_event = threading.Event()
+    cam.stop_event.set()
+    # A still worker finishing while the threads are stopping must not
+    # overwrite 'halted', though the camera itself is still running.
+    CameraCoreModel.set_status(cam)
+    assert cam.current_status == "halted"
+    cam.stop_event.clear()
+    CameraCoreModel.set_status(cam)
+    assert cam.current_status == "ready"
+
+
+def test_file_is_indexed_and_thumbnailed_without_a_preview():
+    cam = MagicMock()
+    cam.index_lock = threading.Lock()
+    cam.video_file_index = 4
+    cam.preview_stream.latest.return_value = None  # No preview published yet.
+    cam.next_frame_thumbnail.return_value = "image"
+    CameraCoreModel.generate_thumbnail(cam, "v", "/tmp/vi_0004.mp4")
+    assert cam.video_file_index == 5
+    cam.media_index.add.assert_called_once_with("v", 4, "/tmp/vi_0004.mp4")
+    cam.thumbnails.submit.assert_called_once_with("/tmp/vi_0004.mp4.v4.th.jpg", "image")
+
+    # With no frame either, the file is still indexed.
+    cam.next_frame_thumbnail.return_value = None
+    CameraCoreModel.generate_thumbnail(cam, "v", "/tmp/vi_0005.mp4")
+    cam.media_index.add.assert_called_with("v", 5, "/tmp/vi_0005.mp4")
+    assert cam.thumbnails.submit.call_count == 1
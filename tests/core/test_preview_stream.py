@@ -0,0 +1,49 @@
+import http.client
+from unittest.mock import MagicMock
+from core.preview_stream import (  # type: ignore
+    PreviewStream,
+    parse_stream_address,
+    start_preview_server,
+    stop_preview_server,
+)
+
+
+def test_parse_stream_address():
+    assert parse_stream_address("8080") == ("127.0.0.1", 8080)
+    assert parse_stream_address("0.0.0.0:8080") == ("0.0.0.0", 8080)
+    assert parse_stream_address("/tmp/preview.sock") == "/tmp/preview.sock"
+
+
+def test_preview_server_streams_shared_buffer():
+    cam = MagicMock()
+    cam.config = {"preview_stream": "127.0.0.1:0"}
+    cam.preview_stream = PreviewStream()
+    server = start_preview_server(cam)
+    port = server.server_address[1]
+    try:
+        first = b"\xff\xd8first\xff\xd9"
+        cam.preview_stream.publish(first)
+
+        still = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        still.request("GET", "/preview.jpg")
+        assert still.getresponse().read() == first
+
+        clients = []
+        for _ in range(2):
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/stream.mjpg")
+            response = conn.getresponse()
+            assert response.getheader("Content-Type").startswith("multipart/")
+            clients.append((conn, response))
+        # Every client is sent each new frame.
+        for frame in [first, b"\xff\xd8second\xff\xd9"]:
+            cam.preview_stream.publish(frame)
+            for conn, response in clients:
+                data = b""
+                while frame not in data:
+                    data += response.read1(4096)
+        assert cam.preview_stream.clients == 2
+        for conn, response in clients:
+            conn.close()
+    finally:
+        stop_preview_server(cam, server)
@@ -1,6 +1,9 @@
 import os
+import threading
+import time
 from unittest.mock import patch
-from core.process import setup_fifo  # type: ignore
+from core.model import CameraCoreModel  # type: ignore
+from core.process import setup_fifo, parse_incoming_commands, read_pipe, stop_process  # type: ignore
 
 
 @patch("os.mkfifo")
@@ -14,3 +17,43 @@ def test_setup_fifo(mock_open, mock_mkfifo):
     mock_open.assert_called_once_with(
         "/tmp/control_fifo", os.O_RDONLY | os.O_NONBLOCK, 0o666
     )
+
+
+def test_parse_incoming_commands_event_driven():
+    # Commands should be queued as soon as they are written, without polling.
+    read_fd, write_fd = os.pipe()
+    os.set_blocking(read_fd, False)
+    CameraCoreModel.fifo_fd = read_fd
+    CameraCoreModel.wake_fds = os.pipe()
+    CameraCoreModel.process_running = True
+    intake = threading.Thread(target=parse_incoming_commands)
+    intake.start()
+
+    start = time.monotonic()
+    os.write(write_fd, b"im\n")
+    assert CameraCoreModel.command_queue.get(timeout=1) == [("im", "")]
+    assert time.monotonic() - start < 0.5
+
+    stop_process()
+    intake.join(timeout=1)
+    assert not intake.is_alive()
+    assert CameraCoreModel.command_queue.get(timeout=1) is None
+    for fd in [read_fd, write_fd] + list(CameraCoreModel.wake_fds):
+        os.close(fd)
+    CameraCoreModel.wake_fds = None
+
+
+def test_read_pipe_batches_and_partials():
+    read_fd, write_fd = os.pipe()
+    # Several commands in one write are all returned, in order.
+    os.write(write_fd, b"md 0\nca 1\r\nxx 1\nim")
+    assert read_pipe(read_fd) == [("md", "0"), ("ca", "1"), ("im", "")]
+
+    # A command cut off by a full read is completed by the next read.
+    read_size = CameraCoreModel.MAX_COMMAND_LEN * CameraCoreModel.FIFO_MAX
+    filler = b"\n" * (read_size - 3)
+    os.write(write_fd, filler + b"ca 0\n")
+    assert read_pipe(read_fd) == []
+    assert read_pipe(read_fd) == [("ca", "0")]
+    os.close(read_fd)
+    os.close(write_fd)
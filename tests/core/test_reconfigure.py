@@ -0,0 +1,66 @@
+import os
+from unittest.mock import MagicMock
+from core.reconfigure import ConfigWatcher, apply_config_changes  # type: ignore
+
+
+def make_cam():
+    cam = MagicMock()
+    cam.config = {
+        "motion_threshold": 7.0,
+        "preview_size": (512, 288),
+        "preview_source": "main",
+        "video_width": 1920,
+        "video_bitrate": 17000000,
+        "control_file": "/tmp/FIFO",
+    }
+    cam.config_version = 0
+    return cam
+
+
+def test_trivial_changes_are_applied_in_place():
+    cam = make_cam()
+    new_config = dict(cam.config, motion_threshold=10.0, preview_size=(640, 360))
+    new_config["video_bitrate"] = 8000000
+    applied, reconfigure = apply_config_changes(cam, new_config)
+    assert sorted(applied) == ["motion_threshold", "preview_size", "video_bitrate"]
+    assert not reconfigure
+    assert cam.config["motion_threshold"] == 10.0
+    assert cam.thumbnails.size == (640, 360)
+    assert cam.config_version == 1
+
+
+def test_stream_changes_need_a_reconfigure():
+    cam = make_cam()
+    _, reconfigure = apply_config_changes(cam, dict(cam.config, video_width=1280))
+    assert reconfigure
+    assert cam.config["video_width"] == 1280
+    # The preview size only changes the streams when the ISP makes the preview.
+    cam.config["preview_source"] = "lores"
+    _, reconfigure = apply_config_changes(
+        cam, dict(cam.config, preview_size=(320, 180))
+    )
+    assert reconfigure
+
+
+def test_startup_settings_are_left_alone():
+    cam = make_cam()
+    applied, reconfigure = apply_config_changes(
+        cam, dict(cam.config, control_file="/tmp/FIFO2")
+    )
+    assert applied == [] and not reconfigure
+    assert cam.config["control_file"] == "/tmp/FIFO"
+    assert cam.config_version == 0
+
+
+def test_watcher_sees_the_file_written(tmp_path):
+    path = str(tmp_path / "uconfig")
+    on_change = MagicMock()
+    watcher = ConfigWatcher(path, on_change)
+    assert not watcher.check()
+    with open(path, "w") as f:
+        f.write("motion_threshold 300\n")
+    assert watcher.check()
+    os.utime(path, ns=(1, 1))
+    assert watcher.check()
+    assert not watcher.check()
+    assert on_change.call_count == 2
@@ -0,0 +1,38 @@
+import numpy as np
+from core.backend import load_backend  # type: ignore
+from core.simulated import MotionScene, SimulatedPicamera2  # type: ignore
+
+STREAMS = {
+    "main": {"size": (64, 48), "format": "RGB888"},
+    "lores": {"size": (32, 24), "format": "YUV420"},
+    "raw": {"size": (80, 60), "format": "SBGGR10"},
+}
+
+
+def test_simulated_streams(simulated_camera):
+    camera = simulated_camera(STREAMS, scene=MotionScene(), framerate=200.0)
+    request = camera.capture_request()
+    assert request.make_array("main").shape == (48, 64, 3)
+    assert request.make_array("lores").shape == (36, 64)  # Rows padded to 64 bytes
+    assert request.make_array("raw").shape == (60, 160)  # 2 bytes per raw pixel
+    assert request.make_image("main", 16, 12).size == (16, 12)
+    assert "SensorTimestamp" in request.get_metadata()
+    request.release()
+
+
+def test_simulated_scene_motion(simulated_camera):
+    still_scene = MotionScene.from_string("still:10")
+    still = simulated_camera(STREAMS, scene=still_scene, framerate=200.0)
+    first, second = still.capture_buffer("lores"), still.capture_buffer("lores")
+    assert np.array_equal(first, second)
+
+    moving_scene = MotionScene.from_string("motion:10", speed=20.0)
+    moving = simulated_camera(STREAMS, scene=moving_scene, framerate=200.0)
+    first, second = moving.capture_buffer("lores"), moving.capture_buffer("lores")
+    assert not np.array_equal(first, second)
+
+
+def test_load_simulated_backend():
+    backend = load_backend("simulated")
+    assert backend.camera_class is SimulatedPicamera2
+    assert backend.global_camera_info()[0]["Num"] == 0
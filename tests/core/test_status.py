@@ -0,0 +1,42 @@
+import pytest
+import os
+import socket
+from unittest.mock import MagicMock
+from core.status import StatusPublisher, start_status_server, stop_status_server  # type: ignore
+
+
+def test_status_is_only_written_when_it_changes(tmp_path):
+    status_path = str(tmp_path / "status" / "status_cam.txt")
+    publisher = StatusPublisher(status_path)
+    assert publisher.publish("ready")
+    inode = os.stat(status_path).st_ino
+    assert not publisher.publish("ready")
+    assert os.stat(status_path).st_ino == inode  # Not rewritten.
+    assert publisher.publish("video")
+    assert open(status_path).read() == "video"
+    assert os.listdir(os.path.dirname(status_path)) == ["status_cam.txt"]
+    assert publisher.transitions == 2
+
+
+def test_status_socket_pushes_each_change(tmp_path):
+    cam = MagicMock()
+    cam.config = {"status_socket": str(tmp_path / "status.sock")}
+    cam.status_publisher = StatusPublisher(str(tmp_path / "status_cam.txt"))
+    cam.status_publisher.publish("ready")
+    server = start_status_server(cam)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.settimeout(2)
+    client.connect(cam.config["status_socket"])
+    lines = client.makefile("rb")
+    try:
+        status, changed_at = lines.readline().split()
+        assert status == b"ready"
+        assert float(changed_at) == pytest.approx(cam.status_publisher.changed_at)
+        cam.status_publisher.publish("video")
+        cam.status_publisher.publish("ready")
+        assert lines.readline().split()[0] == b"video"
+        assert lines.readline().split()[0] == b"ready"
+    finally:
+        client.close()
+        stop_status_server(cam, server)
+    assert not os.path.exists(cam.config["status_socket"])
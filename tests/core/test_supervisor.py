@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from core import process  # type: ignore
+from core.camera_paths import camera_paths, select_cameras  # type: ignore
+from core.model import CameraCoreModel  # type: ignore
+from core.supervisor import CameraSupervisor, combined_status  # type: ignore
+
+
+def test_each_camera_gets_its_own_files():
+    config = CameraCoreModel.default_config()
+    config["preview_stream"] = "8080"
+    config["metrics_socket"] = "127.0.0.1:9100"
+    paths = camera_paths(config, 1)
+    assert paths["control_file"] == "/tmp/FIFO_cam1"
+    assert paths["status_file"] == "/tmp/status_cam_cam1.txt"
+    assert paths["status_socket"] == "/tmp/status_cam_cam1.sock"
+    assert paths["video_output_path"] == "/tmp/media/cam1/vi_%v_%Y%M%D_%h%m%s.mp4"
+    assert paths["preview_stream"] == "8081"
+    assert paths["metrics_socket"] == "127.0.0.1:9101"
+    assert "media_index" not in paths  # Defaults to the camera's own video folder.
+
+
+def test_cameras_are_selected_from_those_attached():
+    attached = [{"Num": 0}, {"Num": 1}]
+    assert select_cameras(None, attached) == [0]
+    assert select_cameras("all", attached) == [0, 1]
+    assert select_cameras("1, 2", attached) == [1]
+
+
+def test_combined_status_shows_the_busiest_camera():
+    assert combined_status(["ready", "video"]) == "video"
+    assert combined_status(["md_ready", "ready"]) == "md_ready"
+    assert combined_status(["video", "Error: frame capture failed"]).startswith("Error")
+    assert combined_status([None, "halted"]) == "halted"
+
+
+def test_commands_are_routed_by_camera_number(tmp_path):
+    config = CameraCoreModel.default_config()
+    config["control_file"] = str(tmp_path / "FIFO")
+    supervisor = CameraSupervisor(None, "simulated", [0, 1], config)
+    fds = {}
+    for num, paths in supervisor.cameras.items():
+        os.mkfifo(paths["control_file"])
+        fds[num] = os.open(paths["control_file"], os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        supervisor.route(b"1:ca 1\nim\nru")  # 'ru' isn't finished yet.
+        assert os.read(fds[0], 256) == b"im\n"
+        assert os.read(fds[1], 256) == b"ca 1\nim\n"
+        supervisor.route(b" 0\n")
+        assert os.read(fds[0], 256) == b"ru 0\n"
+    finally:
+        for fd in fds.values():
+            os.close(fd)
+
+
+def test_commands_for_a_busy_camera_are_dropped_whole(tmp_path):
+    config = CameraCoreModel.default_config()
+    config["control_file"] = str(tmp_path / "FIFO")
+    supervisor = CameraSupervisor(None, "simulated", [0], config)
+    path = supervisor.cameras[0]["control_file"]
+    os.mkfifo(path)
+    fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    try:
+        # Far more than the pipe holds, without the camera reading any.
+        supervisor.route(b"".join(b"tv %d\n" % i for i in range(100000)))
+        received = b""
+        while True:
+            try:
+                data = os.read(fd, 65536)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            received += data
+        lines = received.split(b"\n")
+        assert lines.pop() == b""  # Ends on a whole command.
+        assert lines == [b"tv %d" % i for i in range(len(lines))]
+    finally:
+        os.close(fd)
+
+
+CONFIG = """
+status_file {tmp}/status_cam.txt
+control_file {tmp}/FIFO
+motion_pipe {tmp}/motionFIFO
+fifo_interval
+preview_path {tmp}/preview/cam_preview.jpg
+media_path {tmp}/media
+image_path {tmp}/media/im_%i.jpg
+lapse_path {tmp}/media/tl_%i_%t.jpg
+video_path {tmp}/media/vi_%v.mp4
+width
+video_width
+video_height
+video_bitrate
+motion_external
+motion_threshold
+motion_initframes
+motion_startframes
+motion_stopframes
+autostart standard
+motion_detection
+user_config {tmp}/uconfig
+log_file {tmp}/scheduleLog.txt
+log_size
+motion_logfile {tmp}/motionLog.txt
+"""
+
+
+def wait_for(condition, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+
+def test_crashed_camera_is_started_again_with_backoff(tmp_path, monkeypatch):
+    # Every setting a camera process reads from its config file.
+    config_path = tmp_path / "raspimjpeg"
+    config_path.write_text(CONFIG.format(tmp=tmp_path))
+    for log in ["scheduleLog.txt", "motionLog.txt"]:
+        (tmp_path / log).touch()
+    monkeypatch.setattr(CameraSupervisor, "RESTART_DELAY", 0.2)
+    config = CameraCoreModel.load_config(str(config_path))
+    supervisor = CameraSupervisor([str(config_path)], "simulated", [0, 1], config)
+    runner = threading.Thread(target=supervisor.run)
+    runner.start()
+    try:
+        wait_for(lambda: supervisor.statuses[1] == "ready")
+        supervisor._processes[1].kill()
+        wait_for(lambda: supervisor.restarts[1] == 1)
+        assert supervisor._delays[1] == 0.4  # Doubled for the next failure.
+        wait_for(lambda: supervisor.statuses[1] == "ready")
+        assert supervisor.restarts[0] == 0
+        assert open(config["status_file"]).read() == "ready"
+    finally:
+        process.stop_process()
+        runner.join(60)
+    assert not runner.is_alive()
+    assert open(config["status_file"]).read() == "halted"
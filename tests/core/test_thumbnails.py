@@ -0,0 +1,18 @@
+import os
+from PIL import Image
+from core.thumbnails import ThumbnailWriter  # type: ignore
+
+
+def test_thumbnails_are_written_whole_in_the_background(tmp_path):
+    writer = ThumbnailWriter((64, 36))
+    image = writer.make(Image.new("RGB", (640, 480), (200, 20, 20)))
+    assert image.size == (48, 36)  # Fits the size, keeping the aspect ratio.
+    image_path = str(tmp_path / "im.jpg.i1.th.jpg")
+    video_path = str(tmp_path / "vi.mp4.v1.th.jpg")
+    writer.submit(image_path, image)
+    writer.submit(video_path, b"\xff\xd8preview\xff\xd9")
+    writer.stop()
+    assert Image.open(image_path).size == (48, 36)
+    assert open(video_path, "rb").read() == b"\xff\xd8preview\xff\xd9"
+    assert sorted(os.listdir(tmp_path)) == ["im.jpg.i1.th.jpg", "vi.mp4.v1.th.jpg"]
+    assert writer.stats() == {"depth": 0, "written": 2, "failed": 0}
@@ -0,0 +1,57 @@
+import itertools
+from utilities.burst import BurstCapture, parse_burst  # type: ignore
+
+
+def test_parse_burst():
+    assert parse_burst("") is None
+    assert parse_burst("5") == (5, 0.0)
+    assert parse_burst("3 250") == (3, 0.25)
+
+
+RAW_STREAM = {"raw": {"size": (64, 48), "format": "SBGGR10"}}
+
+
+def make_cam(simulated_cam, free_buffers):
+    config = {"burst_buffers": 4, "image_output_path": "im_%i.jpg"}
+    cam = simulated_cam(RAW_STREAM, config, framerate=100.0)
+    cam.burst_ring = None
+    indexes = itertools.count(1)
+    cam.claim_image.side_effect = lambda name: ("im_%d.jpg" % next(indexes), 0)
+    jobs = []
+
+    def submit(job, bounded=True):
+        jobs.append(job)
+        if free_buffers:
+            job.drop_raw()  # Saved straight away, freeing its ring buffer.
+
+    cam.still_worker.submit.side_effect = submit
+    return cam, jobs
+
+
+def run_burst(cam, count, interval=0.0):
+    burst = BurstCapture(cam, count, interval)
+    burst.start()
+    burst.join()
+    return burst
+
+
+def test_burst_captures_into_ring_buffers(simulated_cam):
+    cam, jobs = make_cam(simulated_cam, free_buffers=True)
+    burst = run_burst(cam, 6)
+    assert burst.captured == 6
+    assert [job.image_path for job in jobs] == ["im_%d.jpg" % i for i in range(1, 7)]
+    # Every frame went through the same few preallocated buffers.
+    assert len(set(id(job.raw) for job in jobs)) == 1
+    assert len(set(id(buffer) for buffer in cam.burst_ring.buffers)) == 4
+    assert 50 < burst.fps < 150
+    cam.still_worker.hold.assert_called_once()
+    cam.still_worker.unhold.assert_called_once()
+
+
+def test_burst_drops_shots_when_ring_is_full(simulated_cam):
+    cam, jobs = make_cam(simulated_cam, free_buffers=False)
+    burst = run_burst(cam, 6, interval=0.02)
+    # Nothing was saved, so only 4 buffers' worth of shots could be taken.
+    assert burst.captured == 4
+    assert burst.dropped == 2
+    assert cam.burst_ring.free() == 0
@@ -0,0 +1,69 @@
+import threading
+from unittest.mock import MagicMock, patch
+from utilities.capture import (  # type: ignore
+    StillJob,
+    StillWorker,
+    capture_still_request,
+)
+
+
+def test_still_worker_is_bounded_and_tracks_status():
+    cam = MagicMock()
+    cam.capturing_still = False
+    cam.config = {"raw_develop_threads": 1, "raw_tile_rows": 128}
+    on_change = MagicMock()
+    release = threading.Event()
+
+    def slow_save(cam, job, developer):
+        release.wait(5)
+        job.timings["save"] = 0.01
+
+    with patch("utilities.capture.save_still", side_effect=slow_save):
+        raw_config = {"size": (4, 4), "format": "SBGGR10"}
+        worker = StillWorker(cam, workers=1, max_pending=2, on_change=on_change)
+        jobs = [StillJob("im_%d.jpg" % i, i, None, raw_config, {}) for i in range(3)]
+        assert worker.submit(jobs[0])
+        assert worker.submit(jobs[1])
+        # The queue is full, so the third still is dropped instead of waiting.
+        assert not worker.submit(jobs[2])
+        assert cam.capturing_still
+        assert worker.stats()["depth"] == 2
+        release.set()
+        worker.stop()
+
+    stats = worker.stats()
+    assert stats["depth"] == 0
+    assert stats["completed"] == 2
+    assert stats["rejected"] == 1
+    assert stats["mean_ms"]["save"] == 10.0
+    # 'image' status only while stills are unsaved: set once, cleared once.
+    assert not cam.capturing_still
+    assert on_change.call_count == 2
+
+
+def test_dropped_still_does_not_use_an_image_index():
+    cam = MagicMock()
+    cam.capturing_still = False
+    cam.config = {
+        "raw_develop_threads": 1,
+        "raw_tile_rows": 128,
+        "image_output_path": "im_%i.jpg",
+    }
+    cam.picam2.camera_configuration.return_value = {
+        "raw": {"size": (4, 4), "format": "SBGGR10"}
+    }
+    cam.claim_image.return_value = ("im_0000.jpg", 0)
+    release = threading.Event()
+
+    with patch("utilities.capture.save_still", side_effect=lambda *a: release.wait(5)):
+        cam.still_worker = StillWorker(cam, workers=1, max_pending=1)
+        capture_still_request(cam)
+        capture_still_request(cam)  # The queue is full, so this still is dropped.
+        release.set()
+        cam.still_worker.stop()
+
+    assert cam.claim_image.call_count == 1
+    stats = cam.still_worker.stats()
+    assert stats["completed"] == 1
+    assert stats["rejected"] == 1
+    assert cam.frame_hub.next_frame.return_value.release.call_count == 2
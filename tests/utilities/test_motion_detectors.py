@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from utilities.motion_detectors import (  # type: ignore
+    BackgroundMotionDetector,
+    MotionDetector,
+    MSEMotionDetector,
+    make_motion_detector,
+)
+
+CONFIG = {
+    "motion_detector": "background",
+    "motion_decimation": 1,
+    "motion_block_size": 0,
+    "motion_noise_floor": 6,
+    "motion_background_rate": 0.05,
+}
+
+
+def test_background_detector_ignores_flicker_and_noise():
+    rng = np.random.default_rng(0)
+    base = np.full((24, 32), 100, dtype=np.int16)
+    detector = make_motion_detector(CONFIG, 32, 24)
+    assert isinstance(detector, BackgroundMotionDetector)
+    mse = MSEMotionDetector(32, 24, CONFIG)
+    for i in range(10):
+        # Flicker of +/-5 levels plus a little noise, but nothing moving.
+        frame = base + (5 if i % 2 else -5) + rng.integers(-2, 3, base.shape)
+        frame = frame.astype(np.uint8)
+        score, mse_score = detector.detect(frame), mse.detect(frame)
+    assert score < 1.0
+    assert mse_score > 7.0
+
+    moved = frame.copy()
+    moved[8:16, 8:16] = 250
+    assert detector.detect(moved) > 7.0
+
+
+def test_half_implemented_detector_fails_when_created():
+    class DetectOnly(MotionDetector):
+        def detect(self, y_plane):
+            return 0.0
+
+    with pytest.raises(TypeError):
+        DetectOnly(32, 24, CONFIG)
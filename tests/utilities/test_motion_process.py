@@ -0,0 +1,57 @@
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+from core.model import CameraCoreModel  # type: ignore
+from utilities.motion_detectors import make_motion_detector  # type: ignore
+from utilities.motion_process import MotionProcess  # type: ignore
+
+
+def test_worker_scores_match_in_process_scores():
+    config = CameraCoreModel.default_config()
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 255, (48, 64), dtype=np.uint8) for _ in range(6)]
+    local = make_motion_detector(config, 64, 48)
+    expected = [local.detect(frame) for frame in frames][1:]
+
+    detector = MotionProcess(64, 48, config)
+    try:
+        scores = []
+        for frame in frames:
+            scores.append(detector.detect(frame))
+            assert detector.wait(timeout=10)
+        scores.append(detector.detect(frames[0]))  # Returns the last frame's score.
+        # Each call returns the score of the frame before, the first has none.
+        assert scores[:2] == [None, None]
+        assert scores[2:] == pytest.approx(expected)
+        assert detector.dropped == 0
+    finally:
+        detector.close()
+
+
+def test_scoring_falls_back_in_process_when_the_worker_dies():
+    config = CameraCoreModel.default_config()
+    frame = np.zeros((48, 64), dtype=np.uint8)
+    detector = MotionProcess(64, 48, config)
+    try:
+        detector.detect(frame)
+        assert detector.wait(timeout=10)
+        detector._process.kill()
+        detector._process.join()
+        for _ in range(3):
+            detector.detect(frame)  # Fails over once the pipe is found closed.
+            if detector._local:
+                break
+        assert detector._local is not None
+        assert detector.stats()["in_process"]
+        detector.detect(frame)
+        assert detector.detect(frame) == 0.0  # Scored in this process.
+
+        # Each reset reaches the in-process detector, not only the first.
+        with patch.object(detector._local, "reset") as local_reset:
+            detector.reset()
+            detector.detect(frame)
+            detector.reset()
+            assert local_reset.call_count == 2
+    finally:
+        detector.close()
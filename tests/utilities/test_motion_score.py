@@ -0,0 +1,38 @@
+import numpy as np
+from utilities.motion_score import MotionScorer  # type: ignore
+
+
+def test_motion_score_is_exact_mse():
+    rng = np.random.default_rng(1)
+    cur = rng.integers(0, 256, (24, 32), dtype=np.uint8)
+    prev = rng.integers(0, 256, (24, 32), dtype=np.uint8)
+    expected = np.square(cur.astype(np.int64) - prev).mean()
+
+    scorer = MotionScorer(32, 24)
+    assert scorer.score(cur, prev) == expected
+    # Negative differences must not wrap around.
+    assert scorer.score(np.zeros_like(cur), np.full_like(prev, 10)) == 100.0
+    # Scoring through update() gives the same result.
+    assert scorer.update(prev) is None
+    assert scorer.update(cur) == expected
+
+
+def test_motion_score_blocks_and_decimation():
+    prev = np.zeros((16, 16), dtype=np.uint8)
+    cur = prev.copy()
+    cur[:8, :8] = 20  # Motion in the top-left block only.
+
+    scorer = MotionScorer(16, 16, block_size=8)
+    assert scorer.score(cur, prev) == 100.0
+    assert scorer.block_scores.tolist() == [[400.0, 0.0], [0.0, 0.0]]
+    assert scorer.max_block_score() == 400.0
+
+    decimated = MotionScorer(16, 16, decimation=2)
+    assert decimated.shape == (8, 8)
+    assert decimated.score(cur, prev) == 100.0
+
+    # Blocks larger than the frame are shrunk to the whole frame.
+    oversized = MotionScorer(16, 16, decimation=2, block_size=300)
+    assert oversized.blocks == (1, 1)
+    oversized.score(cur, prev)
+    assert oversized.max_block_score() == 100.0
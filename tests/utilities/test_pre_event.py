@@ -0,0 +1,53 @@
+from unittest.mock import MagicMock
+from utilities.pre_event import PreEventBuffer  # type: ignore
+
+
+def feed(buffer, start, count, iperiod=5, size=10):
+    """Feeds frames 100ms apart, numbering each frame in its payload."""
+    for n in range(start, start + count):
+        frame = n.to_bytes(2, "big") + bytes(size - 2)
+        buffer.outputframe(frame, n % iperiod == 0, n * 100000)
+
+
+def written(sink):
+    return [
+        (int.from_bytes(c.args[0][:2], "big"), c.args[1])
+        for c in sink.outputframe.call_args_list
+    ]
+
+
+def test_buffer_keeps_whole_gops_covering_the_span():
+    buffer = PreEventBuffer(1.0, 1000000)
+    feed(buffer, 1, 24)  # Frames 1-24, keyframes every 5th.
+    # Frame 24 is at 2.4s, so 1.4s onwards is needed, from the keyframe at 1.0s.
+    sink = MagicMock()
+    buffer.start_recording(sink)
+    frames = written(sink)
+    assert frames[0] == (10, True)
+    assert [n for n, _ in frames] == list(range(10, 25))
+    assert buffer.discarded == 4  # Frames 1-4 came before any keyframe.
+    assert buffer.flushed == (1.4, 150)
+    # Live frames carry on straight after the buffered ones.
+    feed(buffer, 25, 5)
+    assert [n for n, _ in written(sink)][-6:] == list(range(24, 30))
+    buffer.stop_recording()
+    sink.stop.assert_called_once()
+    assert not buffer.recording
+
+
+def test_recording_thumbnail_is_kept_from_its_first_keyframe():
+    snapshots = iter(range(100))
+    buffer = PreEventBuffer(1.0, 1000000, snapshot=lambda: next(snapshots))
+    feed(buffer, 1, 24)  # Keyframes at 5, 10, 15 and 20 get snapshots 0-3.
+    buffer.start_recording(MagicMock())
+    assert buffer.first_snapshot == 1  # The recording starts from frame 10.
+
+
+def test_buffer_stays_under_max_bytes():
+    buffer = PreEventBuffer(10.0, 120)
+    feed(buffer, 0, 23)
+    # Only the last two GOPs (frames 15-22) fit within 120 bytes.
+    assert buffer.stats()["bytes"] == 80
+    sink = MagicMock()
+    buffer.start_recording(sink)
+    assert [n for n, _ in written(sink)] == list(range(15, 23))
@@ -0,0 +1,77 @@
+import io
+import os
+
+import numpy as np
+from PIL import Image
+from unittest.mock import MagicMock
+from utilities.preview import PreviewScheduler, encode_lores_jpeg  # type: ignore
+
+
+def make_scheduler(tmp_path, idle_timeout=10.0):
+    cam = MagicMock()
+    cam.config = {
+        "preview_path": str(tmp_path / "cam_preview.jpg"),
+        "preview_fps": 10.0,
+        "preview_idle_fps": 1.0,
+        "preview_idle_timeout": idle_timeout,
+        "preview_skip_threshold": 1.0,
+        "preview_file": True,
+    }
+    cam.picam2.camera_configuration.return_value = {"lores": {"size": (32, 24)}}
+    return PreviewScheduler(cam)
+
+
+def make_request(value):
+    request = MagicMock()
+    # YUV420 with rows padded to 64 bytes for the 32x24 lores stream. The
+    # padding holds junk, which must not count as a change.
+    yuv = np.random.default_rng().integers(0, 256, (24 * 3 // 2, 64), np.uint8)
+    yuv[:24, :32] = value
+    request.make_array.return_value = yuv
+    return request
+
+
+def test_preview_scheduler_skips_unchanged_frames(tmp_path):
+    scheduler = make_scheduler(tmp_path)
+    first = make_request(100)
+    assert scheduler.should_publish(first)
+    scheduler.mark_published(first)
+    assert not scheduler.should_publish(make_request(100))
+    assert scheduler.should_publish(make_request(150))
+    assert scheduler.stats()["skipped_unchanged"] == 1
+    # The rate is capped at preview_fps.
+    assert 0 < scheduler.time_until_due() <= 0.1
+
+
+def test_preview_scheduler_backs_off_when_idle(tmp_path):
+    scheduler = make_scheduler(tmp_path, idle_timeout=0.01)
+    scheduler.last_activity -= 1
+    # No read seen yet, as on a noatime mount, so it can't tell it is idle.
+    assert scheduler.interval(scheduler.last_activity + 1) == 0.1
+    assert not scheduler.idle
+    preview = tmp_path / "cam_preview.jpg"
+    preview.write_bytes(b"jpeg")
+    mtime = os.stat(preview).st_mtime_ns
+    os.utime(preview, ns=(mtime + 1000000, mtime))  # Read after it was written.
+    scheduler.interval(scheduler.last_activity + 3)  # Past the next read check.
+    assert scheduler.reads_seen
+    scheduler.last_activity -= 1
+    assert scheduler.interval(scheduler.last_activity + 1) == 1.0
+    assert scheduler.idle
+    scheduler.heartbeat()
+    assert scheduler.interval(scheduler.last_activity) == 0.1
+
+
+def test_encode_lores_jpeg_is_preview_sized():
+    cam = MagicMock()
+    cam.picam2.options = {"quality": 80}
+    request = MagicMock()
+    # 24 rows, then 18 (not a multiple of 4, so the chroma planes start and
+    # end mid-row), each with a row stride of 64 bytes for a 32 pixel width.
+    for height in [24, 18]:
+        lores = {"lores": {"size": (32, height)}}
+        cam.picam2.camera_configuration.return_value = lores
+        request.make_array.return_value = np.full((height * 3 // 2, 64), 128, np.uint8)
+        image = Image.open(io.BytesIO(encode_lores_jpeg(cam, request)))
+        assert image.format == "JPEG"
+        assert image.size == (32, height)
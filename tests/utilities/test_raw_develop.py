@@ -0,0 +1,52 @@
+import numpy as np
+from utilities.raw_develop import (  # type: ignore
+    RawDeveloper,
+    parse_raw_format,
+    unpack_rows,
+)
+
+METADATA = {
+    "SensorBlackLevels": (64 << 6,) * 4,
+    "ColourGains": (2.0, 1.5),
+    "ColourCorrectionMatrix": (1, 0, 0, 0, 1, 0, 0, 0, 1),
+}
+
+
+def make_grey_raw(width, height, level):
+    """SBGGR10 raw of a grey scene, with the white balance gains undone."""
+    raw = np.full((height, width), 64 + level, dtype=np.uint16)
+    raw[0::2, 0::2] = 64 + level / 1.5  # Blue
+    raw[1::2, 1::2] = 64 + level / 2.0  # Red
+    return raw.view(np.uint8)
+
+
+def test_parse_raw_format():
+    assert parse_raw_format("SBGGR10") == ("BGGR", 10, False)
+    assert parse_raw_format("SRGGB12_CSI2P") == ("RGGB", 12, True)
+
+
+def test_unpack_csi2_packed_rows():
+    pixels = np.array([[1023, 0, 512, 3, 7, 100, 1000, 256]], dtype=np.uint16)
+    packed = np.zeros((1, 10), dtype=np.uint8)
+    for group in range(2):
+        values = pixels[0].reshape(2, 4)[group]
+        packed[0].reshape(2, 5)[group, :4] = values >> 2
+        packed[0, 5 * group + 4] = sum((v & 3) << (2 * i) for i, v in enumerate(values))
+    assert (unpack_rows(packed, 8, 10, True) == pixels).all()
+
+
+def test_develop_grey_is_neutral_and_tiles_are_seamless():
+    raw = make_grey_raw(64, 48, 480)
+    whole = RawDeveloper(threads=1, tile_rows=48).develop(
+        raw, 64, 48, "SBGGR10", METADATA
+    )
+    developer = RawDeveloper(threads=3, tile_rows=6)
+    tiled = developer.develop(raw, 64, 48, "SBGGR10", METADATA)
+    developer.close()
+    assert whole.shape == (48, 64, 3)
+    # White balance makes the grey scene grey again, at about half brightness.
+    centre = whole[4:-4, 4:-4].reshape(-1, 3)
+    assert np.ptp(centre, axis=0).max() <= 1
+    assert abs(int(centre[:, 0].mean()) - int(centre[:, 2].mean())) <= 1
+    assert 150 < centre.mean() < 210
+    assert (tiled == whole).all()
@@ -0,0 +1,40 @@
+import os
+from unittest.mock import MagicMock
+from utilities.remux import RemuxPool, pts_path, read_framerate  # type: ignore
+
+
+def make_recording(tmp_path, name, times):
+    raw_path = str(tmp_path / (name + ".h264"))
+    with open(raw_path, "wb") as f:
+        f.write(b"\x00\x00\x00\x01")
+    with open(pts_path(raw_path), "w") as f:
+        f.write("# timecode format v2\n")
+        f.writelines("%.3f\n" % t for t in times)
+    return raw_path, str(tmp_path / (name + ".mp4"))
+
+
+def test_framerate_comes_from_the_timestamps(tmp_path):
+    raw_path, _ = make_recording(tmp_path, "vi", [1000.0, 1040.0, 1080.0, 1120.0])
+    assert read_framerate(pts_path(raw_path)) == 25.0
+
+
+def test_queued_recordings_carry_on_after_a_restart(tmp_path):
+    queue_path = str(tmp_path / "queue.txt")
+    left_over = make_recording(tmp_path, "vi_1", [0.0, 50.0, 100.0])
+    with open(queue_path, "w") as f:
+        f.write("%s\t%s\n" % left_over)
+        f.write("%s\t%s\n" % (str(tmp_path / "gone.h264"), "gone.mp4"))
+    cam = MagicMock()
+    pool = RemuxPool(cam, 1, queue_path)
+    new = make_recording(tmp_path, "vi_2", [0.0, 100.0, 200.0])
+    pool.submit(*new)
+    pool.stop()
+    # The recording that no longer exists is skipped.
+    assert [c.args for c in cam.backend.remux.call_args_list] == [
+        left_over + (20.0,),
+        new + (10.0,),
+    ]
+    assert pool.stats() == {"depth": 0, "completed": 2, "failed": 0}
+    assert open(queue_path).read() == ""
+    assert not os.path.exists(left_over[0])
+    assert not os.path.exists(pts_path(new[0]))
@@ -0,0 +1,40 @@
+from unittest.mock import MagicMock
+from utilities.segments import SegmentedOutput  # type: ignore
+
+
+def test_segments_roll_over_on_keyframes_without_losing_frames():
+    files = {}
+    finished = []
+    names = iter(range(2, 10))
+
+    def file_output(path):
+        files[path] = MagicMock()
+        return files[path]
+
+    def next_paths():
+        n = next(names)
+        return ("vi_%d.mp4" % n, "vi_%d.h264" % n)
+
+    output = SegmentedOutput(
+        file_output,
+        ("vi_1.mp4", "vi_1.h264"),
+        next_paths,
+        lambda *segment: finished.append(segment),
+        max_seconds=1.0,
+        max_bytes=600,
+    )
+    output.start()
+    # 10 fps, keyframes every 4th frame, 50 bytes a frame.
+    for n in range(20):
+        output.outputframe(bytes(50), n % 4 == 0, n * 100000)
+    output.stop()
+    frames = {
+        path: [c.args[2] // 100000 for c in f.outputframe.call_args_list]
+        for path, f in files.items()
+    }
+    # A second's worth is reached at frame 10, but the split waits for frame 12.
+    assert frames["vi_1.h264"] == list(range(12))
+    # The next reaches 600 bytes at frame 24, so finishes with the recording.
+    assert frames["vi_2.h264"] == list(range(12, 20))
+    assert finished == [("vi_1.mp4", "vi_1.h264"), ("vi_2.mp4", "vi_2.h264")]
+    assert all(f.stop.call_count == 1 for f in files.values())
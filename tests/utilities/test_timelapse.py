@@ -0,0 +1,87 @@
+import threading
+import time
+from unittest.mock import MagicMock
+from core.frame_hub import FrameSubscription  # type: ignore
+from utilities.timelapse import (  # type: ignore
+    Timelapse,
+    start_timelapse,
+    stop_timelapse,
+)
+
+
+def make_cam(simulated_cam, save_time):
+    config = {"lapse_output_path": "tl_%i_%t.jpg"}
+    cam = simulated_cam({"main": {"size": (64, 48)}}, config, framerate=100.0)
+    cam.claim_image.return_value = ("tl_0007_0000.jpg", 7)
+    cam.make_filename.side_effect = lambda name, i, t: "tl_%04d_%04d.jpg" % (i, t)
+    saved = []
+
+    def save(image, metadata, path):
+        time.sleep(save_time)
+        saved.append((path, image.size))
+
+    cam.picam2.helpers.save = save
+    return cam, saved
+
+
+def drain(cam, frames):
+    """Stands in for motion detection, taking every frame as it arrives."""
+    while not cam.stop_event.is_set():
+        frame = frames.get(timeout=0.1)
+        if frame is not None:
+            frame.release()
+
+
+def test_timelapse_keeps_to_schedule_while_saving_is_slow(simulated_cam):
+    # Saving takes longer than the interval, but is off the schedule's thread.
+    cam, saved = make_cam(simulated_cam, save_time=0.06)
+    motion = cam.frame_hub.subscribe("motion", FrameSubscription.QUEUE, maxlen=2)
+    consumer = threading.Thread(target=drain, args=(cam, motion))
+    consumer.start()
+    timelapse = Timelapse(cam, 0.05, max_pending=10)
+    try:
+        timelapse.start()
+        time.sleep(0.52)
+    finally:
+        timelapse.stop()
+        cam.stop_event.set()
+        consumer.join()
+    # Frames due at 0, 0.05, ... 0.5 seconds.
+    assert 10 <= timelapse.frames + timelapse.skipped <= 12
+    assert timelapse.skipped <= 1
+    assert timelapse.max_late < 0.05
+    assert timelapse.saved == timelapse.frames
+    assert saved[0] == ("tl_0007_0001.jpg", (64, 48))
+    assert saved[-1][0] == "tl_0007_%04d.jpg" % timelapse.frames
+    # One thumbnail for the whole sequence.
+    cam.generate_thumbnail.assert_called_once()
+    assert cam.generate_thumbnail.call_args.args[:3] == ("t", "tl_0007_0001.jpg", 7)
+    assert cam.generate_thumbnail.call_args.args[3].size == (64, 48)
+    # The camera kept its frame rate, and motion detection missed nothing.
+    assert cam.frame_hub.captured >= 40
+    assert motion.dropped == 0
+
+
+def test_timelapse_ended_by_the_camera_halting_clears_its_status(simulated_cam):
+    cam, saved = make_cam(simulated_cam, save_time=0)
+    cam.config["timelapse_interval"] = 0.05
+    cam.timelapse = None
+    on_change = MagicMock()
+    timelapse = start_timelapse(cam, on_change=on_change)
+    assert cam.timelapse_on
+    time.sleep(0.2)
+    cam.stop_event.set()  # Halted with 'ru 0', or frame capture failed.
+    for thread in timelapse._threads:
+        thread.join(5)
+    assert not timelapse.running
+    assert not cam.timelapse_on
+    on_change.assert_called_once_with(cam)
+    assert saved
+
+    # Stopped with 'tl 0', the command loop updates the status itself.
+    cam.stop_event.clear()
+    timelapse = start_timelapse(cam, on_change=on_change)
+    time.sleep(0.1)
+    stop_timelapse(cam)
+    assert not cam.timelapse_on
+    assert on_change.call_count == 1